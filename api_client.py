@@ -0,0 +1,77 @@
+"""Client for api_server.py with the same interface as an in-process TurnHandle"""
+import base64
+import json
+import logging
+
+import requests
+
+from turn_pipeline import event_from_json
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteTurn:
+    """A turn streamed from POST /v1/chat; iterate its events, or cancel it"""
+
+    def __init__(self, base_url, history, state, question=None, audio=None, voice=None,
+                 top_k=3, min_similarity=0.0, search_mode=None, temperature=0.7, session=None,
+                 timeout=(3.05, 300)):
+        payload = {
+            # Only role and content travel; metrics and traces stay with the client
+            "history": [{"role": message["role"], "content": message["content"]} for message in history],
+            "state": state,
+            "question": question,
+            "audio": base64.b64encode(audio).decode("ascii") if audio is not None else None,
+            "voice": voice,
+            "top_k": top_k,
+            "min_similarity": min_similarity,
+            "search_mode": search_mode,
+            "temperature": temperature,
+        }
+        self._response = None
+        self._error = None
+        try:
+            self._response = (session or requests).post(f"{base_url.rstrip('/')}/v1/chat", json=payload,
+                                                        stream=True, timeout=timeout)
+            if self._response.status_code != 200:
+                self._error = f"Chat service returned {self._response.status_code}: {self._response.text}"
+        except requests.RequestException as e:
+            self._error = f"Chat service unreachable: {str(e)}"
+
+    def events(self):
+        if self._error:
+            logger.error(self._error)
+            yield {"type": "error", "message": self._error}
+            return
+        try:
+            for line in self._response.iter_lines():
+                if line:
+                    yield event_from_json(json.loads(line))
+        except requests.RequestException as e:
+            logger.error(f"Chat stream broke: {str(e)}")
+            yield {"type": "error", "message": f"Chat stream broke: {str(e)}"}
+
+    def cancel(self):
+        """Close the stream; the server cancels the turn when the client goes away"""
+        if self._response is not None:
+            self._response.close()
+
+
+def transcribe(base_url, audio_bytes, session=None, timeout=(3.05, 60)):
+    """Text of a WAV recording from POST /v1/transcribe, or None when it could not be transcribed"""
+    try:
+        response = (session or requests).post(f"{base_url.rstrip('/')}/v1/transcribe", data=audio_bytes,
+                                              headers={"Content-Type": "audio/wav"}, timeout=timeout)
+    except requests.RequestException as e:
+        logger.error(f"Chat service unreachable: {str(e)}")
+        return None
+    if response.status_code != 200:
+        logger.error(f"Transcription failed with {response.status_code}: {response.text}")
+        return None
+    return response.json().get("text")
+
+
+def fetch_stats(base_url, session=None, timeout=5):
+    response = (session or requests).get(f"{base_url.rstrip('/')}/v1/stats", timeout=timeout)
+    response.raise_for_status()
+    return response.json()
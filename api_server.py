@@ -0,0 +1,221 @@
+"""HTTP/WebSocket API serving the chat engine
+
+    uvicorn api_server:app --host 0.0.0.0 --port 8000 --workers 4
+
+Workers are stateless: clients send the conversation (and the history state
+returned by the previous turn) with every request, so any worker can serve
+any turn and workers can be added behind a load balancer.
+
+    POST /v1/chat         turn events as newline-delimited JSON
+    WS   /v1/chat/ws      turn events as JSON messages, tagged with the request id;
+                          a new request or {"type": "cancel"} cancels the running turn
+    POST /v1/search       retrieved documents
+    POST /v1/transcribe   raw audio body -> {"text"}
+    POST /v1/tts          {"text", "voice"} -> audio/wav
+    GET  /v1/stats        cache, client and store statistics
+    GET  /metrics         Prometheus text format
+    GET  /healthz
+"""
+import asyncio
+import base64
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Literal, Optional
+
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+
+import chat_engine
+from telemetry import REGISTRY
+from turn_pipeline import event_to_json
+
+logger = logging.getLogger(__name__)
+
+# Turns generating at once in this worker; more wait up to API_QUEUE_TIMEOUT seconds, then get a 503
+MAX_CONCURRENT_TURNS = int(os.getenv("API_MAX_CONCURRENT_TURNS", "8"))
+QUEUE_TIMEOUT = float(os.getenv("API_QUEUE_TIMEOUT", "10"))
+
+
+class Message(BaseModel):
+    role: str
+    content: str
+
+
+class TurnRequest(BaseModel):
+    id: Optional[str] = Field(None, description="Echoed as \"turn\" on every WebSocket event")
+    question: Optional[str] = None
+    audio: Optional[str] = Field(None, description="Base64 recording, transcribed when no question is given")
+    history: list[Message] = []
+    state: dict = {}
+    voice: Optional[str] = None
+    top_k: int = Field(3, ge=1, le=50)
+    min_similarity: float = 0.0
+    search_mode: Optional[Literal["vector", "hybrid"]] = None
+    temperature: float = 0.7
+
+    def turn(self):
+        """Keyword arguments for TurnPipeline.run"""
+        return {
+            "history": [message.model_dump() for message in self.history],
+            "state": dict(self.state),
+            "question": self.question,
+            "audio": base64.b64decode(self.audio) if self.audio and not self.question else None,
+            "voice": self.voice,
+            "top_k": self.top_k,
+            "min_similarity": self.min_similarity,
+            "search_mode": self.search_mode,
+            "temperature": self.temperature,
+            "model_key": chat_engine.model_key(self.temperature),
+        }
+
+
+class SearchRequest(BaseModel):
+    query: str
+    top_k: int = Field(3, ge=1, le=50)
+    min_similarity: float = 0.0
+    search_mode: Optional[Literal["vector", "hybrid"]] = None
+
+
+class SpeechRequest(BaseModel):
+    text: str
+    voice: str = "alloy"
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Build models, pools and stores before taking traffic rather than on the first request
+    await asyncio.to_thread(chat_engine.init_turn_pipeline)
+    await asyncio.to_thread(chat_engine.warm_retrieval)
+    app.state.turn_slots = asyncio.Semaphore(MAX_CONCURRENT_TURNS)
+    yield
+
+
+app = FastAPI(title="Document Assistant API", lifespan=lifespan)
+
+
+async def start_turn(request: TurnRequest):
+    """Start a turn under the concurrency limit; returns (task, queue of events ending with None)"""
+    try:
+        turn = request.turn()
+    except ValueError as e:
+        # e.g. audio that is not valid base64
+        raise HTTPException(status_code=422, detail=f"Invalid turn: {str(e)}")
+    slots = app.state.turn_slots
+    try:
+        await asyncio.wait_for(slots.acquire(), QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Too many turns in progress, retry shortly",
+                            headers={"Retry-After": "1"})
+
+    events = asyncio.Queue()
+    task = asyncio.create_task(chat_engine.init_turn_pipeline().run(events.put_nowait, **turn))
+
+    def finished(_):
+        slots.release()
+        events.put_nowait(None)
+    task.add_done_callback(finished)
+    return task, events
+
+
+@app.post("/v1/chat")
+async def chat(request: TurnRequest):
+    task, events = await start_turn(request)
+
+    async def stream():
+        try:
+            while (event := await events.get()) is not None:
+                yield json.dumps(event_to_json(event)) + "\n"
+        finally:
+            # Client went away or the turn ended; either way nothing is left to wait for
+            task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.websocket("/v1/chat/ws")
+async def chat_socket(websocket: WebSocket):
+    await websocket.accept()
+    task = None
+
+    async def forward(request):
+        try:
+            turn_task, events = await start_turn(request)
+        except HTTPException as e:
+            await websocket.send_json({"type": "error", "message": e.detail, "turn": request.id})
+            return
+        try:
+            # Events of a cancelled turn may still be in flight; the id tells them apart
+            while (event := await events.get()) is not None:
+                await websocket.send_json({**event_to_json(event), "turn": request.id})
+        finally:
+            turn_task.cancel()
+
+    try:
+        while True:
+            message = None
+            try:
+                message = json.loads(await websocket.receive_text())
+                if not isinstance(message, dict):
+                    raise ValueError("expected a JSON object")
+                request = None if message.get("type") == "cancel" else TurnRequest(**message)
+            except (ValueError, ValidationError) as e:
+                # Only this message is rejected; the socket and the running turn carry on
+                await websocket.send_json({"type": "error", "message": f"Invalid message: {str(e)}",
+                                           "turn": message.get("id") if isinstance(message, dict) else None})
+                continue
+            if task is not None:
+                task.cancel()
+                task = None
+            if request is not None:
+                task = asyncio.create_task(forward(request))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if task is not None:
+            task.cancel()
+
+
+@app.post("/v1/search")
+async def search(request: SearchRequest):
+    results, timings = await asyncio.to_thread(
+        chat_engine.search_documents, request.query, request.top_k, request.min_similarity,
+        search_mode=request.search_mode
+    )
+    return {
+        "results": [{"score": score, "content": content} for score, content in results],
+        "timings": timings,
+    }
+
+
+@app.post("/v1/transcribe")
+async def transcribe(request: Request):
+    text = await asyncio.to_thread(chat_engine.transcribe_recording, await request.body())
+    if not text:
+        raise HTTPException(status_code=422, detail="Could not transcribe audio")
+    return {"text": text}
+
+
+@app.post("/v1/tts")
+async def tts(request: SpeechRequest):
+    audio = await asyncio.to_thread(chat_engine.text_to_speech, request.text, request.voice)
+    if not audio:
+        raise HTTPException(status_code=502, detail="Speech synthesis failed")
+    return Response(content=audio, media_type="audio/wav")
+
+
+@app.get("/v1/stats")
+async def stats():
+    return await asyncio.to_thread(chat_engine.engine_stats)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
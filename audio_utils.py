@@ -0,0 +1,47 @@
+"""In-memory audio preparation for speech-to-text uploads"""
+from io import BytesIO
+
+import numpy as np
+import soundfile as sf
+
+# Whisper works at 16 kHz mono internally, so anything more is wasted upload
+STT_SAMPLE_RATE = 16000
+
+
+def lowpass_kernel(cutoff, taps=63):
+    """Hamming-windowed sinc FIR; cutoff is a fraction of the sample rate (0 < cutoff < 0.5)"""
+    n = np.arange(taps) - (taps - 1) / 2
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+    return kernel / kernel.sum()
+
+
+def resample(samples, rate, target_rate):
+    """Resample a mono float signal, low-pass filtering first when downsampling"""
+    if rate == target_rate or len(samples) == 0:
+        return samples
+    if target_rate < rate:
+        # Keep a little headroom below the new Nyquist frequency
+        samples = np.convolve(samples, lowpass_kernel(0.45 * target_rate / rate), mode="same")
+    duration = len(samples) / rate
+    positions = np.arange(int(duration * target_rate)) * (rate / target_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def decode_mono(audio_bytes):
+    """(samples, rate) of a recording, downmixed to mono float32"""
+    data, rate = sf.read(BytesIO(audio_bytes), dtype="float32", always_2d=True)
+    return data.mean(axis=1), rate
+
+
+def encode_wav(samples, rate, target_rate=STT_SAMPLE_RATE):
+    """Resample mono float samples and encode them as 16-bit WAV in memory"""
+    samples = resample(np.asarray(samples, dtype=np.float32), rate, target_rate)
+    buffer = BytesIO()
+    sf.write(buffer, samples, target_rate, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+def prepare_for_transcription(audio_bytes, target_rate=STT_SAMPLE_RATE):
+    """Decode a recording, downmix to mono, resample and re-encode as 16-bit WAV in memory"""
+    mono, rate = decode_mono(audio_bytes)
+    return encode_wav(mono, rate, target_rate)
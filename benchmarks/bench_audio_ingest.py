@@ -0,0 +1,95 @@
+"""Compare the old temp-file audio ingestion with the in-memory 16 kHz mono path.
+
+    python benchmarks/bench_audio_ingest.py --seconds 8 --repeat 50
+
+Prints one JSON object with per-path latency and upload payload sizes.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import numpy as np
+import soundfile as sf
+from langchain_core.documents.base import Blob
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_utils import prepare_for_transcription  # noqa: E402
+
+
+def synthetic_recording(seconds, rate=44100, channels=2):
+    """Speech-like test signal: a few harmonics with a syllable-rate envelope plus noise"""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * rate)) / rate
+    voice = sum(np.sin(2 * np.pi * f * t) / (i + 1) for i, f in enumerate((180, 360, 720, 1440)))
+    envelope = 0.5 * (1 + np.sin(2 * np.pi * 4 * t))
+    signal = 0.2 * voice * envelope + 0.01 * rng.standard_normal(len(t))
+    data = np.repeat(signal[:, None], channels, axis=1)
+    buffer = BytesIO()
+    sf.write(buffer, data, rate, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+def temp_file_path(audio_bytes, directory=None):
+    """The previous process_audio_input: write, reopen through Blob.from_path, unlink"""
+    temp_file = tempfile.NamedTemporaryFile(suffix=".wav", delete=False, dir=directory)
+    try:
+        with open(temp_file.name, "wb") as f:
+            f.write(audio_bytes)
+        blob = Blob.from_path(temp_file.name)
+        return blob.as_bytes()
+    finally:
+        temp_file.close()
+        os.unlink(temp_file.name)
+
+
+def in_memory_path(audio_bytes):
+    return Blob.from_data(prepare_for_transcription(audio_bytes), mime_type="audio/wav",
+                          path="recording.wav").as_bytes()
+
+
+def measure(fn, audio_bytes, repeat):
+    timings = []
+    payload = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        payload = fn(audio_bytes)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        "mean_ms": statistics.mean(timings) * 1000,
+        "p50_ms": timings[len(timings) // 2] * 1000,
+        "p95_ms": timings[int(len(timings) * 0.95) - 1] * 1000,
+        "payload_bytes": len(payload),
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--seconds", type=float, default=8.0, help="Recording length")
+    arg_parser.add_argument("--channels", type=int, default=2)
+    arg_parser.add_argument("--repeat", type=int, default=50)
+    arg_parser.add_argument("--tmpdir", default=None, help="Directory for the temp-file path (e.g. the slow overlay)")
+    args = arg_parser.parse_args()
+
+    audio_bytes = synthetic_recording(args.seconds, channels=args.channels)
+    temp_result = measure(lambda b: temp_file_path(b, args.tmpdir), audio_bytes, args.repeat)
+    memory_result = measure(in_memory_path, audio_bytes, args.repeat)
+
+    print(json.dumps({
+        "benchmark": "audio_ingest",
+        "recording_seconds": args.seconds,
+        "input_bytes": len(audio_bytes),
+        "temp_file": temp_result,
+        "in_memory_16k_mono": memory_result,
+        "payload_reduction": temp_result["payload_bytes"] / memory_result["payload_bytes"],
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
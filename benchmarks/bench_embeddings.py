@@ -0,0 +1,151 @@
+"""Query-embedding latency and throughput: remote Ollama against the local ONNX model.
+
+    python benchmarks/bench_embeddings.py --model ~/models/nomic-embed-text-v1.5/onnx/model_quantized.onnx
+    python benchmarks/bench_embeddings.py --model model.onnx --ollama-url http://ollama:11434 --output embed.json
+
+Both backends sit behind CachedEmbeddings, as in the app, with the cache
+cold: every query is new. "sequential" embeds one query at a time;
+"concurrencyN" has N threads, standing in for sessions, embedding queries
+at the same time through the shared batcher. Without --ollama-url the remote
+side is the stub Ollama server (see stub_servers.py), answering each
+request after --remote-latency seconds, the delay of an Ollama that is busy
+generating. With a real Ollama the report also gives the cosine similarity
+between the two backends' vectors for the same queries.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_cache import CachedEmbeddings  # noqa: E402
+from stub_servers import start_in_thread  # noqa: E402
+from harness import peak_rss_mb, latency_summary, environment, write_report  # noqa: E402
+
+TOPICS = ["the backup schedule", "user permissions", "the network proxy", "log retention", "the license key",
+          "email notifications", "the database password", "two-factor login", "the export format", "disk quotas"]
+
+
+def synthetic_queries(count, seed=0):
+    """Distinct support questions of realistic length, so the query cache never hits"""
+    rng = np.random.default_rng(seed)
+    verbs = ["change", "reset", "configure", "disable", "find", "update"]
+    return [f"How do I {verbs[rng.integers(len(verbs))]} {TOPICS[rng.integers(len(TOPICS))]} "
+            f"for workspace {index}?" for index in range(count)]
+
+
+def cached(embeddings, name, window):
+    return CachedEmbeddings(embeddings, model_name=name, sqlite_path=None, batch_window=window)
+
+
+def sequential(model, queries):
+    timings = []
+    started = time.perf_counter()
+    for query in queries:
+        began = time.perf_counter()
+        model.embed_query(query)
+        timings.append(time.perf_counter() - began)
+    return timings, time.perf_counter() - started
+
+
+def concurrent(model, queries, threads):
+    timings = []
+    lock = threading.Lock()
+
+    def worker(share):
+        for query in share:
+            began = time.perf_counter()
+            model.embed_query(query)
+            with lock:
+                timings.append(time.perf_counter() - began)
+
+    workers = [threading.Thread(target=worker, args=(queries[index::threads],)) for index in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return timings, time.perf_counter() - started
+
+
+def run_backend(name, embeddings, window, args):
+    cases = []
+    # Both backends get the same queries
+    queries = synthetic_queries(args.queries * (1 + len(args.concurrency)))
+    # One warm-up call: ONNX Runtime allocates its buffers, requests opens its connection
+    embeddings.embed_query("warm up")
+    scenarios = [("sequential", None)] + [(f"concurrency{threads}", threads) for threads in args.concurrency]
+    for index, (scenario, threads) in enumerate(scenarios):
+        print(f"{name}: {scenario}", file=sys.stderr)
+        model = cached(embeddings, name, window)
+        share = queries[index * args.queries:(index + 1) * args.queries]
+        timings, wall = sequential(model, share) if threads is None else concurrent(model, share, threads)
+        stats = model.stats()
+        cases.append({
+            "case": f"{name}/{scenario}",
+            "threads": threads or 1,
+            "query": latency_summary(timings),
+            "queries_per_sec": len(timings) / wall,
+            "avg_batch_size": stats["avg_batch_size"],
+        })
+    return cases
+
+
+def agreement(remote, local, count=50):
+    """Mean and minimum cosine similarity between the two backends' vectors for the same queries"""
+    queries = synthetic_queries(count, seed=99)
+    a = np.asarray([remote.embed_query(query) for query in queries], dtype=np.float32)
+    b = np.asarray([local.embed_query(query) for query in queries], dtype=np.float32)
+    cosine = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    return {"mean_cosine": float(cosine.mean()), "min_cosine": float(cosine.min())}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--model", default=os.getenv("EMBEDDING_ONNX_MODEL"),
+                            help="ONNX export of nomic-embed-text (defaults to $EMBEDDING_ONNX_MODEL)")
+    arg_parser.add_argument("--threads", type=int, default=0, help="ONNX Runtime threads; 0 uses every core")
+    arg_parser.add_argument("--ollama-url", help="Real Ollama to compare with, instead of the stub")
+    arg_parser.add_argument("--remote-latency", type=float, default=0.15, help="Stub seconds per embedding")
+    arg_parser.add_argument("--queries", type=int, default=200, help="Queries per scenario")
+    arg_parser.add_argument("--concurrency", default="4,16", help="Comma-separated thread counts")
+    arg_parser.add_argument("--output", help="Also write the JSON report here")
+    args = arg_parser.parse_args()
+    args.concurrency = [int(n) for n in args.concurrency.split(",") if n.strip()]
+    if not args.model:
+        arg_parser.error("--model (or $EMBEDDING_ONNX_MODEL) is required")
+
+    from langchain_community.embeddings import OllamaEmbeddings
+    from local_embeddings import OnnxEmbeddings
+
+    server = None
+    base_url = args.ollama_url
+    if not base_url:
+        server, base_url = start_in_thread(latency=args.remote_latency)
+    remote = OllamaEmbeddings(model="nomic-embed-text", base_url=base_url)
+    local = OnnxEmbeddings(args.model, threads=args.threads or None)
+
+    # The same batching windows chat_engine uses for each backend
+    cases = run_backend("ollama", remote, 0.01, args) + run_backend("onnx", local, 0, args)
+    report = {
+        "benchmark": "embeddings",
+        "environment": environment(),
+        "settings": {"model": args.model, "threads": local.threads, "queries": args.queries,
+                     "remote": "stub" if server else base_url,
+                     "remote_latency": args.remote_latency if server else None},
+        "cases": cases,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if server:
+        server.shutdown()
+    else:
+        report["agreement"] = agreement(remote, local)
+    write_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
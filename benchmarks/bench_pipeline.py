@@ -0,0 +1,196 @@
+"""Drive whole chat turns through the turn pipeline against local stub services.
+
+    python benchmarks/bench_pipeline.py --turns 200 --concurrency 8 --token-delay 0.02
+    python benchmarks/bench_pipeline.py --voice alloy --audio-share 0.5 --output pipeline.json
+
+Stub Ollama (chat and embeddings), TTS and Whisper servers from stub_servers.py
+are started in-process and chat_engine is pointed at them, so turns go
+through the production code: LLMRouter over ChatOllama, cached Ollama
+embeddings, history budgeting, and Whisper/TTS through the pooled
+SpeechClient. Only Postgres is replaced: retrieval runs the usual candidate
+pipeline over a synthetic in-memory corpus. Every question is distinct, so
+the answer cache (off unless --answer-cache) would not hit anyway.
+
+Reports turn latency, time to first token and first audio, throughput and
+per-stage percentiles from the metrics registry, plus peak RSS, as JSON.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_servers import start_in_thread, silent_wav  # noqa: E402
+from bench_retrieval import synthetic_corpus  # noqa: E402
+from harness import peak_rss_mb, latency_summary, environment, write_report  # noqa: E402
+
+
+def configure_environment(args, ollama_urls, speech_url, scratch):
+    """Point chat_engine at the stubs; must run before chat_engine is imported"""
+    os.environ["OLLAMA_URL"] = ollama_urls[0]
+    if len(ollama_urls) > 1:
+        os.environ["LLM_BACKENDS"] = "[" + ",".join(
+            f'{{"name": "stub-{index}", "base_url": "{url}"}}' for index, url in enumerate(ollama_urls)
+        ) + "]"
+    os.environ["TTS_ENDPOINT"] = f"{speech_url}/tts"
+    os.environ["STT_ENDPOINT"] = f"{speech_url}/audio/translations"
+    # Keep caches out of the user's home directory and start them cold
+    os.environ["QUERY_CACHE_PATH"] = ""
+    os.environ["TTS_CACHE_DIR"] = os.path.join(scratch, "tts")
+
+
+def build_pipeline(args, chat_engine):
+    from embedding_store import normalize_rows
+    from history_manager import HistoryManager
+    from retrieval import StageTimer, top_k_indices, run_pipeline
+    from telemetry import REGISTRY
+    from turn_pipeline import TurnPipeline
+
+    corpus = normalize_rows(synthetic_corpus(args.corpus_rows, seed=args.seed))
+    contents = [f"Synthetic passage {index} about configuration option {index % 97}." for index in range(len(corpus))]
+
+    def search(query, query_embedding, top_k, min_similarity, search_mode=None):
+        """search_documents with the in-memory corpus standing in for Postgres (vector search only)"""
+        timer = StageTimer()
+        with timer.stage("candidates"):
+            query_vector = np.asarray(query_embedding, dtype=np.float32)
+            scores = corpus @ (query_vector / (np.linalg.norm(query_vector) or 1.0))
+            indices = top_k_indices(scores, top_k * chat_engine.CANDIDATE_POOL_FACTOR)
+            candidates = [(float(scores[i]), contents[i], corpus[i]) for i in indices]
+        results = run_pipeline(candidates, query, top_k, min_similarity=min_similarity,
+                               mmr_lambda=chat_engine.MMR_LAMBDA,
+                               duplicate_threshold=chat_engine.DUPLICATE_THRESHOLD, timer=timer)
+        return results, timer.timings
+
+    embeddings_model, chat_model = chat_engine.init_models()
+    return TurnPipeline(
+        embeddings=embeddings_model,
+        chat_model=chat_model,
+        search=search,
+        history=HistoryManager(
+            summarize=lambda summary_prompt: chat_model.invoke(summary_prompt).content,
+            system_prompt=chat_engine.SYSTEM_PROMPT,
+            token_budget=chat_engine.PROMPT_TOKEN_BUDGET,
+            keep_turns=chat_engine.HISTORY_KEEP_TURNS
+        ),
+        answer_cache=chat_engine.init_answer_cache() if args.answer_cache else None,
+        transcribe=chat_engine.process_audio_input,
+        synthesize=chat_engine.text_to_speech if args.tts_cache else chat_engine.request_speech,
+        tts_workers=chat_engine.TTS_WORKERS,
+        registry=REGISTRY
+    ), REGISTRY
+
+
+async def run_turns(pipeline, args, model_key):
+    recording = silent_wav(args.audio_seconds)
+    slots = asyncio.Semaphore(args.concurrency)
+    results = []
+
+    async def one_turn(index):
+        use_audio = index < args.turns * args.audio_share
+        turn = {
+            "history": [],
+            "state": {},
+            "question": None if use_audio else f"How do I change configuration option {index}?",
+            "audio": recording if use_audio else None,
+            "voice": args.voice,
+            "top_k": args.top_k,
+            "model_key": model_key,
+        }
+        events = []
+        async with slots:
+            started = time.perf_counter()
+            await pipeline.run(events.append, **turn)
+            elapsed = time.perf_counter() - started
+        done = next((event for event in events if event["type"] == "done"), None)
+        results.append({
+            "seconds": elapsed,
+            "audio_input": use_audio,
+            "metrics": done["metrics"] if done else None,
+            "errors": [event["message"] for event in events if event["type"] == "error"],
+            "audio_segments": sum(1 for event in events if event["type"] == "audio" and event["audio"]),
+        })
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_turn(index) for index in range(args.turns)))
+    return results, time.perf_counter() - started
+
+
+def summarize(results, wall_seconds, registry):
+    completed = [r for r in results if r["metrics"] is not None]
+    tokens = sum(r["metrics"].get("tokens") or 0 for r in completed)
+    stage_ms = {
+        stage: {"count": snapshot["count"],
+                **{key: snapshot[key] * 1000 for key in ("p50", "p95", "p99", "max") if snapshot[key] is not None}}
+        for stage, snapshot in sorted(registry.snapshot("chatbot_stage_seconds", "stage").items())
+    }
+    return {
+        "turns": len(results),
+        "completed": len(completed),
+        "failed_turns": sum(1 for r in results if r["errors"] or r["metrics"] is None),
+        "wall_seconds": wall_seconds,
+        "turns_per_sec": len(completed) / wall_seconds if wall_seconds else None,
+        "tokens_per_sec": tokens / wall_seconds if wall_seconds else None,
+        "turn": latency_summary([r["seconds"] for r in completed]),
+        "ttft": latency_summary([r["metrics"]["ttft"] for r in completed if r["metrics"].get("ttft")]),
+        "first_audio": latency_summary([r["metrics"]["first_audio"] for r in completed
+                                        if r["metrics"].get("first_audio")]),
+        "audio_segments": sum(r["audio_segments"] for r in results),
+        # Registry percentiles are bucket interpolations, in milliseconds
+        "stages_ms": stage_ms,
+        "outcomes": registry.counters("chatbot_turns_total", "outcome"),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--turns", type=int, default=100)
+    arg_parser.add_argument("--concurrency", type=int, default=4, help="Turns in flight at once")
+    arg_parser.add_argument("--backends", type=int, default=1, help="Stub Ollama servers behind the LLM router")
+    arg_parser.add_argument("--ttft", type=float, default=0.3, help="Stub seconds before the first token")
+    arg_parser.add_argument("--token-delay", type=float, default=0.02, help="Stub seconds between tokens")
+    arg_parser.add_argument("--embed-latency", type=float, default=0.02, help="Stub embedding seconds")
+    arg_parser.add_argument("--speech-latency", type=float, default=0.2, help="Stub TTS/Whisper seconds")
+    arg_parser.add_argument("--voice", default=None, help="Speak answers in this voice (e.g. alloy)")
+    arg_parser.add_argument("--tts-cache", action="store_true", help="Synthesize through the TTS cache")
+    arg_parser.add_argument("--answer-cache", action="store_true")
+    arg_parser.add_argument("--audio-share", type=float, default=0.0, help="Share of turns asked by voice")
+    arg_parser.add_argument("--audio-seconds", type=float, default=4.0)
+    arg_parser.add_argument("--corpus-rows", type=int, default=20000)
+    arg_parser.add_argument("--top-k", type=int, default=3)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--output", help="Also write the JSON report here")
+    args = arg_parser.parse_args()
+
+    ollama_stubs = [start_in_thread(latency=args.ttft, token_delay=args.token_delay, embed_latency=args.embed_latency)
+                    for _ in range(args.backends)]
+    speech_stub = start_in_thread(latency=args.speech_latency)
+
+    with tempfile.TemporaryDirectory(prefix="bench-pipeline-") as scratch:
+        configure_environment(args, [url for _, url in ollama_stubs], speech_stub[1], scratch)
+        import chat_engine
+
+        pipeline, registry = build_pipeline(args, chat_engine)
+        results, wall_seconds = asyncio.run(run_turns(pipeline, args, chat_engine.model_key(0.7)))
+
+        write_report({
+            "benchmark": "pipeline",
+            "environment": environment(),
+            "settings": {key: value for key, value in vars(args).items() if key != "output"},
+            "results": summarize(results, wall_seconds, registry),
+            "requests": {
+                "ollama": [server.requests for server, _ in ollama_stubs],
+                "speech": speech_stub[0].requests,
+            },
+            "llm": chat_engine.init_models()[1].stats(),
+        }, args.output)
+
+
+if __name__ == "__main__":
+    main()
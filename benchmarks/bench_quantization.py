@@ -0,0 +1,136 @@
+"""Recall@k, memory and latency of quantized embedding stores against exact float32 search.
+
+    python benchmarks/bench_quantization.py --rows 200000 --output quantization.json
+    python benchmarks/bench_quantization.py --dsn postgresql+psycopg2://... --collection manuals
+
+Without --dsn the corpus is synthetic (see bench_retrieval.py); with it, the
+embeddings are loaded from the database the same way the app loads them.
+Queries are stored vectors with a little noise added, so every query has real
+neighbours. Rescore factor 1 means no re-scoring: the codes alone pick the
+top k.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_store import EmbeddingStore  # noqa: E402
+from bench_retrieval import synthetic_corpus, synthetic_queries  # noqa: E402
+from harness import peak_rss_mb, latency_summary, environment, write_report  # noqa: E402
+
+
+class _NoRefresh:
+    """Engine placeholder: the benchmark fills stores directly and never refreshes them"""
+
+
+def filled_store(vectors, quantization=None, pq_subspaces=48, batch_size=10_000):
+    store = EmbeddingStore(_NoRefresh(), refresh_interval=float("inf"), quantization=quantization,
+                           pq_subspaces=pq_subspaces, batch_size=batch_size)
+    store._last_refresh = time.monotonic()
+    for start in range(0, len(vectors), batch_size):
+        rows = np.asarray(vectors[start:start + batch_size], dtype=np.float32)
+        ids = list(range(start, start + len(rows)))
+        store._load_batch(rows, ids, ids)  # row number as content, to compare result sets
+    return store
+
+
+def load_corpus(args):
+    if not args.dsn:
+        return synthetic_corpus(args.rows, seed=args.seed), "synthetic"
+    from db import create_db_engine
+    from vector_store import describe_embedding_column, supports_vector_search
+
+    engine = create_db_engine(args.dsn)
+    store = EmbeddingStore(engine, collection=args.collection,
+                           binary=supports_vector_search(describe_embedding_column(engine)))
+    store.refresh()
+    return np.asarray(store.snapshot().delta), "database"
+
+
+def measure(store, queries, exact, top_k):
+    timings = []
+    hits = 0
+    for query, expected in zip(queries, exact):
+        started = time.perf_counter()
+        results = store.search(query, top_k)
+        timings.append(time.perf_counter() - started)
+        hits += len(expected & {content for _, content in results})
+    return {
+        f"recall_at_{top_k}": hits / (len(queries) * top_k),
+        "query": latency_summary(timings),
+        "queries_per_sec": len(timings) / sum(timings),
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--rows", type=int, default=100_000, help="Synthetic corpus size")
+    arg_parser.add_argument("--dsn", help="Benchmark the embeddings stored in this database instead")
+    arg_parser.add_argument("--collection")
+    arg_parser.add_argument("--queries", type=int, default=200)
+    arg_parser.add_argument("--top-k", type=int, default=12, help="Candidate pool size (top_k x CANDIDATE_POOL_FACTOR)")
+    arg_parser.add_argument("--codecs", default="float16,int8,pq")
+    arg_parser.add_argument("--pq-subspaces", default="48,96", help="Comma-separated; must divide the dimension")
+    arg_parser.add_argument("--rescore-factors", default="1,4,10,25")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--output", help="Also write the JSON report here")
+    args = arg_parser.parse_args()
+
+    corpus, source = load_corpus(args)
+    queries = synthetic_queries(corpus, args.queries, seed=args.seed + 1)
+    rows, dims = corpus.shape
+
+    baseline = filled_store(corpus)
+    exact = [{content for _, content in baseline.search(query, args.top_k)} for query in queries]
+    cases = [{
+        "case": "float32", "quantization": None,
+        "bytes_per_vector": dims * 4,
+        "memory_mb": baseline.stats()["memory_mb"],
+        **measure(baseline, queries, exact, args.top_k),
+    }]
+    del baseline
+
+    configurations = []
+    for codec in [name.strip() for name in args.codecs.split(",") if name.strip()]:
+        if codec == "pq":
+            configurations += [("pq", int(m)) for m in args.pq_subspaces.split(",")]
+        else:
+            configurations.append((codec, None))
+
+    for codec, subspaces in configurations:
+        print(f"Encoding {rows} rows as {codec}{'/' + str(subspaces) if subspaces else ''}", file=sys.stderr)
+        started = time.perf_counter()
+        store = filled_store(corpus, quantization=codec, pq_subspaces=subspaces or 48)
+        encode_seconds = time.perf_counter() - started
+        stats = store.stats()
+        for factor in [int(f) for f in args.rescore_factors.split(",")]:
+            store.rescore_factor = factor
+            cases.append({
+                "case": f"{codec}{subspaces or ''}/rescore{factor}",
+                "quantization": codec,
+                "pq_subspaces": subspaces,
+                "rescore_factor": factor,
+                "bytes_per_vector": store._codec.code_size,
+                "encode_seconds": encode_seconds,
+                "memory_mb": stats["memory_mb"],
+                "spill_mb": stats["spill_mb"],
+                **measure(store, queries, exact, args.top_k),
+            })
+        del store
+
+    write_report({
+        "benchmark": "quantization",
+        "environment": environment(),
+        "settings": {"source": source, "rows": rows, "dims": dims, "queries": args.queries,
+                     "top_k": args.top_k, "seed": args.seed},
+        "cases": cases,
+        "peak_rss_mb": peak_rss_mb(),
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
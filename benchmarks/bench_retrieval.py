@@ -0,0 +1,226 @@
+"""Compare full-scan retrieval strategies on synthetic nomic-embed-text sized corpora.
+
+    python benchmarks/bench_retrieval.py --sizes 10000,100000,1000000 --output retrieval.json
+    python benchmarks/bench_retrieval.py --sizes 5000000 --methods matrix,snapshot
+
+Methods:
+    text_scan    the original search_documents: every row as pgvector text,
+                 float() per value, cosine similarity and argsort, on every query
+    text_load    parse the text rows once with numpy (EmbeddingStore, binary=False),
+                 then search the normalized matrix
+    binary_load  decode vector_send payloads once (EmbeddingStore, binary=True),
+                 then search the normalized matrix
+    matrix       search an already loaded matrix: one mat-vec plus argpartition
+    snapshot     write a vector snapshot, map it and search the mapped matrix
+
+Each (method, size) case runs in its own subprocess so its peak RSS is its
+own; rss_mb is what the process holds while serving queries. The corpus is generated, not loaded: a 768-dim float32 row is 3 KB, so
+5M rows need about 15 GB for the matrix alone; text methods are skipped above
+--text-max-rows since formatting and holding the text costs several times that.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_store import parse_vector_text, normalize_rows  # noqa: E402
+from retrieval import top_k_indices  # noqa: E402
+from vector_store import decode_vector_send  # noqa: E402
+from vector_snapshot import write_snapshot, open_snapshot  # noqa: E402
+from harness import peak_rss_mb, current_rss_mb, latency_summary, environment, write_report  # noqa: E402
+
+EMBEDDING_DIM = 768
+METHODS = ("text_scan", "text_load", "binary_load", "matrix", "snapshot")
+TEXT_METHODS = ("text_scan", "text_load")
+CHUNK_ROWS = 100_000
+
+
+def synthetic_corpus(rows, dims=EMBEDDING_DIM, clusters=256, seed=0):
+    """Clustered unit-ish vectors, generated in chunks so the same seed always gives the same corpus"""
+    centroids = np.random.default_rng(seed).standard_normal((clusters, dims)).astype(np.float32)
+    matrix = np.empty((rows, dims), dtype=np.float32)
+    for chunk, start in enumerate(range(0, rows, CHUNK_ROWS)):
+        stop = min(start + CHUNK_ROWS, rows)
+        rng = np.random.default_rng([seed, chunk])
+        assignment = rng.integers(0, clusters, stop - start)
+        matrix[start:stop] = centroids[assignment] + 0.6 * rng.standard_normal((stop - start, dims), dtype=np.float32)
+    matrix /= np.sqrt(dims)
+    return matrix
+
+
+def synthetic_queries(corpus, count, seed=1):
+    """Perturbed corpus rows, so every query has genuine near neighbours"""
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(corpus), count)
+    noise = 0.3 * rng.standard_normal((count, corpus.shape[1]), dtype=np.float32) / np.sqrt(corpus.shape[1])
+    return (corpus[picks] + noise).astype(np.float32)
+
+
+def to_text_rows(matrix):
+    """Rows as pgvector prints them ('[x,y,...]')"""
+    row_format = "[" + ",".join(["%.7g"] * matrix.shape[1]) + "]"
+    return [row_format % tuple(row.tolist()) for row in matrix]
+
+
+def to_vector_send(matrix):
+    """Rows as pgvector's binary vector_send payloads"""
+    header = np.array([matrix.shape[1], 0], dtype=">i2").tobytes()
+    body = matrix.astype(">f4")
+    return [header + row.tobytes() for row in body]
+
+
+def text_scan_search(text_rows, query, top_k):
+    """The original search_documents, minus the SQL round trip"""
+    embeddings = []
+    for embedding_str in text_rows:
+        embedding_values = embedding_str.strip('[]').split(',')
+        embeddings.append(np.array([float(x.strip()) for x in embedding_values]))
+    stored_vectors = np.stack(embeddings)
+    # cosine_similarity(query, stored_vectors), as sklearn computes it
+    similarities = (stored_vectors @ query) / (np.linalg.norm(stored_vectors, axis=1) * np.linalg.norm(query))
+    return np.argsort(similarities)[::-1][:top_k]
+
+
+def matrix_search(matrix, query, top_k):
+    # As EmbeddingStore.search: a float64 query would make every mat-vec a slow mixed-dtype one
+    query = np.asarray(query, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+    return top_k_indices(matrix @ query, top_k)
+
+
+def run_case(method, rows, dims, queries, top_k, seed):
+    """Measure one method on one corpus size; returns the case's JSON-ready result"""
+    generate_started = time.perf_counter()
+    corpus = synthetic_corpus(rows, dims, seed=seed)
+    query_vectors = synthetic_queries(corpus, queries, seed=seed + 1)
+    result = {"case": f"{method}@{rows}", "method": method, "rows": rows, "dims": dims, "top_k": top_k,
+              "generate_seconds": time.perf_counter() - generate_started}
+
+    scratch = None
+    if method == "text_scan":
+        started = time.perf_counter()
+        payload = to_text_rows(corpus)
+        result["payload_seconds"] = time.perf_counter() - started
+        del corpus
+        setup = None
+        search = lambda q: text_scan_search(payload, q, top_k)  # noqa: E731
+    elif method in ("text_load", "binary_load"):
+        started = time.perf_counter()
+        payload = to_text_rows(corpus) if method == "text_load" else to_vector_send(corpus)
+        result["payload_seconds"] = time.perf_counter() - started
+        del corpus
+        started = time.perf_counter()
+        decoded = parse_vector_text(payload) if method == "text_load" else decode_vector_send(payload)
+        matrix = np.ascontiguousarray(normalize_rows(decoded), dtype=np.float32)
+        setup = time.perf_counter() - started
+        del payload, decoded
+        search = lambda q: matrix_search(matrix, q, top_k)  # noqa: E731
+    elif method == "matrix":
+        started = time.perf_counter()
+        matrix = normalize_rows(corpus)
+        del corpus
+        setup = time.perf_counter() - started
+        search = lambda q: matrix_search(matrix, q, top_k)  # noqa: E731
+    elif method == "snapshot":
+        scratch = tempfile.TemporaryDirectory(prefix="bench-snapshot-")
+        matrix = normalize_rows(corpus)
+        del corpus
+        write_started = time.perf_counter()
+        write_snapshot(scratch.name, matrix, [""] * rows, list(range(rows)), rows, rows)
+        result["write_seconds"] = time.perf_counter() - write_started
+        del matrix
+        started = time.perf_counter()
+        snapshot = open_snapshot(scratch.name)
+        setup = time.perf_counter() - started
+        mapped = snapshot.matrix
+        search = lambda q: matrix_search(mapped, q, top_k)  # noqa: E731
+    else:
+        raise ValueError(f"Unknown method: {method}")
+    result["load_seconds"] = setup
+
+    timings = []
+    first = None
+    for query in query_vectors:
+        started = time.perf_counter()
+        search(query)
+        timings.append(time.perf_counter() - started)
+        if first is None:
+            # Includes page faults for the snapshot, the cold-start cost a fresh worker pays
+            first = timings[-1]
+    total = sum(timings)
+    result["first_query_ms"] = first * 1000
+    result["query"] = latency_summary(timings[1:] or timings)
+    result["queries_per_sec"] = len(timings) / total if total else None
+    # The peak includes generating the corpus; the current figure is what serving it holds
+    result["rss_mb"] = current_rss_mb()
+    result["peak_rss_mb"] = peak_rss_mb()
+    if scratch is not None:
+        scratch.cleanup()
+    return result
+
+
+def run_in_subprocess(method, rows, args):
+    command = [
+        sys.executable, os.path.abspath(__file__), "--case", method, "--rows", str(rows),
+        "--dims", str(args.dims), "--queries", str(args.scan_queries if method == "text_scan" else args.queries),
+        "--top-k", str(args.top_k), "--seed", str(args.seed),
+    ]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        # Usually the corpus did not fit in memory
+        return {"case": f"{method}@{rows}", "method": method, "rows": rows,
+                "error": completed.stderr.strip().splitlines()[-1:] or [f"exit {completed.returncode}"]}
+    return json.loads(completed.stdout)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--sizes", default="10000,100000,1000000", help="Comma-separated corpus sizes")
+    arg_parser.add_argument("--methods", default=",".join(METHODS))
+    arg_parser.add_argument("--dims", type=int, default=EMBEDDING_DIM)
+    arg_parser.add_argument("--queries", type=int, default=200, help="Queries per case")
+    arg_parser.add_argument("--scan-queries", type=int, default=5, help="Queries for text_scan, which reparses every row")
+    arg_parser.add_argument("--text-max-rows", type=int, default=100_000, help="Skip text methods on larger corpora")
+    arg_parser.add_argument("--top-k", type=int, default=12, help="Candidate pool size (top_k x CANDIDATE_POOL_FACTOR)")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--output", help="Also write the JSON report here")
+    arg_parser.add_argument("--case", help=argparse.SUPPRESS)
+    arg_parser.add_argument("--rows", type=int, help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(args.case, args.rows, args.dims, args.queries, args.top_k, args.seed)))
+        return
+
+    methods = [m.strip() for m in args.methods.split(",") if m.strip()]
+    unknown = set(methods) - set(METHODS)
+    if unknown:
+        arg_parser.error(f"unknown methods: {', '.join(sorted(unknown))}")
+
+    cases = []
+    for rows in [int(size) for size in args.sizes.split(",")]:
+        for method in methods:
+            if method in TEXT_METHODS and rows > args.text_max_rows:
+                cases.append({"case": f"{method}@{rows}", "method": method, "rows": rows,
+                              "skipped": f"more than --text-max-rows={args.text_max_rows}"})
+                continue
+            print(f"Running {method} on {rows} rows", file=sys.stderr)
+            cases.append(run_in_subprocess(method, rows, args))
+
+    write_report({
+        "benchmark": "retrieval",
+        "environment": environment(),
+        "settings": {"dims": args.dims, "queries": args.queries, "top_k": args.top_k, "seed": args.seed},
+        "cases": cases,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Time from the end of speech to the full transcript: whole uploads against streamed segments.
+
+    python benchmarks/bench_stt_stream.py --output stt.json
+    python benchmarks/bench_stt_stream.py --wav question.wav --wav dictation.wav
+    python benchmarks/bench_stt_stream.py --save-fixtures fixtures/
+
+Each recording (the synthetic fixtures, or WAV files given with --wav) is
+transcribed by a local stub Whisper server (see stub_servers.py) whose
+delay grows with the length of the upload, in three ways:
+
+    whole       the finished recording in one upload, as the browser recorder does
+    segmented   the finished recording cut at pauses, segments sent concurrently
+    streaming   fed at --speed times real time while segments are transcribed
+
+tail_ms is the wait after the last sample until the transcript is complete:
+what the speaker notices.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_utils import decode_mono, encode_wav  # noqa: E402
+from speech_stream import StreamingTranscriber  # noqa: E402
+from stub_servers import start_in_thread  # noqa: E402
+from harness import latency_summary, environment, write_report  # noqa: E402
+
+RATE = 16000
+# Seconds of speech per phrase; the phrases are separated by pauses
+FIXTURES = {
+    "question": [2.5],
+    "request": [2.0, 1.4, 2.6],
+    "dictation": [3.0, 2.2, 4.1, 1.8, 3.5, 2.7, 4.4],
+}
+
+
+def synthetic_speech(phrases, rate=RATE, seed=0):
+    """Voiced phrases with a syllable-rate envelope, separated by 0.6-0.9 s pauses, over faint noise"""
+    rng = np.random.default_rng(seed)
+    parts = [np.zeros(int(0.4 * rate))]
+    for seconds in phrases:
+        t = np.arange(int(seconds * rate)) / rate
+        pitch = 140 + 40 * rng.random()
+        voice = sum(np.sin(2 * np.pi * pitch * (i + 1) * t) / (i + 1) for i in range(4))
+        envelope = 0.4 + 0.6 * np.abs(np.sin(2 * np.pi * 2.5 * t))
+        parts += [0.15 * voice * envelope, np.zeros(int(rng.uniform(0.6, 0.9) * rate))]
+    signal = np.concatenate(parts)
+    return (signal + 0.001 * rng.standard_normal(len(signal))).astype(np.float32)
+
+
+def load_recordings(args):
+    if not args.wav:
+        return {name: (synthetic_speech(phrases, seed=index), RATE)
+                for index, (name, phrases) in enumerate(FIXTURES.items())}
+    recordings = {}
+    for path in args.wav:
+        with open(path, "rb") as f:
+            recordings[os.path.splitext(os.path.basename(path))[0]] = decode_mono(f.read())
+    return recordings
+
+
+def stub_transcriber(base_url):
+    from speech_client import SpeechClient
+
+    client = SpeechClient(max_retries=0)
+
+    def transcribe(wav_bytes):
+        response = client.transcribe(f"{base_url}/audio/translations", "stub", wav_bytes)
+        return response.json().get("text") if response.ok else None
+    return transcribe
+
+
+def whole(samples, rate, transcribe, speed):
+    started = time.perf_counter()
+    text = transcribe(encode_wav(samples, rate))
+    return time.perf_counter() - started, 1, text
+
+
+def segmented(samples, rate, transcribe, speed):
+    started = time.perf_counter()
+    transcriber = StreamingTranscriber(transcribe, rate)
+    transcriber.feed(samples)
+    text = transcriber.finish()
+    return time.perf_counter() - started, transcriber.segments, text
+
+
+def streaming(samples, rate, transcribe, speed, chunk_seconds=0.05):
+    transcriber = StreamingTranscriber(transcribe, rate)
+    chunk = int(chunk_seconds * rate)
+    started = time.perf_counter()
+    for number, offset in enumerate(range(0, len(samples), chunk)):
+        # Pace the feed like a sound card delivering blocks
+        delay = started + number * chunk_seconds / speed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        transcriber.feed(samples[offset:offset + chunk])
+    text = transcriber.finish()
+    return transcriber.tail_seconds, transcriber.segments, text
+
+
+MODES = {"whole": whole, "segmented": segmented, "streaming": streaming}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--wav", action="append", help="Recording to transcribe (repeatable); default: fixtures")
+    arg_parser.add_argument("--save-fixtures", metavar="DIR", help="Write the synthetic fixtures as WAV files and exit")
+    arg_parser.add_argument("--modes", default=",".join(MODES))
+    arg_parser.add_argument("--repeat", type=int, default=2)
+    arg_parser.add_argument("--speed", type=float, default=1.0, help="Streaming feed rate relative to real time")
+    arg_parser.add_argument("--latency", type=float, default=0.3, help="Stub Whisper seconds per request")
+    arg_parser.add_argument("--stt-factor", type=float, default=0.1, help="Stub Whisper seconds per second of audio")
+    arg_parser.add_argument("--output", help="Also write the JSON report here")
+    args = arg_parser.parse_args()
+
+    if args.save_fixtures:
+        os.makedirs(args.save_fixtures, exist_ok=True)
+        for name, phrases in FIXTURES.items():
+            with open(os.path.join(args.save_fixtures, f"{name}.wav"), "wb") as f:
+                f.write(encode_wav(synthetic_speech(phrases, seed=list(FIXTURES).index(name)), RATE))
+        return
+
+    server, base_url = start_in_thread(latency=args.latency, stt_factor=args.stt_factor)
+    transcribe = stub_transcriber(base_url)
+    cases = []
+    for name, (samples, rate) in load_recordings(args).items():
+        for mode in [mode.strip() for mode in args.modes.split(",") if mode.strip()]:
+            print(f"{name}: {mode}", file=sys.stderr)
+            runs = [MODES[mode](samples, rate, transcribe, args.speed) for _ in range(args.repeat)]
+            cases.append({
+                "case": f"{name}/{mode}",
+                "audio_seconds": len(samples) / rate,
+                "segments": statistics.median(segments for _, segments, _ in runs),
+                "transcribed": all(text for _, _, text in runs),
+                "tail_ms": statistics.median(seconds for seconds, _, _ in runs) * 1000,
+                "tail": latency_summary([seconds for seconds, _, _ in runs]),
+            })
+    server.shutdown()
+
+    write_report({
+        "benchmark": "stt_stream",
+        "environment": environment(),
+        "settings": {"repeat": args.repeat, "speed": args.speed, "latency": args.latency,
+                     "stt_factor": args.stt_factor, "source": "wav" if args.wav else "synthetic"},
+        "cases": cases,
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
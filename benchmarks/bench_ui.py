@@ -0,0 +1,154 @@
+"""Script run time and websocket payload of the Streamlit page for sessions of different lengths.
+
+    python benchmarks/bench_ui.py --messages 0,50,200,1000 --output ui.json
+    git show HEAD~1:streamlitollama.py > /tmp/old_app.py
+    python benchmarks/bench_ui.py --script /tmp/old_app.py --output ui_before.json
+    python benchmarks/compare.py ui_before.json ui.json
+
+Runs the page headless with streamlit.testing's AppTest, with a session that
+already holds N messages, and measures three interactions:
+
+    load      first run of the page
+    setting   moving a sidebar slider (a full rerun)
+    send      submitting a question from the chat input
+
+Payload is the serialized size of every message the script sends to the
+browser during the run. Turns go to an unreachable chat API and end
+straight away with an error, so only the page's own rendering is measured.
+The conversation store is off. AppTest reruns the whole script for every
+interaction, so send also redraws the history that a fragment rerun skips
+in a browser: its numbers are an upper bound.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from harness import REPO_ROOT, peak_rss_mb, environment, write_report  # noqa: E402
+
+ANSWER = ("To change that setting open **Settings > Advanced**, pick the profile and edit the value. "
+          "The change applies after a restart of the service.\n\n"
+          "1. Stop the service\n2. Edit the configuration\n3. Start it again\n\n") * 3
+
+
+def synthetic_messages(count):
+    messages = []
+    for index in range(count):
+        timestamp = f"{10 + index // 3600 % 12:02d}:{index // 60 % 60:02d}:{index % 60:02d}"
+        if index % 2 == 0:
+            messages.append({"role": "human", "content": f"How do I change setting number {index}?",
+                             "timestamp": timestamp, "seq": index})
+            continue
+        messages.append({
+            "role": "assistant",
+            "content": ANSWER,
+            "reasoning": "The user asks about a configuration option. " * 5,
+            "metrics": {"turn_seconds": 3.2, "ttft": 0.8, "tokens_per_sec": 24.0, "tokens": 180,
+                        "prompt_tokens": {"system": 40, "summary": 0, "history": 600, "context": 900,
+                                          "question": 12, "total": 1552, "verbatim_messages": 6}},
+            "trace": [{"name": "embed", "start": 0.0, "end": 0.05, "status": "ok"},
+                      {"name": "retrieve", "start": 0.05, "end": 0.2, "status": "ok"},
+                      {"name": "llm", "start": 0.2, "end": 3.2, "status": "ok"}],
+            "timestamp": timestamp,
+            "seq": index,
+        })
+    return messages
+
+
+class PayloadMeter:
+    """Counts the bytes of every ForwardMsg the script runner enqueues"""
+
+    def __init__(self):
+        from streamlit.runtime.forward_msg_queue import ForwardMsgQueue
+
+        self.bytes = 0
+        self.messages = 0
+        meter = self
+        original = ForwardMsgQueue.enqueue
+
+        def enqueue(queue, msg):
+            meter.bytes += msg.ByteSize()
+            meter.messages += 1
+            return original(queue, msg)
+        ForwardMsgQueue.enqueue = enqueue
+
+    def reset(self):
+        self.bytes = 0
+        self.messages = 0
+
+
+def seeded_app(script, messages, timeout):
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(script, default_timeout=timeout)
+    app.session_state["session_id"] = "bench"
+    app.session_state["messages"] = synthetic_messages(messages)
+    app.session_state["history_state"] = {}
+    app.session_state["first_seq"] = 0
+    app.session_state["history_shown"] = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+    app.query_params["session"] = "bench"
+    return app
+
+
+def measure(meter, interaction):
+    meter.reset()
+    started = time.perf_counter()
+    interaction()
+    return time.perf_counter() - started, meter.bytes, meter.messages
+
+
+def run_case(script, messages, repeat, timeout, meter):
+    samples = {"load": [], "setting": [], "send": []}
+    for _ in range(repeat):
+        app = seeded_app(script, messages, timeout)
+        samples["load"].append(measure(meter, app.run))
+        if app.exception:
+            raise RuntimeError(f"The page raised: {app.exception[0].value}")
+        slider = app.sidebar.slider[0]
+        samples["setting"].append(measure(meter, lambda: slider.set_value(slider.value % 10 + 1).run()))
+        samples["send"].append(measure(meter, lambda: app.chat_input[0].set_value("How do I reset it?").run()))
+
+    result = {"case": f"{messages}_messages", "messages": messages}
+    for interaction, runs in samples.items():
+        result[interaction] = {
+            "run_ms": statistics.median(seconds for seconds, _, _ in runs) * 1000,
+            "payload_kb": statistics.median(size for _, size, _ in runs) / 1024,
+            "forward_msgs": statistics.median(count for _, _, count in runs),
+        }
+    return result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--script", default=os.path.join(REPO_ROOT, "streamlitollama.py"))
+    arg_parser.add_argument("--messages", default="0,50,200,1000", help="Comma-separated session lengths")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="Runs per case; the median counts")
+    arg_parser.add_argument("--timeout", type=float, default=60)
+    arg_parser.add_argument("--output", help="Also write the JSON report here")
+    args = arg_parser.parse_args()
+
+    # No engine, store or metrics server: only the page itself is measured
+    os.environ["CHAT_API_URL"] = "http://127.0.0.1:9"
+    os.environ["CONVERSATION_STORE"] = ""
+    os.environ.pop("METRICS_PORT", None)
+    meter = PayloadMeter()
+
+    cases = []
+    for count in [int(n) for n in args.messages.split(",")]:
+        print(f"Session with {count} messages", file=sys.stderr)
+        cases.append(run_case(args.script, count, args.repeat, args.timeout, meter))
+
+    write_report({
+        "benchmark": "ui",
+        "environment": environment(),
+        "settings": {"script": os.path.relpath(args.script, REPO_ROOT), "repeat": args.repeat},
+        "cases": cases,
+        "peak_rss_mb": peak_rss_mb(),
+    }, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Check that importing the app's modules stays fast and leaves the heavy stacks unloaded.
+
+    python benchmarks/check_import_time.py
+    python benchmarks/check_import_time.py --scale 2 --output import_time.json
+
+Each module is imported in fresh interpreters under ``python -X importtime``;
+its best cumulative import time over --repeat runs is compared with a budget, and the modules that
+are supposed to load lazily (database driver, LangChain, audio, plotting)
+must not appear at all. streamlitollama is checked only where streamlit is
+installed. Exits with status 1 when any budget or laziness rule is broken.
+"""
+import argparse
+import importlib.util
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from harness import REPO_ROOT, environment, write_report  # noqa: E402
+
+# Milliseconds of cumulative import time; numpy alone is most of chat_engine's
+BUDGETS_MS = {
+    "chat_engine": 400,
+    "turn_pipeline": 250,
+    "telemetry": 120,
+    "api_client": 350,
+    "streamlitollama": 1500,
+}
+
+HEAVY = ("sqlalchemy", "langchain_community", "langchain_core", "soundfile", "sounddevice", "plotly", "psycopg2",
+         "onnxruntime", "tokenizers")
+# Modules each entry point must not import until they are actually needed
+MUST_NOT_IMPORT = {
+    "chat_engine": HEAVY + ("requests",),
+    "turn_pipeline": HEAVY,
+    "telemetry": HEAVY + ("http.server",),
+    "streamlitollama": HEAVY + ("chat_engine",),
+}
+# Whatever these import by themselves is not held against the module (streamlit loads plotly when installed)
+BASELINES = {"streamlitollama": "streamlit"}
+
+
+def import_times(module):
+    """{imported module: cumulative microseconds} for a cold ``import module``"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=REPO_ROOT, capture_output=True, text=True, timeout=120)
+    if result.returncode:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+    times = {}
+    for line in result.stderr.splitlines():
+        # "import time:       self [us] |  cumulative | imported package"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def check(module, budget_ms, forbidden, repeat=3):
+    # The fastest run is the least disturbed by whatever else the machine is doing
+    times = min((import_times(module) for _ in range(repeat)), key=lambda run: run[module])
+    import_ms = times[module] / 1000
+    baseline = import_times(BASELINES[module]) if module in BASELINES else {}
+    loaded = sorted(name for name in forbidden if name in times and name not in baseline)
+    slowest = sorted(((us, name) for name, us in times.items() if name != module and "." not in name),
+                     reverse=True)[:5]
+    return {
+        "case": module,
+        "import_ms": import_ms,
+        "budget_ms": budget_ms,
+        "modules": len(times),
+        "slowest_ms": {name: us / 1000 for us, name in slowest},
+        "unexpected_imports": loaded,
+        "ok": import_ms <= budget_ms and not loaded,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--modules", default=",".join(BUDGETS_MS))
+    arg_parser.add_argument("--repeat", type=int, default=3, help="Cold imports per module; the fastest counts")
+    arg_parser.add_argument("--scale", type=float, default=1.0, help="Multiply every budget (slow CI machines)")
+    arg_parser.add_argument("--output", help="Also write the JSON report here")
+    args = arg_parser.parse_args()
+
+    cases = []
+    for module in [name.strip() for name in args.modules.split(",") if name.strip()]:
+        if module == "streamlitollama" and importlib.util.find_spec("streamlit") is None:
+            print("Skipping streamlitollama: streamlit is not installed", file=sys.stderr)
+            continue
+        cases.append(check(module, BUDGETS_MS.get(module, 200) * args.scale, MUST_NOT_IMPORT.get(module, HEAVY),
+                           args.repeat))
+
+    write_report({"benchmark": "import_time", "environment": environment(), "cases": cases}, args.output)
+    for case in cases:
+        if not case["ok"]:
+            print(f"{case['case']}: {case['import_ms']:.0f}ms (budget {case['budget_ms']:.0f}ms), "
+                  f"unexpected imports: {', '.join(case['unexpected_imports']) or 'none'}", file=sys.stderr)
+    sys.exit(0 if all(case["ok"] for case in cases) else 1)
+
+
+if __name__ == "__main__":
+    main()
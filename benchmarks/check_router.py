@@ -0,0 +1,115 @@
+"""Check that LLMRouter's circuit breakers recover, against stub Ollama servers.
+
+    python benchmarks/check_router.py
+
+Each scenario half-opens a backend's breaker, lets the trial request end
+without a verdict (cancelled mid-stream, cancelled before its first token,
+or beaten by a hedge) and then checks that the next request still gets
+through. A last one checks that a passing health check closes a breaker
+that a failing one opened. Requests go through the real ChatOllama client.
+Exits with status 1 when any scenario fails.
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_router import Backend, CircuitBreaker, LLMRouter, backend_from_spec  # noqa: E402
+from stub_servers import start_in_thread  # noqa: E402
+
+RESET_TIMEOUT = 0.2
+MESSAGES = [("human", "How do I change the setting?")]
+
+
+def stub_backend(name, latency, health_check=None):
+    _, base_url = start_in_thread(latency=latency, token_delay=0.01)
+    backend = backend_from_spec({"name": name, "base_url": base_url}, "stub", temperature=0.0)
+    return Backend(name, backend.model, health_check=health_check,
+                   breaker=CircuitBreaker(reset_timeout=RESET_TIMEOUT))
+
+
+def half_open(backend):
+    backend.breaker.trip()
+    time.sleep(RESET_TIMEOUT * 1.5)
+    assert backend.breaker.state == "half-open", backend.breaker.state
+
+
+async def answer(router):
+    return "".join([chunk.content async for chunk in router.astream(MESSAGES)])
+
+
+async def trial_cancelled_mid_stream():
+    backend = stub_backend("only", latency=0.05)
+    router = LLMRouter([backend])
+    half_open(backend)
+    stream = router.astream(MESSAGES)
+    await stream.__anext__()
+    # What the Stop button does to a running turn
+    await stream.aclose()
+    return bool(await answer(router))
+
+
+async def trial_cancelled_before_first_token():
+    backend = stub_backend("only", latency=1.0)
+    router = LLMRouter([backend])
+    half_open(backend)
+    task = asyncio.ensure_future(answer(router))
+    await asyncio.sleep(0.2)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    return bool(await answer(router))
+
+
+async def trial_loses_hedge():
+    slow = stub_backend("slow", latency=1.0)
+    fast = stub_backend("fast", latency=0.05)
+    router = LLMRouter([slow, fast], hedge_after=0.1)
+    half_open(slow)
+    await answer(router)
+    if fast.stats["hedge_wins"] != 1:
+        return False
+    # The slow backend's trial slot is free again
+    return slow.breaker.allow()
+
+
+async def health_check_closes_breaker():
+    outcomes = [RuntimeError("down"), None]
+
+    def check():
+        outcome = outcomes.pop(0)
+        if outcome:
+            raise outcome
+    backend = stub_backend("checked", latency=0.05, health_check=check)
+    router = LLMRouter([backend])
+    router.check_health()
+    if backend.breaker.state != "open":
+        return False
+    router.check_health()
+    return backend.breaker.state == "closed" and bool(await answer(router))
+
+
+SCENARIOS = [trial_cancelled_mid_stream, trial_cancelled_before_first_token, trial_loses_hedge,
+             health_check_closes_breaker]
+
+
+def main():
+    failed = []
+    for scenario in SCENARIOS:
+        try:
+            ok = asyncio.run(asyncio.wait_for(scenario(), timeout=30))
+        except Exception as e:
+            print(f"{scenario.__name__}: {type(e).__name__}: {e}", file=sys.stderr)
+            ok = False
+        print(f"{'ok  ' if ok else 'FAIL'} {scenario.__name__}")
+        if not ok:
+            failed.append(scenario.__name__)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
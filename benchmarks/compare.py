@@ -0,0 +1,90 @@
+"""Compare two benchmark reports and flag regressions.
+
+    python benchmarks/bench_retrieval.py --output before.json
+    git checkout my-branch
+    python benchmarks/bench_retrieval.py --output after.json
+    python benchmarks/compare.py before.json after.json --threshold 0.1
+
+Latencies (*_ms, *_seconds) and memory (*_mb) are better lower, rates
+(*_per_sec) better higher; maxima and test-data generation times are
+ignored. Cases are matched by their "case" name. Exits with status 1 when
+any metric got worse by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+LOWER_IS_BETTER = ("_ms", "_seconds", "_mb")
+HIGHER_IS_BETTER = ("_per_sec",)
+# Single worst samples are too noisy to gate on; generating test data is not the code under test
+IGNORED = {"max_ms", "generate_seconds", "payload_seconds"}
+
+
+def flatten(report, prefix=""):
+    """{dotted path: number} for every numeric leaf; list items are keyed by their "case" name"""
+    values = {}
+    if isinstance(report, dict):
+        for key, value in report.items():
+            if key in ("environment", "settings"):
+                continue
+            values.update(flatten(value, f"{prefix}{key}."))
+    elif isinstance(report, list):
+        for index, item in enumerate(report):
+            name = item.get("case", index) if isinstance(item, dict) else index
+            values.update(flatten(item, f"{prefix}{name}."))
+    elif isinstance(report, (int, float)) and not isinstance(report, bool):
+        values[prefix.rstrip(".")] = report
+    return values
+
+
+def direction(path):
+    """+1 when higher is better, -1 when lower is better, 0 for counts and settings"""
+    name = path.rsplit(".", 1)[-1]
+    if name in IGNORED:
+        return 0
+    if name.endswith(HIGHER_IS_BETTER):
+        return 1
+    if name.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def compare(before, after, threshold):
+    """Rows of (path, before, after, relative change, regressed) for metrics in both reports"""
+    old, new = flatten(before), flatten(after)
+    rows = []
+    for path in sorted(set(old) & set(new)):
+        better = direction(path)
+        if not better or not old[path]:
+            continue
+        change = (new[path] - old[path]) / abs(old[path])
+        rows.append((path, old[path], new[path], change, change * better < -threshold))
+    return rows
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("before")
+    arg_parser.add_argument("after")
+    arg_parser.add_argument("--threshold", type=float, default=0.1, help="Relative change that counts as a regression")
+    arg_parser.add_argument("--all", action="store_true", help="List unchanged metrics too")
+    args = arg_parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    rows = compare(before, after, args.threshold)
+    regressions = 0
+    for path, old, new, change, regressed in rows:
+        regressions += regressed
+        if args.all or abs(change) > args.threshold:
+            marker = "REGRESSION" if regressed else ("improved" if abs(change) > args.threshold else "")
+            print(f"{path:60s} {old:12.3f} -> {new:12.3f} {change:+8.1%} {marker}")
+    print(f"{len(rows)} metrics compared, {regressions} regressed by more than {args.threshold:.0%}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
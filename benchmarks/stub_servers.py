@@ -0,0 +1,199 @@
+"""Local stand-ins for the remote services, for benchmarks and manual testing.
+
+    python benchmarks/stub_servers.py tts --port 8765 --latency 0.3
+    TTS_ENDPOINT=http://localhost:8765/tts streamlit run streamlitollama.py
+
+    python benchmarks/stub_servers.py ollama --port 11501 --latency 0.5
+    python benchmarks/stub_servers.py ollama --port 11502 --fail-rate 1
+    LLM_BACKENDS='[{"base_url": "http://localhost:11501"}, {"base_url": "http://localhost:11502"}]' \
+        streamlit run streamlitollama.py
+
+    python benchmarks/stub_servers.py whisper --port 8766 --latency 0.3
+    STT_ENDPOINT=http://localhost:8766/audio/translations streamlit run streamlitollama.py
+"""
+import argparse
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+import wave
+
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_RATE = 16000
+# 16 kHz mono 16-bit, for estimating the length of an uploaded recording
+BYTES_PER_AUDIO_SECOND = SAMPLE_RATE * 2
+EMBEDDING_DIM = 768
+STUB_ANSWER = ("<think>The context covers this directly.</think>According to the documents, the "
+               "configuration is stored in the settings file. Changes take effect after a restart. "
+               "Let me know if you need the exact steps.")
+
+
+def silent_wav(seconds):
+    """A valid mono 16-bit WAV of the given length"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(b"\x00\x00" * int(SAMPLE_RATE * seconds))
+    return buffer.getvalue()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Dispatches POSTs by path; per-server settings live on self.server"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _unavailable(self):
+        """Simulate an outage (server.down) or a failing share of requests (server.fail_rate)"""
+        if self.server.down or random.random() < self.server.fail_rate:
+            self._send(503, b'{"error": "stub unavailable"}', "application/json")
+            return True
+        return False
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/api/tags":
+            if self.server.down:
+                return self._send(503, b"down", "text/plain")
+            return self._send(200, json.dumps({"models": [{"name": "stub"}]}).encode(), "application/json")
+        self._send(404, b"not found", "text/plain")
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/tts") or path.endswith("/audio/speech"):
+            return self._tts()
+        if path.endswith("/audio/translations") or path.endswith("/audio/transcriptions"):
+            return self._transcribe()
+        if path == "/api/chat":
+            return self._chat()
+        if path == "/api/embeddings":
+            return self._embeddings()
+        self._send(404, b"not found", "text/plain")
+
+    def _tts(self):
+        payload = self._read_json()
+        text = payload.get("input", "")
+        with self.server.lock:
+            self.server.requests += 1
+        # Fixed latency plus a per-character cost, like a real synthesizer
+        time.sleep(self.server.latency + len(text) * self.server.per_char)
+        # Roughly 15 characters of speech per second
+        self._send(200, silent_wav(max(0.2, len(text) / 15)), "audio/wav")
+
+    def _transcribe(self):
+        """Whisper: `latency` plus `stt_factor` seconds per second of uploaded audio"""
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        with self.server.lock:
+            self.server.requests += 1
+            number = self.server.requests
+        if self._unavailable():
+            return
+        time.sleep(self.server.latency + length / BYTES_PER_AUDIO_SECOND * self.server.stt_factor)
+        # A different question each time, so transcribed turns do not all hit the caches
+        text = f"How do I change setting number {number} in the configuration?"
+        self._send(200, json.dumps({"text": text}).encode(), "application/json")
+
+    def _chat(self):
+        """Ollama /api/chat: `latency` before the first token, then one word every `token_delay`"""
+        payload = self._read_json()
+        with self.server.lock:
+            self.server.requests += 1
+        if self._unavailable():
+            return
+        time.sleep(self.server.latency)
+        words = STUB_ANSWER.replace("</think>", "</think> ").split(" ")
+        if not payload.get("stream", True):
+            body = {"model": payload.get("model"), "message": {"role": "assistant", "content": STUB_ANSWER},
+                    "done": True, "eval_count": len(words)}
+            return self._send(200, json.dumps(body).encode(), "application/json")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        try:
+            for word in words:
+                line = {"model": payload.get("model"), "message": {"role": "assistant", "content": word + " "},
+                        "done": False}
+                self.wfile.write(json.dumps(line).encode() + b"\n")
+                self.wfile.flush()
+                time.sleep(self.server.token_delay)
+            final = {"model": payload.get("model"), "message": {"role": "assistant", "content": ""},
+                     "done": True, "eval_count": len(words)}
+            self.wfile.write(json.dumps(final).encode() + b"\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client cancelled the stream
+            with self.server.lock:
+                self.server.cancelled += 1
+
+    def _embeddings(self):
+        """Ollama /api/embeddings: a deterministic unit vector per prompt"""
+        payload = self._read_json()
+        with self.server.lock:
+            self.server.requests += 1
+        if self._unavailable():
+            return
+        time.sleep(self.server.latency if self.server.embed_latency is None else self.server.embed_latency)
+        seed = int.from_bytes(hashlib.sha256(payload.get("prompt", "").encode()).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM)
+        vector /= np.linalg.norm(vector)
+        self._send(200, json.dumps({"embedding": vector.tolist()}).encode(), "application/json")
+
+
+def make_server(port=0, latency=0.2, per_char=0.002, token_delay=0.02, fail_rate=0.0, stt_factor=0.05,
+                embed_latency=None):
+    """``latency`` is the TTS or Whisper delay, or the Ollama time to first token (and embedding
+    delay unless ``embed_latency`` is given)"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.per_char = per_char
+    server.token_delay = token_delay
+    server.fail_rate = fail_rate
+    server.stt_factor = stt_factor
+    server.embed_latency = embed_latency
+    server.down = False
+    server.requests = 0
+    server.cancelled = 0
+    server.lock = threading.Lock()
+    return server
+
+
+def start_in_thread(**kwargs):
+    """Start a stub server on a free port; returns (server, base_url)"""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("service", choices=["tts", "ollama", "whisper"], help="Every endpoint is served either way")
+    arg_parser.add_argument("--port", type=int, default=8765)
+    arg_parser.add_argument("--latency", type=float, default=0.2, help="Seconds before responding")
+    arg_parser.add_argument("--token-delay", type=float, default=0.02, help="Seconds between streamed tokens")
+    arg_parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of Ollama/Whisper requests answered 503")
+    arg_parser.add_argument("--stt-factor", type=float, default=0.05, help="Whisper seconds per second of audio")
+    args = arg_parser.parse_args()
+
+    stub = make_server(port=args.port, latency=args.latency, token_delay=args.token_delay,
+                       fail_rate=args.fail_rate, stt_factor=args.stt_factor)
+    print(f"Stub {args.service} listening on http://127.0.0.1:{args.port}")
+    stub.serve_forever()
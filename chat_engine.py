@@ -0,0 +1,531 @@
+"""Retrieval, generation and speech behind the chat, importable by any front end
+
+Resources are built once per process on first use and shared by every
+session or request: the Streamlit app runs turns in-process through this
+module, and api_server.py serves the same functions over HTTP/WebSocket.
+
+Importing this module is kept cheap: LangChain integrations, SQLAlchemy and
+the audio stack are imported by the functions that first need them
+(benchmarks/check_import_time.py holds the budget).
+"""
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from tts_cache import TTSCache
+from embedding_cache import CachedEmbeddings
+from semantic_cache import SemanticCache
+from retrieval import StageTimer, CrossEncoderReranker, run_pipeline, reciprocal_rank_fusion
+from turn_pipeline import TurnPipeline, LoopThread
+from llm_router import LLMRouter, backend_from_spec
+from telemetry import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://sestrilevante.platform.myw.ai:11434")
+CHAT_MODEL = 'deepseek-r1:32b'
+
+# Chat backends as a JSON list; without it, CHAT_MODEL on the single OLLAMA_URL host. Example:
+# [{"name": "gpu-a", "base_url": "http://gpu-a:11434"},
+#  {"name": "gpu-b", "base_url": "http://gpu-b:11434", "weight": 2},
+#  {"name": "azure", "type": "azure", "deployment": "gpt-4o", "endpoint": "https://<resource>.openai.azure.com"}]
+LLM_BACKENDS = os.getenv("LLM_BACKENDS")
+LLM_ROUTING_POLICY = os.getenv("LLM_ROUTING_POLICY", "least_outstanding")  # or "latency"
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0")) or None  # seconds without a first token
+LLM_FIRST_TOKEN_TIMEOUT = float(os.getenv("LLM_FIRST_TOKEN_TIMEOUT", "60"))
+LLM_HEALTH_INTERVAL = float(os.getenv("LLM_HEALTH_INTERVAL", "15"))
+
+# Prompt construction
+SYSTEM_PROMPT = """You are a helpful and friendly assistant. 
+Use the context provided with each question to answer thoroughly yet concisely. 
+If you're not sure about something, be honest about it."""
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "3"))
+
+# Query embeddings: "ollama" on OLLAMA_URL, or "onnx" on this machine's CPU (see local_embeddings.py)
+EMBEDDING_MODEL = 'nomic-embed-text'
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "ollama")
+EMBEDDING_ONNX_MODEL = os.getenv("EMBEDDING_ONNX_MODEL", os.path.expanduser(
+    "~/.cache/chatbot-models/nomic-embed-text-v1.5/onnx/model_quantized.onnx"))
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))  # 0 uses every available core
+# Query embedding cache (set QUERY_CACHE_PATH="" to keep it in memory only)
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", os.path.expanduser("~/.cache/chatbot-query-embeddings.sqlite"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", str(7 * 24 * 3600)))
+# Seconds the batcher waits for concurrent queries to join a request to Ollama. The local model
+# waits for nothing: each batch is whatever queued while the previous one ran.
+QUERY_BATCH_WINDOW = float(os.getenv("QUERY_BATCH_WINDOW", "0" if EMBEDDING_BACKEND == "onnx" else "0.01"))
+
+# Semantic answer cache
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))
+
+# Speech service HTTP settings
+SPEECH_POOL_SIZE = int(os.getenv("SPEECH_POOL_SIZE", "10"))
+SPEECH_MAX_CONCURRENCY = int(os.getenv("SPEECH_MAX_CONCURRENCY", "8"))
+SPEECH_CONNECT_TIMEOUT = float(os.getenv("SPEECH_CONNECT_TIMEOUT", "3.05"))
+SPEECH_READ_TIMEOUT = float(os.getenv("SPEECH_READ_TIMEOUT", "60"))
+SPEECH_MAX_RETRIES = int(os.getenv("SPEECH_MAX_RETRIES", "3"))
+
+# TTS audio cache (set TTS_CACHE_DIR="" to keep it in memory only)
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.expanduser("~/.cache/chatbot-tts"))
+TTS_CACHE_MEMORY_MB = int(os.getenv("TTS_CACHE_MEMORY_MB", "32"))
+TTS_CACHE_DISK_MB = int(os.getenv("TTS_CACHE_DISK_MB", "512"))
+# Concurrent TTS requests per response in audio mode
+TTS_WORKERS = 3
+
+# Speech input (see speech_stream.py): pauses of STT_MIN_SILENCE seconds end a segment, and each
+# segment is transcribed while the rest is still recorded. Finished recordings longer than
+# STT_SEGMENT_LONGER_THAN seconds are cut the same way and their segments sent concurrently.
+STT_MIN_SILENCE = float(os.getenv("STT_MIN_SILENCE", "0.5"))
+STT_MAX_SEGMENT_SECONDS = float(os.getenv("STT_MAX_SEGMENT_SECONDS", "15"))
+STT_SEGMENT_LONGER_THAN = float(os.getenv("STT_SEGMENT_LONGER_THAN", "10"))
+STT_WORKERS = int(os.getenv("STT_WORKERS", "2"))
+
+# Vector search settings (see vector_store.py for index management)
+VECTOR_COLLECTION = os.getenv("PGVECTOR_COLLECTION")  # None searches every collection
+HNSW_EF_SEARCH = int(os.getenv("PGVECTOR_EF_SEARCH", "40"))
+IVFFLAT_PROBES = int(os.getenv("PGVECTOR_PROBES", "10"))
+# Retrieval post-processing (see retrieval.py)
+CANDIDATE_POOL_FACTOR = int(os.getenv("CANDIDATE_POOL_FACTOR", "4"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", "0.95"))
+RERANKER_MODEL = os.getenv("RERANKER_MODEL")  # e.g. cross-encoder/ms-marco-MiniLM-L-6-v2
+# "pgvector" pushes top-k into Postgres, "memory" scores the in-process embedding matrix
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "pgvector")
+EMBEDDING_REFRESH_SECONDS = float(os.getenv("EMBEDDING_REFRESH_SECONDS", "30"))
+# Root written by `python vector_snapshot.py <dir>`; mapped read-only at startup
+VECTOR_SNAPSHOT_DIR = os.getenv("VECTOR_SNAPSHOT_DIR")
+# Compact in-memory vectors for the memory backend: float16, int8 or pq (see quantization.py)
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION")
+RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", "10"))
+PQ_SUBSPACES = int(os.getenv("PQ_SUBSPACES", "48"))
+VECTOR_SPILL_DIR = os.getenv("VECTOR_SPILL_DIR")  # full-precision copies for re-scoring; default temp dir
+# Hybrid search: full-text matches (see text_search.py) fused with the vector candidates
+SEARCH_MODES = ("vector", "hybrid")
+SEARCH_MODE = os.getenv("SEARCH_MODE", "vector")  # default for callers that don't choose
+TEXT_SEARCH_CONFIG = os.getenv("TEXT_SEARCH_CONFIG", "english")
+TEXT_SEARCH_MAX_MATCHES = int(os.getenv("TEXT_SEARCH_MAX_MATCHES", "1000"))  # index hits ranked per query
+TEXT_SEARCH_TIMEOUT_MS = int(os.getenv("TEXT_SEARCH_TIMEOUT_MS", "250"))
+TEXT_SEARCH_WORKERS = int(os.getenv("TEXT_SEARCH_WORKERS", "4"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# Conversation history in Postgres (set CONVERSATION_STORE="" to keep it in the session only)
+CONVERSATION_STORE = os.getenv("CONVERSATION_STORE", "postgres")
+CONVERSATION_BATCH_SIZE = int(os.getenv("CONVERSATION_BATCH_SIZE", "200"))
+CONVERSATION_FLUSH_SECONDS = float(os.getenv("CONVERSATION_FLUSH_SECONDS", "0.5"))
+CONVERSATION_MAX_QUEUE = int(os.getenv("CONVERSATION_MAX_QUEUE", "10000"))
+
+
+def shared_resource(factory):
+    """Build the resource once per process on first call, like st.cache_resource"""
+    lock = threading.Lock()
+    built = []
+
+    @functools.wraps(factory)
+    def get():
+        if not built:
+            with lock:
+                if not built:
+                    built.append(factory())
+        return built[0]
+    return get
+
+
+# Initialize models
+@shared_resource
+def init_models():
+    if EMBEDDING_BACKEND == "onnx":
+        from local_embeddings import OnnxEmbeddings
+        embeddings = OnnxEmbeddings(EMBEDDING_ONNX_MODEL, threads=EMBEDDING_THREADS or None, registry=REGISTRY)
+    else:
+        from langchain_community.embeddings import OllamaEmbeddings
+        embeddings = OllamaEmbeddings(model = EMBEDDING_MODEL, base_url = OLLAMA_URL)
+
+    embeddings_model = CachedEmbeddings(
+        embeddings,
+        # Local and Ollama vectors differ slightly, so each backend keeps its own cache entries
+        model_name=EMBEDDING_MODEL if EMBEDDING_BACKEND != "onnx" else f"{EMBEDDING_MODEL}/onnx",
+        sqlite_path=QUERY_CACHE_PATH or None,
+        ttl=QUERY_CACHE_TTL,
+        batch_window=QUERY_BATCH_WINDOW
+    )
+
+    backend_specs = json.loads(LLM_BACKENDS) if LLM_BACKENDS else [{"name": "ollama", "base_url": OLLAMA_URL}]
+    chat_model = LLMRouter(
+        [backend_from_spec(spec, CHAT_MODEL, temperature=0.7) for spec in backend_specs],
+        policy=LLM_ROUTING_POLICY,
+        hedge_after=LLM_HEDGE_AFTER,
+        first_token_timeout=LLM_FIRST_TOKEN_TIMEOUT,
+        health_interval=LLM_HEALTH_INTERVAL
+    )
+    chat_model.start_health_checks()
+
+    return embeddings_model, chat_model
+
+@shared_resource
+def init_answer_cache():
+    """Answers shared across sessions for equivalent questions over the same documents"""
+    return SemanticCache(
+        threshold=ANSWER_CACHE_THRESHOLD,
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+        ttl=ANSWER_CACHE_TTL
+    )
+
+@shared_resource
+def init_speech_client():
+    """Pooled HTTP client shared by the TTS and Whisper calls of every session"""
+    from speech_client import SpeechClient
+    return SpeechClient(
+        pool_size=SPEECH_POOL_SIZE,
+        max_concurrency=SPEECH_MAX_CONCURRENCY,
+        connect_timeout=SPEECH_CONNECT_TIMEOUT,
+        read_timeout=SPEECH_READ_TIMEOUT,
+        max_retries=SPEECH_MAX_RETRIES,
+        registry=REGISTRY
+    )
+
+@shared_resource
+def init_STT_model():
+    from speech_client import PooledWhisperParser
+    # STT_ENDPOINT lets a local stub (benchmarks/stub_servers.py) stand in for Azure
+    endpoint = os.getenv("STT_ENDPOINT", "https://mywai-openai.openai.azure.com/openai/deployments/whisper/audio/translations?api-version=2024-06-01")
+    key = "83msI0RzecQTAiN6ay1cKOvu4EOiMafnhzBw8FfxVOzQ3ManWsVSJQQJ99AJAC5RqLJXJ3w3AAABACOGh0s0"
+    parser = PooledWhisperParser(init_speech_client(), endpoint=endpoint, api_key=key)
+    return parser
+
+@shared_resource
+def init_TTS_model():
+    """Initialize Azure TTS configuration"""
+    return {
+        # TTS_ENDPOINT lets a local stub (benchmarks/stub_servers.py) stand in for Azure
+        "endpoint": os.getenv("TTS_ENDPOINT", "https://agan-m4jr7rp0-swedencentral.cognitiveservices.azure.com/openai/deployments/tts/audio/speech"),
+        "api_key": "FD3zRAvrda5nxcoKaisV41Nl8zQIVmXodKX8C2jteMWGpEbXSEg3JQQJ99ALACfhMk5XJ3w3AAAAACOGLiYx",
+        "api_version": "2024-05-01-preview"
+    }
+
+@shared_resource
+def init_tts_cache():
+    """Audio cache shared by every session; the disk tier survives restarts"""
+    return TTSCache(
+        directory=TTS_CACHE_DIR or None,
+        memory_max_bytes=TTS_CACHE_MEMORY_MB * 1024 * 1024,
+        disk_max_bytes=TTS_CACHE_DISK_MB * 1024 * 1024
+    )
+
+def text_to_speech(text, voice):
+    """Convert text to speech, reusing cached audio for text already spoken in this voice"""
+    tts_config = init_TTS_model()
+    return init_tts_cache().get_or_synthesize(text, voice, tts_config["api_version"], request_speech)
+
+def request_speech(text, voice):
+    """Convert text to speech using Azure TTS"""
+    try:
+        tts_config = init_TTS_model()
+
+        logger.debug(f"Sending TTS request for {len(text)} characters with voice {voice}")
+
+        # Voice must be one of the allowed voices: nova, shimmer, echo, onyx, fable, alloy
+        response = init_speech_client().synthesize(
+            tts_config["endpoint"],
+            tts_config["api_key"],
+            tts_config["api_version"],
+            text,
+            voice
+        )
+
+        if response.status_code == 200:
+            return response.content
+        else:
+            logger.error(f"TTS Error: {response.status_code} - {response.text}")
+            # Add more detailed error logging
+            if response.text:
+                try:
+                    error_details = response.json()
+                    logger.error(f"Error details: {error_details}")
+                except:
+                    logger.error(f"Raw error response: {response.text}")
+            return None
+
+    except Exception as e:
+        logger.error(f"TTS processing error: {str(e)}", exc_info=True)
+        return None
+
+def process_audio_input(audio_bytes):
+    """Process audio input and convert to text using Azure Whisper"""
+    # The audio stack is only loaded once someone actually speaks
+    from langchain_core.documents.base import Blob
+    from audio_utils import prepare_for_transcription
+    try:
+        # Downmix/resample to 16 kHz mono in memory; fall back to the raw upload if decoding fails
+        try:
+            wav_bytes = prepare_for_transcription(audio_bytes)
+            logger.debug(f"Prepared audio for STT: {len(audio_bytes)} -> {len(wav_bytes)} bytes")
+        except Exception as e:
+            logger.warning(f"Could not resample audio, sending original: {str(e)}")
+            wav_bytes = audio_bytes
+
+        # Hand the bytes to the parser directly, no temporary file
+        audio_blob = Blob.from_data(wav_bytes, mime_type="audio/wav", path="recording.wav")
+
+        # Get the parser and convert speech to text
+        parser = init_STT_model()
+        docs = parser.parse(audio_blob)
+
+        if docs and len(docs) > 0:
+            return docs[0].page_content
+        return None
+
+    except Exception as e:
+        # Runs off the UI thread; callers report a None transcript
+        logger.error(f"Audio processing error: {str(e)}", exc_info=True)
+        return None
+
+def streaming_transcriber(rate):
+    """A StreamingTranscriber for audio at ``rate`` that sends its segments to Whisper"""
+    from speech_stream import EnergySegmenter, StreamingTranscriber
+    segmenter = EnergySegmenter(rate, min_silence=STT_MIN_SILENCE, max_segment=STT_MAX_SEGMENT_SECONDS)
+    return StreamingTranscriber(process_audio_input, rate, max_workers=STT_WORKERS, segmenter=segmenter,
+                                registry=REGISTRY)
+
+def transcribe_recording(audio_bytes):
+    """Transcribe a finished recording; long ones are cut at pauses and their segments sent concurrently"""
+    from audio_utils import decode_mono
+    try:
+        samples, rate = decode_mono(audio_bytes)
+    except Exception as e:
+        logger.warning(f"Could not decode recording, sending it whole: {str(e)}")
+        return process_audio_input(audio_bytes)
+    if len(samples) / rate <= STT_SEGMENT_LONGER_THAN:
+        return process_audio_input(audio_bytes)
+    transcriber = streaming_transcriber(rate)
+    transcriber.feed(samples)
+    text = transcriber.finish()
+    logger.debug(f"Transcribed {len(samples) / rate:.1f}s in {transcriber.segments} segments")
+    return text
+
+# Database connection
+@shared_resource
+def init_db():
+    from db import create_db_engine
+    return create_db_engine()
+
+@shared_resource
+def init_vector_backend():
+    """Detect once whether top-k search can run inside Postgres"""
+    from vector_store import describe_embedding_column, supports_vector_search
+    try:
+        info = describe_embedding_column(init_db())
+    except Exception as e:
+        logger.warning(f"Could not inspect embedding column, using full scan: {str(e)}")
+        return None
+    if not supports_vector_search(info):
+        logger.warning("pgvector not available, falling back to full-scan search")
+        return None
+    return info
+
+@shared_resource
+def init_embedding_store():
+    """Process-wide embedding matrix shared by every session"""
+    from embedding_store import EmbeddingStore
+    from vector_snapshot import open_snapshot
+    vector_info = init_vector_backend()
+    store = EmbeddingStore(
+        init_db(),
+        collection=VECTOR_COLLECTION,
+        # vector_send() needs the pgvector extension; otherwise parse the text form
+        binary=vector_info is not None,
+        refresh_interval=EMBEDDING_REFRESH_SECONDS,
+        quantization=VECTOR_QUANTIZATION,
+        rescore_factor=RESCORE_FACTOR,
+        pq_subspaces=PQ_SUBSPACES,
+        spill_dir=VECTOR_SPILL_DIR
+    )
+    if VECTOR_SNAPSHOT_DIR and os.path.exists(VECTOR_SNAPSHOT_DIR):
+        try:
+            store.attach_snapshot(open_snapshot(VECTOR_SNAPSHOT_DIR))
+        except Exception as e:
+            logger.warning(f"Could not map vector snapshot, loading from Postgres: {str(e)}")
+    # Tops up a snapshot with newer rows, or loads the whole table without one
+    store.refresh()
+    return store
+
+def uses_embedding_store():
+    return RETRIEVAL_BACKEND == "memory" or init_vector_backend() is None
+
+def fetch_candidates(query_embedding, pool_size):
+    """(score, content, vector) candidates from the configured vector backend"""
+    vector_info = init_vector_backend()
+    if RETRIEVAL_BACKEND == "pgvector" and vector_info is not None:
+        from vector_store import pgvector_search
+        try:
+            return pgvector_search(
+                init_db(), vector_info, query_embedding, pool_size,
+                collection=VECTOR_COLLECTION,
+                ef_search=max(HNSW_EF_SEARCH, pool_size),
+                probes=IVFFLAT_PROBES,
+                with_vectors=True
+            )
+        except Exception as e:
+            logger.error(f"pgvector search failed, falling back to full scan: {str(e)}", exc_info=True)
+
+    return init_embedding_store().search(query_embedding, pool_size, with_vectors=True)
+
+@shared_resource
+def init_text_search():
+    """Threads for the lexical half of hybrid search, or None when the full-text index is missing"""
+    from text_search import text_index_exists, index_name
+    try:
+        if not text_index_exists(init_db(), TEXT_SEARCH_CONFIG):
+            # Without the index every query would scan the table until the timeout
+            logger.warning(f"Full-text index {index_name(TEXT_SEARCH_CONFIG)} not found, hybrid search "
+                           f"falls back to vector search (build it with `python text_search.py`)")
+            return None
+    except Exception as e:
+        logger.warning(f"Could not check the full-text index, hybrid search disabled: {str(e)}")
+        return None
+    return ThreadPoolExecutor(max_workers=TEXT_SEARCH_WORKERS, thread_name_prefix="text-search")
+
+def fetch_lexical_candidates(query, pool_size):
+    """(rank, content, vector) full-text matches and the milliseconds they took"""
+    from text_search import text_search
+    started = time.perf_counter()
+    try:
+        hits = text_search(
+            init_db(), query, pool_size,
+            collection=VECTOR_COLLECTION,
+            config=TEXT_SEARCH_CONFIG,
+            max_matches=TEXT_SEARCH_MAX_MATCHES,
+            timeout_ms=TEXT_SEARCH_TIMEOUT_MS,
+            binary=init_vector_backend() is not None
+        )
+    except Exception as e:
+        logger.error(f"Text search failed, using vector results only: {str(e)}", exc_info=True)
+        hits = []
+    return hits, (time.perf_counter() - started) * 1000
+
+@shared_resource
+def init_reranker():
+    return CrossEncoderReranker(RERANKER_MODEL) if RERANKER_MODEL else None
+
+# Search function
+def search_documents(query, top_k=5, min_similarity=0.0, query_embedding=None, search_mode=None):
+    """Return (results, timings): the top_k (score, content) pairs and per-stage milliseconds
+
+    ``search_mode`` "hybrid" also runs a full-text search, in parallel with
+    the vector search, and fuses both rankings with reciprocal-rank fusion.
+    """
+    search_mode = search_mode or SEARCH_MODE
+    if search_mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode {search_mode!r}; expected one of {', '.join(SEARCH_MODES)}")
+    timer = StageTimer()
+    if query_embedding is None:
+        with timer.stage("embed"):
+            query_embedding = init_models()[0].embed_query(query)
+    query_embedding = np.array(query_embedding)
+
+    # Pull a wider pool than needed so thresholding, reranking and MMR have room to work
+    pool_size = max(top_k * CANDIDATE_POOL_FACTOR, top_k)
+    text_pool = init_text_search() if search_mode == "hybrid" else None
+    lexical = text_pool.submit(fetch_lexical_candidates, query, pool_size) if text_pool else None
+    with timer.stage("candidates"):
+        candidates = fetch_candidates(query_embedding, pool_size)
+
+    relevance = None
+    if lexical is not None:
+        lexical_hits, timer.timings["lexical"] = lexical.result()
+        with timer.stage("fuse"):
+            candidates, relevance = reciprocal_rank_fusion(
+                [candidates, lexical_hits], query_embedding, pool_size,
+                min_similarity=min_similarity, k=RRF_K
+            )
+
+    results = run_pipeline(
+        candidates, query, top_k,
+        min_similarity=min_similarity,
+        mmr_lambda=MMR_LAMBDA,
+        duplicate_threshold=DUPLICATE_THRESHOLD,
+        reranker=init_reranker(),
+        timer=timer,
+        relevance=relevance
+    )
+    logger.debug(f"Retrieval timings (ms): {timer.timings}")
+    return results, timer.timings
+
+@shared_resource
+def init_conversation_store():
+    """Write-behind conversation log shared by every session, or None when disabled or unreachable"""
+    if not CONVERSATION_STORE:
+        return None
+    from conversation_store import ConversationStore
+    try:
+        return ConversationStore(
+            init_db(),
+            batch_size=CONVERSATION_BATCH_SIZE,
+            flush_interval=CONVERSATION_FLUSH_SECONDS,
+            max_queue=CONVERSATION_MAX_QUEUE,
+            registry=REGISTRY
+        )
+    except Exception as e:
+        logger.warning(f"Conversation store unavailable, history is kept per session only: {str(e)}")
+        return None
+
+def warm_retrieval():
+    """Bring the in-process embedding matrix up to date while the question is embedded"""
+    if uses_embedding_store():
+        init_embedding_store().maybe_refresh()
+
+@shared_resource
+def init_turn_loop():
+    """Event loop thread for callers that are not async themselves"""
+    return LoopThread()
+
+@shared_resource
+def init_turn_pipeline():
+    from history_manager import HistoryManager
+    embeddings_model, chat_model = init_models()
+    return TurnPipeline(
+        embeddings=embeddings_model,
+        chat_model=chat_model,
+        search=lambda query, query_embedding, top_k, min_similarity, search_mode: search_documents(
+            query, top_k, min_similarity, query_embedding=query_embedding, search_mode=search_mode
+        ),
+        # Recent turns verbatim, older ones summarized
+        history=HistoryManager(
+            summarize=lambda summary_prompt: chat_model.invoke(summary_prompt).content,
+            system_prompt=SYSTEM_PROMPT,
+            token_budget=PROMPT_TOKEN_BUDGET,
+            keep_turns=HISTORY_KEEP_TURNS
+        ),
+        answer_cache=init_answer_cache(),
+        transcribe=transcribe_recording,
+        synthesize=text_to_speech,
+        warm=warm_retrieval,
+        tts_workers=TTS_WORKERS,
+        registry=REGISTRY
+    )
+
+def model_key(temperature):
+    """Answer cache partition for the chat model at this temperature (passed to the backends per turn)"""
+    return f"{CHAT_MODEL}@{temperature}"
+
+def engine_stats():
+    """Statistics of the shared caches, clients and stores, for the Analytics tab"""
+    return {
+        # Every turn this process has served, whichever session it came from
+        "stages": REGISTRY.snapshot("chatbot_stage_seconds", "stage"),
+        "turns": REGISTRY.counters("chatbot_turns_total", "outcome"),
+        "llm": init_models()[1].stats(),
+        "answer_cache": init_answer_cache().stats(),
+        "query_embeddings": init_models()[0].stats(),
+        "local_embeddings": init_models()[0].embeddings.stats() if EMBEDDING_BACKEND == "onnx" else None,
+        "speech": init_speech_client().stats(),
+        "tts_cache": init_tts_cache().stats(),
+        "embedding_store": init_embedding_store().stats() if uses_embedding_store() else None,
+    }
@@ -0,0 +1,324 @@
+"""Durable chat history in Postgres, written behind the request path in batches
+
+Two tables: ``chat_sessions`` (one row per conversation, with the history
+manager's summary state) and ``chat_messages`` (one row per message).
+Messages are keyed by (session_id, seq), which is also the index history
+pages are read through; a BRIN index on created_at serves time-window
+queries over every session, and stays tiny because rows arrive in time order.
+"""
+import atexit
+import json
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+SESSIONS_TABLE = "chat_sessions"
+MESSAGES_TABLE = "chat_messages"
+# Message keys with columns of their own; everything else goes into metadata
+_COLUMNS = ("role", "content")
+
+
+def ensure_schema(engine):
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {SESSIONS_TABLE} (
+                session_id TEXT PRIMARY KEY,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                state JSONB
+            )
+        """))
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {MESSAGES_TABLE} (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL,
+                metadata JSONB,
+                PRIMARY KEY (session_id, seq)
+            )
+        """))
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS {MESSAGES_TABLE}_created_at_idx
+            ON {MESSAGES_TABLE} USING brin (created_at)
+        """))
+
+
+def _to_message(row):
+    """A stored row in the shape the app keeps in session state"""
+    message = dict(row.metadata or {})
+    message.update({"role": row.role, "content": row.content, "seq": row.seq})
+    return message
+
+
+class ConversationStore:
+    """Append-only conversation log with a write-behind queue.
+
+    ``append()`` only queues the message; a background thread inserts queued
+    messages in multi-row batches every ``flush_interval`` seconds (sooner
+    once ``batch_size`` are waiting). A failed batch is retried with backoff,
+    and duplicates from a retry are ignored by the primary key. When the
+    queue holds ``max_queue`` messages, e.g. during a database outage, new
+    messages are dropped and counted rather than blocking the chat.
+
+    Reads see queued messages too, so a session reloaded right after a turn
+    is complete before its messages reach the database.
+    """
+
+    def __init__(self, engine, batch_size=200, flush_interval=0.5, max_queue=10000,
+                 registry=None, create_schema=True):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.registry = registry
+
+        if create_schema:
+            ensure_schema(engine)
+
+        self._queue = deque()
+        self._states = {}  # session_id -> latest state not yet written, as JSON
+        self._cond = threading.Condition()
+        self._closed = False
+        self._flush_requested = False
+        self._in_flight = []  # the batch being written, still visible to reads
+        self._stats = {
+            "queued": 0,
+            "written": 0,
+            "dropped": 0,
+            "failed_batches": 0,
+            "batches": 0,
+            "flush_seconds": 0.0,
+        }
+        if registry is not None:
+            registry.describe("chatbot_conversation_writes_total", "Conversation messages by write outcome")
+            registry.describe("chatbot_conversation_flush_seconds", "Duration of one batched conversation write")
+            registry.gauge("chatbot_conversation_queue_depth", lambda: len(self._queue),
+                           help="Conversation messages waiting to be written")
+
+        self._thread = threading.Thread(target=self._run, name="conversation-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def append(self, session_id, seq, message, state=None):
+        """Queue one message (a dict with role and content); ``state`` replaces the session's state"""
+        row = {
+            "session_id": session_id,
+            "seq": int(seq),
+            "role": message["role"],
+            "content": message["content"],
+            "created_at": datetime.now(timezone.utc),
+            "metadata": {key: value for key, value in message.items() if key not in _COLUMNS and key != "seq"},
+        }
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self._stats["dropped"] += 1
+                self._count("dropped")
+                logger.warning(f"Conversation queue full, dropping message {seq} of session {session_id}")
+                return False
+            self._queue.append(row)
+            if state is not None:
+                # Serialized now: the caller keeps updating its state dict in place
+                self._states[session_id] = json.dumps(state, default=str)
+            self._stats["queued"] += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    def _count(self, outcome, value=1):
+        if self.registry is not None:
+            self.registry.increment("chatbot_conversation_writes_total", value, outcome=outcome)
+
+    def _run(self):
+        backoff = self.flush_interval
+        while True:
+            with self._cond:
+                # A trickle of messages gets the whole interval to form a batch
+                deadline = time.monotonic() + self.flush_interval
+                while (len(self._queue) < self.batch_size and not self._closed and not self._flush_requested
+                       and time.monotonic() < deadline):
+                    self._cond.wait(deadline - time.monotonic())
+                self._flush_requested = False
+                if not self._queue and not self._states:
+                    if self._closed:
+                        return
+                    continue
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                # States stay in place (and readable) until they are written
+                states = dict(self._states)
+                self._in_flight = batch
+
+            started = time.perf_counter()
+            try:
+                self._write(batch, states)
+            except Exception as e:
+                with self._cond:
+                    # Back to the front, in order, for the next attempt
+                    self._queue.extendleft(reversed(batch))
+                    self._in_flight = []
+                    self._stats["failed_batches"] += 1
+                    closed = self._closed
+                self._count("failed", len(batch))
+                logger.error(f"Writing {len(batch)} conversation messages failed, retrying in {backoff:.1f}s: {str(e)}")
+                if closed:
+                    return
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+
+            elapsed = time.perf_counter() - started
+            backoff = self.flush_interval
+            with self._cond:
+                self._in_flight = []
+                for session_id, state in states.items():
+                    if self._states.get(session_id) is state:
+                        del self._states[session_id]
+                self._stats["written"] += len(batch)
+                self._stats["batches"] += 1
+                self._stats["flush_seconds"] += elapsed
+                self._cond.notify_all()
+            self._count("written", len(batch))
+            if self.registry is not None:
+                self.registry.observe("chatbot_conversation_flush_seconds", elapsed)
+
+    def _write(self, batch, states):
+        sessions = {row["session_id"]: row["created_at"] for row in batch}
+        for session_id in states:
+            sessions.setdefault(session_id, datetime.now(timezone.utc))
+        session_rows = [
+            {"session_id": session_id, "created_at": created_at,
+             "state": states.get(session_id)}
+            for session_id, created_at in sessions.items()
+        ]
+        with self.engine.begin() as conn:
+            conn.execute(text(f"""
+                INSERT INTO {SESSIONS_TABLE} (session_id, created_at, updated_at, state)
+                VALUES {self._values(len(session_rows), "(:session_id{i}, :created_at{i}, :created_at{i}, CAST(:state{i} AS jsonb))")}
+                ON CONFLICT (session_id) DO UPDATE
+                SET updated_at = EXCLUDED.updated_at,
+                    state = COALESCE(EXCLUDED.state, {SESSIONS_TABLE}.state)
+            """), self._params(session_rows))
+            if batch:
+                message_rows = [{**row, "metadata": json.dumps(row["metadata"], default=str)} for row in batch]
+                # One multi-row INSERT per batch instead of a round trip per message
+                conn.execute(text(f"""
+                    INSERT INTO {MESSAGES_TABLE} (session_id, seq, role, content, created_at, metadata)
+                    VALUES {self._values(len(message_rows), "(:session_id{i}, :seq{i}, :role{i}, :content{i}, :created_at{i}, CAST(:metadata{i} AS jsonb))")}
+                    ON CONFLICT (session_id, seq) DO NOTHING
+                """), self._params(message_rows))
+
+    @staticmethod
+    def _values(count, template):
+        return ", ".join(template.format(i=i) for i in range(count))
+
+    @staticmethod
+    def _params(rows):
+        return {f"{key}{i}": value for i, row in enumerate(rows) for key, value in row.items()}
+
+    def _pending(self, session_id):
+        with self._cond:
+            rows = [row for row in (*self._in_flight, *self._queue) if row["session_id"] == session_id]
+            state = self._states.get(session_id)
+            return rows, json.loads(state) if state is not None else None
+
+    def load_session(self, session_id, limit=20):
+        """(latest ``limit`` messages oldest first, history state, total messages) for a session"""
+        pending, pending_state = self._pending(session_id)
+        with self.engine.connect() as conn:
+            state = conn.execute(text(f"SELECT state FROM {SESSIONS_TABLE} WHERE session_id = :session_id"),
+                                 {"session_id": session_id}).scalar()
+            total = conn.execute(text(f"""
+                SELECT coalesce(max(seq) + 1, 0) FROM {MESSAGES_TABLE} WHERE session_id = :session_id
+            """), {"session_id": session_id}).scalar()
+        messages = self.messages_before(session_id, None, limit, pending=pending)
+        if pending:
+            total = max(total, max(row["seq"] for row in pending) + 1)
+        return messages, pending_state if pending_state is not None else state, total
+
+    def messages_before(self, session_id, before_seq=None, limit=20, pending=None):
+        """Up to ``limit`` messages with seq < ``before_seq`` (the newest when None), oldest first"""
+        if pending is None:
+            pending, _ = self._pending(session_id)
+        params = {"session_id": session_id, "limit": int(limit)}
+        condition = ""
+        if before_seq is not None:
+            condition = "AND seq < :before_seq"
+            params["before_seq"] = int(before_seq)
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(f"""
+                SELECT seq, role, content, metadata
+                FROM {MESSAGES_TABLE}
+                WHERE session_id = :session_id {condition}
+                ORDER BY seq DESC
+                LIMIT :limit
+            """), params).fetchall()
+        messages = {row.seq: _to_message(row) for row in rows}
+        for row in pending:
+            if before_seq is None or row["seq"] < before_seq:
+                messages[row["seq"]] = {**row["metadata"], "role": row["role"], "content": row["content"],
+                                        "seq": row["seq"]}
+        return [messages[seq] for seq in sorted(messages)[-limit:]]
+
+    def activity(self, hours=24):
+        """Sessions, questions, answers and answer latency over every session in the last ``hours``"""
+        with self.engine.connect() as conn:
+            row = conn.execute(text(f"""
+                SELECT count(DISTINCT session_id) AS sessions,
+                       count(*) FILTER (WHERE role = 'human') AS questions,
+                       count(*) FILTER (WHERE role = 'assistant') AS answers,
+                       percentile_cont(0.5) WITHIN GROUP (ORDER BY (metadata->'metrics'->>'turn_seconds')::float) AS p50,
+                       percentile_cont(0.95) WITHIN GROUP (ORDER BY (metadata->'metrics'->>'turn_seconds')::float) AS p95
+                FROM {MESSAGES_TABLE}
+                WHERE created_at >= now() - make_interval(hours => :hours)
+            """), {"hours": int(hours)}).one()
+            per_hour = conn.execute(text(f"""
+                SELECT date_trunc('hour', created_at) AS hour, count(*) AS messages
+                FROM {MESSAGES_TABLE}
+                WHERE created_at >= now() - make_interval(hours => :hours)
+                GROUP BY 1
+                ORDER BY 1
+            """), {"hours": int(hours)}).fetchall()
+        return {
+            "sessions": row.sessions,
+            "questions": row.questions,
+            "answers": row.answers,
+            "turn_seconds_p50": row.p50,
+            "turn_seconds_p95": row.p95,
+            "messages_per_hour": [(hour.isoformat(), count) for hour, count in per_hour],
+        }
+
+    def flush(self, timeout=5.0):
+        """Wait until everything queued so far is written; False on timeout"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._queue or self._states or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(min(remaining, self.flush_interval))
+        return True
+
+    def close(self, timeout=5.0):
+        """Write what is queued (for up to ``timeout`` seconds) and stop the writer"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queue_depth"] = len(self._queue) + len(self._in_flight)
+        stats["messages_per_flush_second"] = stats["written"] / stats["flush_seconds"] if stats["flush_seconds"] else None
+        return stats
@@ -0,0 +1,243 @@
+"""Query-embedding cache with request coalescing, in front of a LangChain embeddings model"""
+import hashlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text):
+    """Case- and whitespace-insensitive form of a query"""
+    return " ".join(unicodedata.normalize("NFKC", text).lower().split())
+
+
+def embed_queries(embeddings, texts):
+    """Embed several queries in one call, keeping the model's query-side instruction.
+
+    langchain_community's OllamaEmbeddings prefixes queries and documents
+    differently ("query: " vs "passage: "), so calling embed_documents on
+    queries would change the vectors. Use its raw _embed with the query
+    prefix when available.
+    """
+    query_instruction = getattr(embeddings, "query_instruction", None)
+    if query_instruction is not None and hasattr(embeddings, "_embed"):
+        return embeddings._embed([f"{query_instruction}{text}" for text in texts])
+    return embeddings.embed_documents(texts)
+
+
+class QueryBatcher:
+    """Coalesce embed requests arriving within ``window`` seconds into one batch call"""
+
+    def __init__(self, embed_batch, window=0.01, max_batch=32):
+        self.embed_batch = embed_batch
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = OrderedDict()  # text -> Future, so duplicates share one slot
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+        self._thread.start()
+        self.batches = 0
+        self.batched_texts = 0
+
+    def submit(self, text):
+        with self._cond:
+            future = self._pending.get(text)
+            if future is None:
+                future = Future()
+                self._pending[text] = future
+                self._cond.notify()
+            return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            # Let concurrent callers join the batch
+            time.sleep(self.window)
+            with self._cond:
+                batch = []
+                while self._pending and len(batch) < self.max_batch:
+                    batch.append(self._pending.popitem(last=False))
+            texts = [text for text, _ in batch]
+            try:
+                vectors = list(self.embed_batch(texts))
+                if len(vectors) != len(texts):
+                    raise RuntimeError(f"Embedding backend returned {len(vectors)} vectors for {len(texts)} texts")
+            except Exception as e:
+                # Every caller is waiting on its future; none may be left unresolved
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.batched_texts += len(texts)
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+
+class SQLiteVectors:
+    """The on-disk tier: reads on pooled connections, writes on one writer thread.
+
+    Callers never wait on each other's disk I/O: each read borrows a
+    connection of its own, and ``put`` only queues the row. The writer
+    commits whatever has queued up in one transaction. WAL mode lets reads
+    proceed while it does.
+    """
+
+    def __init__(self, path, model_name):
+        self.path = path
+        self._readers = queue.SimpleQueue()
+        self._writes = queue.SimpleQueue()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        db = self._connect()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS query_embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                vector BLOB NOT NULL
+            )
+        """)
+        db.execute("DELETE FROM query_embeddings WHERE model != ? OR expires_at < ?",
+                   (model_name, time.time()))
+        db.commit()
+        self._thread = threading.Thread(target=self._write_loop, args=(db,), name="embed-cache-writer",
+                                        daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def get(self, key, now):
+        """(vector bytes, expires_at) of a live row, or None"""
+        try:
+            db = self._readers.get_nowait()
+        except queue.Empty:
+            db = self._connect()
+        try:
+            return db.execute(
+                "SELECT vector, expires_at FROM query_embeddings WHERE key = ? AND expires_at > ?",
+                (key, now)
+            ).fetchone()
+        finally:
+            self._readers.put(db)
+
+    def put(self, key, model_name, expires_at, vector):
+        self._writes.put((key, model_name, expires_at, np.asarray(vector, dtype=np.float32).tobytes()))
+
+    def _write_loop(self, db):
+        while True:
+            rows = [self._writes.get()]
+            while True:
+                try:
+                    rows.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                db.executemany(
+                    "INSERT OR REPLACE INTO query_embeddings (key, model, expires_at, vector) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Could not persist {len(rows)} query embeddings: {str(e)}")
+
+
+class CachedEmbeddings:
+    """Drop-in wrapper exposing embed_query/embed_documents with a two-tier query cache.
+
+    Entries are keyed by the model name and the normalized query, so switching
+    models never serves stale vectors; rows for other models are purged from
+    the SQLite tier on startup. Documents are passed straight through.
+    """
+
+    def __init__(self, embeddings, model_name, sqlite_path=None, ttl=7 * 24 * 3600,
+                 max_entries=10_000, batch_window=0.01, max_batch=32):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (vector, expires_at)
+        self._batcher = QueryBatcher(lambda texts: embed_queries(embeddings, texts),
+                                     window=batch_window, max_batch=max_batch)
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+        self._db = SQLiteVectors(sqlite_path, model_name) if sqlite_path else None
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\x1f{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector, expires_at):
+        self._memory[key] = (vector, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return entry[0]
+                del self._memory[key]
+
+        # The lock only guards the in-memory tier; disk reads run concurrently
+        row = self._db.get(key, now) if self._db is not None else None
+        with self._lock:
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+            self._remember(key, vector, row[1])
+            self._stats["disk_hits"] += 1
+            return vector
+
+    def _store(self, key, vector):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, vector, expires_at)
+        if self._db is not None:
+            self._db.put(key, self.model_name, expires_at, vector)
+
+    def embed_query(self, text):
+        key = self._key(text)
+        vector = self._lookup(key)
+        if vector is not None:
+            return vector
+        # Identical normalized queries in flight at the same time share one request
+        vector = list(self._batcher.submit(normalize_query(text)).result())
+        self._store(key, vector)
+        return vector
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def stats(self):
+        with self._lock:
+            hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+            lookups = hits + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "batches": self._batcher.batches,
+                "avg_batch_size": (self._batcher.batched_texts / self._batcher.batches
+                                   if self._batcher.batches else 0.0),
+            }
@@ -0,0 +1,433 @@
+"""Process-wide in-memory copy of langchain_pg_embedding for vectorized search"""
+import logging
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+from vector_store import EMBEDDING_TABLE, COLLECTION_TABLE, decode_vector_send
+from retrieval import top_k_indices
+from vector_snapshot import source_state, snapshot_freshness, write_snapshot
+from quantization import CODECS, make_codec, encode_in_chunks, VectorSpill
+
+logger = logging.getLogger(__name__)
+
+# Rows sampled from a snapshot to train product quantization codebooks
+PQ_TRAIN_ROWS = 50_000
+# k-means needs a few dozen points per centroid (256 per subspace) for usable
+# codebooks; with fewer rows loaded the store stays at full precision
+PQ_MIN_TRAIN_ROWS = 10_000
+
+
+def parse_vector_text(values):
+    """Parse '[x,y,...]' text vectors with numpy's C parser instead of a float() loop"""
+    if not values:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.vstack([np.fromstring(v.strip("[]"), dtype=np.float32, sep=",") for v in values])
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class StoreView:
+    """Immutable view over the snapshot rows followed by the rows loaded from Postgres.
+
+    ``base`` and ``delta`` are always full precision; with a ``codec`` the
+    scores come from ``base_codes`` and ``delta_codes`` instead.
+    """
+
+    def __init__(self, base, delta, base_contents, delta_contents, base_ids, delta_ids,
+                 codec=None, base_codes=None, delta_codes=None):
+        self.base = base
+        self.delta = delta
+        self._base_contents = base_contents
+        self._delta_contents = delta_contents
+        self._base_ids = base_ids
+        self._delta_ids = delta_ids
+        self.codec = codec
+        self.base_codes = base_codes
+        self.delta_codes = delta_codes
+
+    def __len__(self):
+        return len(self.base) + len(self.delta)
+
+    def scores(self, query):
+        """Cosine similarity of every row, approximate when the rows are quantized"""
+        if self.codec is not None:
+            base, delta = self.base_codes, self.delta_codes
+            score = lambda rows: self.codec.scores(rows, query)  # noqa: E731
+        else:
+            base, delta = self.base, self.delta
+            score = lambda rows: rows @ query  # noqa: E731
+        if len(base) == 0:
+            return score(delta)
+        if len(delta) == 0:
+            return score(base)
+        return np.concatenate([score(base), score(delta)])
+
+    def vectors(self, indices):
+        return np.stack([self.base[i] if i < len(self.base) else self.delta[i - len(self.base)]
+                         for i in indices])
+
+    def content(self, index):
+        if index < len(self.base):
+            return self._base_contents[index]
+        return self._delta_contents[index - len(self.base)]
+
+    def id(self, index):
+        if index < len(self.base):
+            return self._base_ids[index]
+        return self._delta_ids[index - len(self.base)]
+
+
+class EmbeddingStore:
+    """Contiguous, L2-normalized float32 matrix of every stored embedding.
+
+    Rows are loaded once and then topped up incrementally: each refresh only
+    fetches rows whose ``id`` is greater than the highest id already loaded, so
+    ids must grow monotonically for new rows to be picked up. Call ``reload()``
+    after deletes or re-ingestion.
+
+    A memory-mapped snapshot (see vector_snapshot.py) can serve as the base of
+    the store; only rows newer than the snapshot are then read from Postgres.
+
+    With ``quantization`` ("float16", "int8" or "pq", see quantization.py)
+    the heap holds only compact codes. Searches shortlist ``top_k *
+    rescore_factor`` rows on the codes and re-score the shortlist at full
+    precision, read from the snapshot's memory map or from a temporary spill
+    file in ``spill_dir``. Product quantization codebooks are trained once
+    ``PQ_MIN_TRAIN_ROWS`` rows are loaded, on a sample of the snapshot and the
+    loaded rows; until then searches are exact. ``reload()`` retrains them.
+    """
+
+    def __init__(self, engine, collection=None, binary=True, refresh_interval=30.0,
+                 batch_size=10_000, quantization=None, rescore_factor=10, pq_subspaces=48,
+                 spill_dir=None):
+        if quantization not in (None, "", "float32", *CODECS):
+            raise ValueError(f"Unknown vector quantization {quantization!r}")
+        self.engine = engine
+        self.collection = collection
+        self.binary = binary
+        self.refresh_interval = refresh_interval
+        self.batch_size = batch_size
+        self.quantization = quantization if quantization in CODECS else None
+        self.rescore_factor = rescore_factor
+        self.pq_subspaces = pq_subspaces
+        self.spill_dir = spill_dir
+
+        self._lock = threading.Lock()          # guards the arrays readers see
+        self._refresh_lock = threading.Lock()  # serializes database loads
+        self._snapshot = None
+        self._base = np.empty((0, 0), dtype=np.float32)
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._size = 0
+        self._contents = []
+        self._ids = []
+        self._codec = None
+        self._base_codes = np.empty((0, 0), dtype=np.uint8)
+        self._spill = None
+        self._watermark = None
+        self._last_refresh = 0.0
+        self._stats = {
+            "hits": 0,
+            "refreshes": 0,
+            "rows_loaded": 0,
+            "last_refresh_rows": 0,
+            "last_refresh_seconds": 0.0,
+            "snapshot": None,
+            "snapshot_state": None,
+        }
+
+    def __len__(self):
+        return len(self._base) + self._size
+
+    @property
+    def watermark(self):
+        return self._watermark
+
+    def attach_snapshot(self, snapshot):
+        """Serve a memory-mapped snapshot as the base of the store.
+
+        Returns False (and leaves the store untouched) when the live table has
+        diverged from the snapshot, e.g. after deletes; rows added since the
+        export are picked up by the next refresh.
+        """
+        manifest = snapshot.manifest
+        row_count, max_id = source_state(self.engine, self.collection)
+        state = snapshot_freshness(manifest, row_count, max_id)
+        if manifest.get("collection") != self.collection:
+            state = "diverged"
+        self._stats["snapshot_state"] = state
+        if state == "diverged":
+            logger.warning(f"Snapshot {snapshot.path} is out of date ({manifest['source_rows']} rows "
+                           f"exported, {row_count} in table); loading from Postgres instead")
+            return False
+
+        with self._refresh_lock:
+            codec, base_codes = None, np.empty((0, 0), dtype=np.uint8)
+            if self.quantization and len(snapshot.matrix):
+                # One pass over the map; afterwards the kernel may evict pages that are never re-scored
+                started = time.perf_counter()
+                matrix = snapshot.matrix
+                codec = self._train_codec(matrix[::max(1, len(matrix) // PQ_TRAIN_ROWS)])
+                if codec is not None:
+                    base_codes = encode_in_chunks(codec, matrix)
+                    logger.info(f"Encoded {len(matrix)} snapshot rows as {self.quantization} "
+                                f"in {time.perf_counter() - started:.2f}s")
+
+            with self._lock:
+                self._snapshot = snapshot
+                self._base = snapshot.matrix
+                self._codec = codec
+                self._base_codes = base_codes
+                self._matrix = np.empty((0, 0), dtype=np.float32)
+                self._size = 0
+                self._contents = []
+                self._ids = []
+                self._reset_spill()
+                self._watermark = manifest["source_max_id"]
+                self._stats["snapshot"] = snapshot.path
+        logger.info(f"Attached snapshot {snapshot.path} ({state})")
+        return True
+
+    def export_snapshot(self, root):
+        """Write everything currently loaded to a new snapshot under root"""
+        with self._refresh_lock:
+            view = self.snapshot()
+            parts = [m for m in (view.base, view.delta) if len(m)]
+            matrix = np.concatenate(parts) if len(parts) > 1 else (parts[0] if parts else view.delta)
+            contents = [view.content(i) for i in range(len(view))]
+            ids = [view.id(i) for i in range(len(view))]
+            return write_snapshot(root, matrix, contents, ids, len(view), self._watermark,
+                                  collection=self.collection)
+
+    def _fetch_query(self):
+        vector_expr = "vector_send(embedding)" if self.binary else "embedding::text"
+        where = []
+        if self._watermark is not None:
+            where.append("id > :watermark")
+        if self.collection:
+            where.append(f"collection_id = (SELECT uuid FROM {COLLECTION_TABLE} WHERE name = :collection)")
+        where_clause = f"WHERE {' AND '.join(where)}" if where else ""
+        return text(f"""
+            SELECT id, {vector_expr}, "pageContent"
+            FROM {EMBEDDING_TABLE}
+            {where_clause}
+            ORDER BY id
+        """)
+
+    def _decode(self, values):
+        return decode_vector_send(values) if self.binary else parse_vector_text(values)
+
+    def _train_codec(self, sample):
+        """A new codec trained on sample, or None while the sample is too small"""
+        # float16 and int8 need no training
+        if self.quantization == "pq" and len(sample) < PQ_MIN_TRAIN_ROWS:
+            return None
+        codec = make_codec(self.quantization, sample.shape[1], pq_subspaces=self.pq_subspaces)
+        if not codec.trained:
+            codec.train(normalize_rows(np.asarray(sample, dtype=np.float32)))
+        return codec
+
+    def _start_quantizing(self, rows):
+        """Switch to codes once the loaded rows plus ``rows`` are enough to train the codec.
+
+        Called with only the refresh lock held: searches keep running on the
+        full-precision rows while the codec trains and encodes them, and the
+        codes are swapped in at the end.
+        """
+        delta = self._matrix[:self._size]
+        parts = [part for part in (self._base, delta, rows) if len(part)]
+        sample = np.concatenate([part[::max(1, len(part) // PQ_TRAIN_ROWS)] for part in parts])
+        codec = self._train_codec(sample)
+        if codec is None:
+            return
+        started = time.perf_counter()
+        base_codes = encode_in_chunks(codec, self._base) if len(self._base) else np.empty((0, 0), dtype=np.uint8)
+        spill = VectorSpill(rows.shape[1], self.spill_dir)
+        spill.append(delta)
+        codes = encode_in_chunks(codec, delta)
+        with self._lock:
+            self._codec = codec
+            self._base_codes = base_codes
+            self._spill = spill
+            self._matrix = codes
+        logger.info(f"Encoded {len(self._base) + len(delta)} rows as {self.quantization} "
+                    f"in {time.perf_counter() - started:.2f}s")
+
+    def _reset_spill(self):
+        if self._spill is not None:
+            self._spill.close()
+        self._spill = None
+
+    def _load_batch(self, vectors, contents, ids):
+        """Add a batch of rows read from the database; called with the refresh lock held"""
+        if len(vectors) == 0:
+            return
+        rows = normalize_rows(vectors)
+        if self.quantization and self._codec is None:
+            self._start_quantizing(rows)
+        with self._lock:
+            self._append(rows, contents, ids)
+
+    def _append(self, rows, contents, ids):
+        """Append normalized rows, growing the backing array geometrically to avoid O(n) copies per refresh.
+
+        Once the codec is trained, the array holds codes and the float32 rows go to the spill file.
+        """
+        n = len(rows)
+        if n == 0:
+            return
+        if self._codec is not None:
+            if self._spill is None:
+                self._spill = VectorSpill(rows.shape[1], self.spill_dir)
+            self._spill.append(rows)
+            rows = self._codec.encode(rows)
+        if self._matrix.shape[1] == 0:
+            self._matrix = np.empty((max(n, 1024), rows.shape[1]), dtype=rows.dtype)
+        needed = self._size + n
+        if needed > self._matrix.shape[0]:
+            capacity = max(needed, self._matrix.shape[0] * 2)
+            grown = np.empty((capacity, self._matrix.shape[1]), dtype=self._matrix.dtype)
+            grown[:self._size] = self._matrix[:self._size]
+            self._matrix = grown
+        self._matrix[self._size:needed] = rows
+        self._contents.extend(contents)
+        self._ids.extend(ids)
+        self._size = needed
+
+    def refresh(self):
+        """Load rows added since the last refresh; returns the number of new rows"""
+        with self._refresh_lock:
+            started = time.perf_counter()
+            params = {"watermark": self._watermark}
+            if self.collection:
+                params["collection"] = self.collection
+
+            added = 0
+            with self.engine.connect() as conn:
+                result = conn.execution_options(stream_results=True).execute(self._fetch_query(), params)
+                while True:
+                    rows = result.fetchmany(self.batch_size)
+                    if not rows:
+                        break
+                    ids = [row[0] for row in rows]
+                    self._load_batch(self._decode([row[1] for row in rows]), [row[2] for row in rows], ids)
+                    self._watermark = ids[-1]
+                    added += len(rows)
+
+            elapsed = time.perf_counter() - started
+            self._last_refresh = time.monotonic()
+            self._stats["refreshes"] += 1
+            self._stats["rows_loaded"] += added
+            self._stats["last_refresh_rows"] = added
+            self._stats["last_refresh_seconds"] = elapsed
+            if added:
+                logger.info(f"Embedding store loaded {added} rows in {elapsed:.2f}s (total {len(self)})")
+            return added
+
+    def reload(self):
+        """Drop everything and load the table from scratch"""
+        with self._refresh_lock, self._lock:
+            self._snapshot = None
+            self._base = np.empty((0, 0), dtype=np.float32)
+            self._stats["snapshot"] = None
+            self._matrix = np.empty((0, 0), dtype=np.float32)
+            self._size = 0
+            self._contents = []
+            self._ids = []
+            # Product quantization codebooks are retrained on the reloaded rows
+            self._codec = None
+            self._base_codes = np.empty((0, 0), dtype=np.uint8)
+            self._reset_spill()
+            self._watermark = None
+        return self.refresh()
+
+    def maybe_refresh(self):
+        """Top up from the database when the refresh interval has elapsed.
+
+        Only the first caller waits for the initial load; later callers keep
+        searching the rows already in memory while another thread refreshes.
+        """
+        if time.monotonic() - self._last_refresh < self.refresh_interval:
+            return
+        if len(self) and self._refresh_lock.locked():
+            return
+        self.refresh()
+
+    def snapshot(self):
+        """Consistent view for readers; loaded rows are never mutated in place"""
+        with self._lock:
+            snapshot = self._snapshot
+            if self._codec is None:
+                return StoreView(
+                    self._base,
+                    self._matrix[:self._size],
+                    snapshot.contents if snapshot else [],
+                    self._contents,
+                    snapshot.ids if snapshot else [],
+                    self._ids,
+                )
+            return StoreView(
+                self._base,
+                self._spill.view(self._size) if self._spill else np.empty((0, 0), dtype=np.float32),
+                snapshot.contents if snapshot else [],
+                self._contents,
+                snapshot.ids if snapshot else [],
+                self._ids,
+                codec=self._codec,
+                base_codes=self._base_codes,
+                delta_codes=self._matrix[:self._size],
+            )
+
+    def search(self, query_embedding, top_k=5, with_vectors=False):
+        """Return the top_k (similarity, content) pairs: one mat-vec plus argpartition.
+
+        With ``with_vectors`` each result also carries its normalized embedding.
+        """
+        self.maybe_refresh()
+        view = self.snapshot()
+        self._stats["hits"] += 1
+        if len(view) == 0:
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        query = query / (np.linalg.norm(query) or 1.0)
+        similarities = view.scores(query)
+
+        vectors = None
+        if view.codec is not None:
+            # Shortlist on the codes, then rank the shortlist by exact cosine
+            shortlist = top_k_indices(similarities, top_k * self.rescore_factor)
+            vectors = view.vectors(shortlist)
+            exact = vectors @ query
+            order = np.argsort(-exact)[:top_k]
+            top, scores, vectors = shortlist[order], exact[order], vectors[order]
+        else:
+            top = top_k_indices(similarities, top_k)
+            scores = similarities[top]
+        if with_vectors:
+            if vectors is None:
+                vectors = view.vectors(top)
+            return [(float(score), view.content(idx), vector) for idx, score, vector in zip(top, scores, vectors)]
+        return [(float(score), view.content(idx)) for idx, score in zip(top, scores)]
+
+    def stats(self):
+        return {
+            **self._stats,
+            "rows": len(self),
+            "snapshot_rows": len(self._base),
+            "seconds_since_refresh": time.monotonic() - self._last_refresh,
+            # Snapshot rows live in the shared page cache, not in this process's heap
+            "memory_mb": (self._matrix.nbytes + self._base_codes.nbytes) / 1e6,
+            "quantization": self.quantization,
+            # False while too few rows are loaded to train the codec
+            "quantized": self._codec is not None,
+            # Full-precision copies kept on disk for re-scoring
+            "spill_mb": self._spill.nbytes / 1e6 if self._spill else 0.0,
+            "watermark": self._watermark,
+        }
@@ -0,0 +1,139 @@
+"""Token-budgeted conversation history with a rolling summary of older turns"""
+import logging
+import math
+import re
+
+from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken is optional; fall back to a character estimate
+    _ENCODING = None
+
+THINK_BLOCK = re.compile(r"<think>.*?</think>", re.DOTALL)
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a user and a document assistant.
+Keep facts, names, numbers and open questions the user may refer back to. Be brief.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}
+
+Updated summary:"""
+
+
+def estimate_tokens(text):
+    """Local token count: tiktoken when installed, otherwise ~4 characters per token"""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 4)
+
+
+def format_turns(messages):
+    return "\n".join(f"{'User' if m['role'] == 'human' else 'Assistant'}: {m['content']}" for m in messages)
+
+
+class HistoryManager:
+    """Builds the prompt for a turn within ``token_budget`` tokens.
+
+    The most recent turns are kept verbatim; older ones are folded into a
+    summary. Folding happens in batches (once more than ``2 * keep_turns``
+    turns are pending), so the system prompt and summary stay byte-identical
+    for several turns and Ollama can reuse its KV cache for that prefix. For
+    the same reason the retrieved context goes with the latest question, not
+    into the system prompt.
+
+    Per-session state (the summary and how far it reaches) lives in the
+    ``state`` dict the caller passes in, e.g. an entry of st.session_state.
+    """
+
+    def __init__(self, summarize, system_prompt, token_budget=6000, keep_turns=3):
+        self.summarize = summarize
+        self.system_prompt = system_prompt
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+
+    def _fold(self, state, messages, upto):
+        """Fold messages[state['summarized']:upto] into the running summary"""
+        new_turns = messages[state["summarized"]:upto]
+        if not new_turns:
+            return
+        prompt = SUMMARY_PROMPT.format(summary=state["summary"] or "(none)", turns=format_turns(new_turns))
+        try:
+            summary = THINK_BLOCK.sub("", self.summarize(prompt)).strip()
+        except Exception as e:
+            # Keep going without a summary update rather than failing the turn
+            logger.error(f"History summarization failed: {str(e)}", exc_info=True)
+            return
+        state["summary"] = summary
+        state["summarized"] = upto
+        logger.debug(f"Folded {len(new_turns)} messages into summary ({estimate_tokens(summary)} tokens)")
+
+    def _system_message(self, state):
+        content = self.system_prompt
+        if state["summary"]:
+            content += f"\n\nSummary of the earlier conversation:\n{state['summary']}"
+        return content
+
+    def prepare(self, state, history):
+        """Do the batch fold that does not depend on the question.
+
+        Safe to run ahead of time, e.g. while the question is still being
+        embedded; build() calls it again and it is then a no-op.
+        """
+        state.setdefault("summary", "")
+        state.setdefault("summarized", 0)
+        # History was cleared (new chat) since the last turn
+        if state["summarized"] > len(history):
+            state["summary"], state["summarized"] = "", 0
+
+        keep = 2 * self.keep_turns
+        if len(history) - state["summarized"] > 2 * keep:
+            self._fold(state, history, len(history) - keep)
+
+    def build(self, state, history, context, question):
+        """Return (messages, token_report) for this turn.
+
+        ``history`` is the list of previous message dicts (role/content),
+        excluding the current question.
+        """
+        self.prepare(state, history)
+
+        question_content = f"Context:\n{context}\n\nQuestion: {question}" if context else question
+        fixed_tokens = estimate_tokens(self._system_message(state)) + estimate_tokens(question_content)
+
+        # Fold further if the verbatim window alone does not fit the budget
+        recent = history[state["summarized"]:]
+        while len(recent) > 2 and fixed_tokens + sum(estimate_tokens(m["content"]) for m in recent) > self.token_budget:
+            self._fold(state, history, len(history) - max(2, len(recent) - 2))
+            if len(history[state["summarized"]:]) == len(recent):
+                break  # summarization failed; keep what we have
+            recent = history[state["summarized"]:]
+            fixed_tokens = estimate_tokens(self._system_message(state)) + estimate_tokens(question_content)
+
+        system_content = self._system_message(state)
+        messages = [SystemMessage(content=system_content)]
+        for message in recent:
+            if message["role"] == "human":
+                messages.append(HumanMessage(content=message["content"]))
+            else:
+                messages.append(AIMessage(content=message["content"]))
+        messages.append(HumanMessage(content=question_content))
+
+        report = {
+            "system": estimate_tokens(self.system_prompt),
+            "summary": estimate_tokens(state["summary"]),
+            "history": sum(estimate_tokens(m["content"]) for m in recent),
+            "context": estimate_tokens(context),
+            "question": estimate_tokens(question),
+            "verbatim_messages": len(recent),
+        }
+        report["total"] = estimate_tokens(system_content) + report["history"] + estimate_tokens(question_content)
+        return messages, report
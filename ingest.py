@@ -0,0 +1,279 @@
+"""Load documents into langchain_pg_embedding: chunk, embed in parallel batches, bulk insert.
+
+    python ingest.py --create-index
+    python ingest.py docs/ --collection manuals --batch-size 64 --workers 4
+
+Every chunk stores a content hash in its metadata, so re-running the same
+command only embeds chunks that are not in the table yet. ``--create-index``
+builds the index that check uses, CONCURRENTLY, so run it once before the
+first load into a large table.
+
+New rows take their ``id`` from the column default. The in-memory store
+(embedding_store.py) only picks up rows whose id is above the highest one it
+has loaded, so the default should be an increasing sequence or identity.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+from langchain_community.embeddings import OllamaEmbeddings
+
+from db import create_db_engine
+from vector_store import EMBEDDING_TABLE, COLLECTION_TABLE, METADATA_COLUMNS, describe_embedding_column, \
+    supports_vector_search, to_vector_literal
+
+logger = logging.getLogger(__name__)
+
+TEXT_EXTENSIONS = {".txt", ".md", ".rst", ".csv", ".json", ".html", ".htm", ".xml", ".log"}
+HASH_INDEX = f"{EMBEDDING_TABLE}_content_hash_idx"
+INTEGER_TYPES = ("smallint", "integer", "bigint")
+
+
+def iter_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def read_document(path):
+    """Text of a file, or None for unsupported types. PDFs need pypdf."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".pdf":
+        from pypdf import PdfReader
+        return "\n\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+    if extension in TEXT_EXTENSIONS:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return f.read()
+    return None
+
+
+def chunk_text(text, chunk_size=1000, overlap=150):
+    """Split on paragraph, then line, then word boundaries into ~chunk_size character pieces"""
+    text = text.strip()
+    if len(text) <= chunk_size:
+        return [text] if text else []
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            for separator in ("\n\n", "\n", ". ", " "):
+                cut = text.rfind(separator, start + chunk_size // 2, end)
+                if cut > start:
+                    end = cut + len(separator)
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+def content_hash(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def iter_chunks(paths, chunk_size, overlap, stats):
+    """Stream (content, metadata) pairs file by file so memory stays flat"""
+    for path in iter_files(paths):
+        try:
+            document = read_document(path)
+        except Exception as e:
+            logger.error(f"Could not read {path}: {str(e)}")
+            continue
+        if document is None:
+            logger.debug(f"Skipping unsupported file {path}")
+            continue
+        stats["documents"] += 1
+        for index, chunk in enumerate(chunk_text(document, chunk_size, overlap)):
+            yield chunk, {"source": path, "chunk": index, "content_hash": content_hash(chunk)}
+
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ensure_hash_index(engine, info, rebuild=False):
+    """Create (or rebuild) the index the resume check uses, CONCURRENTLY so inserts keep running"""
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if rebuild:
+            logger.info(f"Dropping content hash index {HASH_INDEX}")
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {HASH_INDEX}"))
+
+        logger.info(f"Building content hash index {HASH_INDEX}")
+        conn.execute(text(f"""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS {HASH_INDEX}
+            ON {EMBEDDING_TABLE} (({info["metadata_column"]}->>'content_hash'))
+        """))
+        conn.execute(text(f"ANALYZE {EMBEDDING_TABLE}"))
+
+    return HASH_INDEX
+
+
+def check_columns(info):
+    """Refuse tables ingest cannot write to, and warn when new rows would be missed"""
+    if info["metadata_column"] is None:
+        raise RuntimeError(f"{EMBEDDING_TABLE} has no metadata column (expected one of "
+                           f"{', '.join(METADATA_COLUMNS)})")
+    if info["id_default"] is None:
+        raise RuntimeError(f"{EMBEDDING_TABLE}.id has no default, so inserted rows cannot be numbered")
+    if info["id_type"] not in INTEGER_TYPES:
+        logger.warning(f"{EMBEDDING_TABLE}.id is {info['id_type']}, not an increasing integer: with "
+                       f"RETRIEVAL_BACKEND=memory, restart the app (or reload the store) after loading")
+
+
+class Loader:
+    """Writes embedded chunks to Postgres and tells which ones are already there"""
+
+    def __init__(self, engine, collection=None):
+        self.engine = engine
+        self.info = describe_embedding_column(engine)
+        check_columns(self.info)
+        self.metadata_column = self.info["metadata_column"]
+        self.vector_cast = "CAST(:embedding AS vector)" if supports_vector_search(self.info) else ":embedding"
+        self.collection_id = None
+
+        with engine.begin() as conn:
+            if conn.execute(text("SELECT to_regclass(:name)"), {"name": HASH_INDEX}).scalar() is None:
+                logger.warning(f"No {HASH_INDEX}: every resume check scans the table. "
+                               f"Run python ingest.py --create-index first")
+            if collection and self.info["has_collection"]:
+                self.collection_id = conn.execute(
+                    text(f"SELECT uuid FROM {COLLECTION_TABLE} WHERE name = :name"), {"name": collection}
+                ).scalar()
+                if self.collection_id is None:
+                    self.collection_id = conn.execute(text(f"""
+                        INSERT INTO {COLLECTION_TABLE} (uuid, name, cmetadata)
+                        VALUES (gen_random_uuid(), :name, '{{}}'::jsonb)
+                        RETURNING uuid
+                    """), {"name": collection}).scalar()
+
+    def existing_hashes(self, hashes):
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(f"""
+                SELECT {self.metadata_column}->>'content_hash'
+                FROM {EMBEDDING_TABLE}
+                WHERE {self.metadata_column}->>'content_hash' = ANY(:hashes)
+            """), {"hashes": list(hashes)}).fetchall()
+        return {row[0] for row in rows}
+
+    def insert(self, chunks, vectors):
+        """One multi-row executemany per batch, in a single transaction"""
+        columns = f'"pageContent", {self.metadata_column}, embedding'
+        values = f":content, CAST(:metadata AS jsonb), {self.vector_cast}"
+        if self.collection_id is not None:
+            columns += ", collection_id"
+            values += ", :collection_id"
+        rows = [
+            {
+                "content": content,
+                "metadata": json.dumps(metadata),
+                "embedding": to_vector_literal(vector),
+                "collection_id": self.collection_id,
+            }
+            for (content, metadata), vector in zip(chunks, vectors)
+        ]
+        with self.engine.begin() as conn:
+            conn.execute(text(f"INSERT INTO {EMBEDDING_TABLE} ({columns}) VALUES ({values})"), rows)
+
+
+def ingest(paths, loader, embeddings, batch_size=64, workers=4, chunk_size=1000, overlap=150):
+    """Embed and load every new chunk; returns throughput statistics"""
+    stats = {"documents": 0, "chunks": 0, "skipped": 0, "inserted": 0}
+    started = time.perf_counter()
+    # At most this many batches are embedding at once; reading pauses until one is written
+    max_in_flight = workers * 2
+    in_flight = deque()
+    # Hashes queued during this run; batches still embedding are not visible in the table yet
+    queued = set()
+
+    def drain_one():
+        chunks, future = in_flight.popleft()
+        loader.insert(chunks, future.result())
+        stats["inserted"] += len(chunks)
+        elapsed = time.perf_counter() - started
+        logger.info(f"{stats['inserted']} chunks inserted, {stats['inserted'] / elapsed:.1f} chunks/s")
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed") as executor:
+        for batch in iter_batches(iter_chunks(paths, chunk_size, overlap, stats), batch_size):
+            stats["chunks"] += len(batch)
+            existing = loader.existing_hashes(metadata["content_hash"] for _, metadata in batch)
+            new_chunks = []
+            for content, metadata in batch:
+                if metadata["content_hash"] not in existing and metadata["content_hash"] not in queued:
+                    queued.add(metadata["content_hash"])
+                    new_chunks.append((content, metadata))
+            stats["skipped"] += len(batch) - len(new_chunks)
+            if not new_chunks:
+                continue
+
+            if len(in_flight) >= max_in_flight:
+                drain_one()
+            future = executor.submit(embeddings.embed_documents, [content for content, _ in new_chunks])
+            in_flight.append((new_chunks, future))
+
+        while in_flight:
+            drain_one()
+
+    elapsed = time.perf_counter() - started
+    stats["seconds"] = elapsed
+    stats["docs_per_sec"] = stats["documents"] / elapsed if elapsed else 0.0
+    stats["chunks_per_sec"] = stats["inserted"] / elapsed if elapsed else 0.0
+    return stats
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("paths", nargs="*", help="Files or directories to load")
+    arg_parser.add_argument("--create-index", action="store_true",
+                            help="Build the content hash index (CONCURRENTLY) before loading")
+    arg_parser.add_argument("--dsn", default=None,
+                            help="SQLAlchemy connection string (defaults to $POSTGRES_CONNECTION)")
+    arg_parser.add_argument("--collection", default=os.getenv("PGVECTOR_COLLECTION"))
+    arg_parser.add_argument("--ollama-url", default=os.getenv("OLLAMA_URL", "http://sestrilevante.platform.myw.ai:11434"))
+    arg_parser.add_argument("--model", default="nomic-embed-text", help="Must match EMBEDDING_MODEL in the app")
+    arg_parser.add_argument("--batch-size", type=int, default=64, help="Chunks per embed_documents call")
+    arg_parser.add_argument("--workers", type=int, default=4, help="Concurrent embedding requests")
+    arg_parser.add_argument("--chunk-size", type=int, default=1000, help="Characters per chunk")
+    arg_parser.add_argument("--overlap", type=int, default=150, help="Characters shared by neighbouring chunks")
+    args = arg_parser.parse_args()
+    if not args.paths and not args.create_index:
+        arg_parser.error("give files or directories to load, or --create-index")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    engine = create_db_engine(args.dsn)
+    if args.create_index:
+        info = describe_embedding_column(engine)
+        check_columns(info)
+        ensure_hash_index(engine, info)
+        if not args.paths:
+            return
+    loader = Loader(engine, collection=args.collection)
+    embeddings = OllamaEmbeddings(model=args.model, base_url=args.ollama_url)
+    stats = ingest(args.paths, loader, embeddings, batch_size=args.batch_size, workers=args.workers,
+                   chunk_size=args.chunk_size, overlap=args.overlap)
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""Route chat requests across several LLM backends with failover, circuit breakers and hedging"""
+import asyncio
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class NoBackendAvailable(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    """Stops sending requests to a backend that keeps failing.
+
+    Opens after ``failure_threshold`` consecutive failures; after
+    ``reset_timeout`` seconds it lets a single trial request through
+    (half-open) and closes again if that one succeeds. A trial that ends
+    without an outcome (cancelled, or a hedge it lost) gives its slot back.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def acquire(self):
+        """"closed" or "trial" when a request may go out (claiming the half-open trial slot), else None"""
+        state = self.state
+        if state == "closed":
+            return "closed"
+        if state == "half-open":
+            with self._lock:
+                if not self._trial:
+                    self._trial = True
+                    return "trial"
+        return None
+
+    def allow(self):
+        return self.acquire() is not None
+
+    def release_trial(self):
+        """Free the trial slot without a verdict, so the next request becomes the trial"""
+        with self._lock:
+            self._trial = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial = False
+            if self._failures >= self.failure_threshold or self._opened_at is not None:
+                self._opened_at = time.monotonic()
+
+    def trip(self):
+        """Open immediately, e.g. after a failed health check"""
+        with self._lock:
+            self._opened_at = time.monotonic()
+            self._trial = False
+
+
+def ollama_health_check(base_url, timeout=2.0):
+    def check():
+        import requests
+        requests.get(f"{base_url.rstrip('/')}/api/tags", timeout=timeout).raise_for_status()
+    return check
+
+
+class Backend:
+    """One chat model endpoint plus the load and latency figures the router balances on"""
+
+    def __init__(self, name, model, weight=1.0, health_check=None, breaker=None):
+        self.name = name
+        self.model = model
+        self.weight = weight
+        self.health_check = health_check
+        self.breaker = breaker or CircuitBreaker()
+        self.outstanding = 0
+        self.ttft = None  # moving average of seconds to first token
+        self.healthy = True
+        self.stats = {"requests": 0, "failures": 0, "hedges": 0, "hedge_wins": 0}
+        self._lock = threading.Lock()
+
+    def begin(self):
+        # Streams run on the event loop, summaries in worker threads
+        with self._lock:
+            self.outstanding += 1
+            self.stats["requests"] += 1
+
+    def end(self):
+        with self._lock:
+            self.outstanding -= 1
+
+    def observe_ttft(self, seconds, alpha=0.2):
+        self.ttft = seconds if self.ttft is None else (1 - alpha) * self.ttft + alpha * seconds
+
+
+def backend_from_spec(spec, default_model, temperature=0.7):
+    """Build a Backend from a config dict: {"type": "ollama"|"azure", ...}"""
+    kind = spec.get("type", "ollama")
+    if kind == "ollama":
+        from langchain_community.chat_models import ChatOllama
+        model = ChatOllama(model=spec.get("model", default_model), base_url=spec["base_url"],
+                           temperature=temperature)
+        return Backend(spec.get("name", spec["base_url"]), model, weight=spec.get("weight", 1.0),
+                       health_check=ollama_health_check(spec["base_url"]))
+    if kind == "azure":
+        from langchain_openai import AzureChatOpenAI
+        model = AzureChatOpenAI(
+            azure_deployment=spec["deployment"],
+            azure_endpoint=spec["endpoint"],
+            api_version=spec.get("api_version", "2024-06-01"),
+            api_key=os.getenv(spec.get("api_key_env", "AZURE_OPENAI_API_KEY")),
+            temperature=temperature
+        )
+        return Backend(spec.get("name", spec["deployment"]), model, weight=spec.get("weight", 1.0))
+    raise ValueError(f"Unknown LLM backend type: {kind}")
+
+
+class _Attempt:
+    """A stream started on one backend, waiting for its first chunk"""
+
+    def __init__(self, backend, messages, kwargs, trial=False):
+        self.backend = backend
+        # Holds the breaker's half-open trial slot until it records an outcome
+        self.trial = trial
+        self.started = time.perf_counter()
+        self.iterator = backend.model.astream(messages, **kwargs).__aiter__()
+        self.first = asyncio.ensure_future(self.iterator.__anext__())
+        backend.begin()
+
+    async def close(self):
+        if not self.first.done():
+            self.first.cancel()
+            try:
+                await self.first
+            except BaseException:
+                pass
+        try:
+            await self.iterator.aclose()
+        except Exception:
+            pass
+        self.backend.end()
+        if self.trial:
+            self.trial = False
+            self.backend.breaker.release_trial()
+
+    def record(self, success):
+        if success:
+            self.backend.breaker.record_success()
+        else:
+            self.backend.stats["failures"] += 1
+            self.backend.breaker.record_failure()
+        self.trial = False
+
+
+class LLMRouter:
+    """Chat model facade over several backends, exposing ``astream`` and ``invoke``.
+
+    Each request goes to the best backend whose circuit breaker allows it:
+    fewest outstanding requests per unit of weight ("least_outstanding"), or
+    lowest expected wait, time-to-first-token times queue depth ("latency").
+    A backend that errors or times out before its first token is marked
+    failed and the request moves to the next one; once tokens have been
+    streamed a failure is passed on, since the answer cannot be restarted
+    invisibly. With ``hedge_after`` set, a second backend is started when
+    the first has not produced a token by then, and the slower one is
+    cancelled.
+    """
+
+    def __init__(self, backends, policy="least_outstanding", hedge_after=None,
+                 first_token_timeout=60.0, health_interval=15.0):
+        if not backends:
+            raise ValueError("LLMRouter needs at least one backend")
+        self.backends = list(backends)
+        self.policy = policy
+        self.hedge_after = hedge_after
+        self.first_token_timeout = first_token_timeout
+        self.health_interval = health_interval
+        self._stats = {"failovers": 0, "exhausted": 0}
+        self._health_thread = None
+
+    def _expected_wait(self, backend):
+        if self.policy == "latency":
+            # Unmeasured backends get tried first so they get a latency estimate
+            return (backend.ttft or 0.0) * (backend.outstanding + 1) / backend.weight
+        return (backend.outstanding / backend.weight, backend.ttft or 0.0)
+
+    def _pick(self, exclude):
+        """(backend, holds the trial slot) for the best backend not in ``exclude`` whose breaker
+        lets a request through, or (None, False)"""
+        candidates = [b for b in self.backends if b.name not in exclude]
+        # Backends failing their health check are a last resort, not excluded outright
+        for backend in sorted(candidates, key=lambda b: (not b.healthy, self._expected_wait(b))):
+            admission = backend.breaker.acquire()
+            if admission is not None:
+                return backend, admission == "trial"
+        return None, False
+
+    async def astream(self, messages, **kwargs):
+        tried = set()
+        attempts = {}
+        hedged = False
+        hedge = None
+
+        def start(exclude):
+            backend, trial = self._pick(exclude)
+            if backend is None:
+                return None
+            tried.add(backend.name)
+            attempt = _Attempt(backend, messages, kwargs, trial)
+            attempts[attempt.first] = attempt
+            return attempt
+
+        if start(tried) is None:
+            self._stats["exhausted"] += 1
+            raise NoBackendAvailable("Every LLM backend is failing or its circuit is open")
+
+        winner = first_chunk = None
+        try:
+            while winner is None:
+                now = time.perf_counter()
+                deadline = min(a.started + self.first_token_timeout for a in attempts.values())
+                wake = deadline
+                if self.hedge_after and not hedged and len(attempts) == 1:
+                    wake = min(wake, next(iter(attempts.values())).started + self.hedge_after)
+                done, _ = await asyncio.wait(list(attempts), timeout=max(0.0, wake - now),
+                                             return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    now = time.perf_counter()
+                    for attempt in [a for a in attempts.values() if now - a.started >= self.first_token_timeout]:
+                        logger.warning(f"LLM backend {attempt.backend.name} gave no token in {self.first_token_timeout}s")
+                        del attempts[attempt.first]
+                        await self._fail(attempt)
+                    if self.hedge_after and not hedged and attempts:
+                        hedged = True
+                        hedge = start(tried)
+                        if hedge is not None:
+                            hedge.backend.stats["hedges"] += 1
+                            logger.info(f"Hedging slow LLM request to {hedge.backend.name}")
+                else:
+                    for future in done:
+                        attempt = attempts.pop(future)
+                        error = future.exception()
+                        if error is None or isinstance(error, StopAsyncIteration):
+                            winner = attempt
+                            first_chunk = None if error else future.result()
+                            break
+                        logger.warning(f"LLM backend {attempt.backend.name} failed before streaming: {str(error)}")
+                        await self._fail(attempt)
+
+                if winner is None and not attempts:
+                    # Fail over to the next backend that has not been tried for this request
+                    if start(tried) is None:
+                        self._stats["exhausted"] += 1
+                        raise NoBackendAvailable("Every LLM backend failed for this request")
+                    self._stats["failovers"] += 1
+        finally:
+            for attempt in attempts.values():
+                await attempt.close()
+
+        backend = winner.backend
+        backend.observe_ttft(time.perf_counter() - winner.started)
+        if winner is hedge:
+            backend.stats["hedge_wins"] += 1
+        try:
+            if first_chunk is not None:
+                yield first_chunk
+                async for chunk in winner.iterator:
+                    yield chunk
+            winner.record(success=True)
+        except asyncio.CancelledError:
+            # Neither a success nor a failure; close() gives a trial slot back
+            raise
+        except Exception:
+            winner.record(success=False)
+            raise
+        finally:
+            await winner.close()
+
+    async def _fail(self, attempt):
+        attempt.record(success=False)
+        await attempt.close()
+
+    def invoke(self, messages, **kwargs):
+        """Non-streaming call (used for history summaries), failing over between backends"""
+        tried = set()
+        while True:
+            backend, trial = self._pick(tried)
+            if backend is None:
+                self._stats["exhausted"] += 1
+                raise NoBackendAvailable("Every LLM backend failed for this request")
+            if tried:
+                self._stats["failovers"] += 1
+            tried.add(backend.name)
+            backend.begin()
+            recorded = False
+            try:
+                result = backend.model.invoke(messages, **kwargs)
+                backend.breaker.record_success()
+                recorded = True
+                return result
+            except Exception as e:
+                logger.warning(f"LLM backend {backend.name} failed: {str(e)}")
+                backend.stats["failures"] += 1
+                backend.breaker.record_failure()
+                recorded = True
+            finally:
+                backend.end()
+                if trial and not recorded:
+                    backend.breaker.release_trial()
+
+    def check_health(self):
+        for backend in self.backends:
+            if backend.health_check is None:
+                continue
+            try:
+                backend.health_check()
+                if not backend.healthy:
+                    logger.info(f"LLM backend {backend.name} is healthy again")
+                    # The failed check opened the circuit; the passing one closes it
+                    backend.breaker.record_success()
+                backend.healthy = True
+            except Exception as e:
+                if backend.healthy:
+                    logger.warning(f"LLM backend {backend.name} failed its health check: {str(e)}")
+                backend.healthy = False
+                backend.breaker.trip()
+
+    def start_health_checks(self):
+        """Probe every backend each ``health_interval`` seconds in a daemon thread"""
+        if self._health_thread is not None:
+            return
+
+        def run():
+            while True:
+                self.check_health()
+                time.sleep(self.health_interval)
+        self._health_thread = threading.Thread(target=run, name="llm-health", daemon=True)
+        self._health_thread.start()
+
+    def stats(self):
+        return {
+            **self._stats,
+            "backends": [
+                {
+                    "name": backend.name,
+                    "state": backend.breaker.state,
+                    "healthy": backend.healthy,
+                    "outstanding": backend.outstanding,
+                    "ttft": backend.ttft,
+                    **backend.stats,
+                }
+                for backend in self.backends
+            ],
+        }
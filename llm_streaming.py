@@ -0,0 +1,90 @@
+"""Helpers for streaming chat model output token by token"""
+import time
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+class ThinkSplitter:
+    """Route streamed text into the reasoning (<think>...</think>) and answer channels.
+
+    Tags may be split across chunks, so a short tail that could be the start
+    of a tag is held back until the next chunk arrives.
+    """
+
+    def __init__(self):
+        self.thinking = False
+        self._pending = ""
+
+    def feed(self, chunk):
+        """Return a list of (channel, text) pairs, channel being "think" or "answer" """
+        text = self._pending + chunk
+        self._pending = ""
+        parts = []
+        while text:
+            tag = THINK_CLOSE if self.thinking else THINK_OPEN
+            channel = "think" if self.thinking else "answer"
+            pos = text.find(tag)
+            if pos >= 0:
+                if pos:
+                    parts.append((channel, text[:pos]))
+                text = text[pos + len(tag):]
+                self.thinking = not self.thinking
+                continue
+            keep = _partial_tag_length(text, tag)
+            if keep:
+                self._pending = text[-keep:]
+                text = text[:-keep]
+            if text:
+                parts.append((channel, text))
+            break
+        return parts
+
+    def flush(self):
+        if not self._pending:
+            return []
+        text, self._pending = self._pending, ""
+        return [("think" if self.thinking else "answer", text)]
+
+
+def _partial_tag_length(text, tag):
+    """Length of the longest suffix of text that is a prefix of tag"""
+    for size in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:size]):
+            return size
+    return 0
+
+
+class StreamStats:
+    """Time-to-first-token and throughput for one streamed response"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token = None
+        self.finished = None
+        self.tokens = 0
+        self.reported_tokens = None
+
+    def on_chunk(self, chunk):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+        self.tokens += 1
+        # Ollama reports the exact generated token count on the final chunk
+        metadata = getattr(chunk, "response_metadata", None) or {}
+        if metadata.get("eval_count"):
+            self.reported_tokens = metadata["eval_count"]
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    def as_dict(self):
+        finished = self.finished or time.perf_counter()
+        tokens = self.reported_tokens or self.tokens
+        ttft = (self.first_token - self.started) if self.first_token else None
+        generation = finished - (self.first_token or self.started)
+        return {
+            "ttft": ttft,
+            "total": finished - self.started,
+            "tokens": tokens,
+            "tokens_per_sec": tokens / generation if generation > 0 else None,
+        }
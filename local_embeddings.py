@@ -0,0 +1,127 @@
+"""nomic-embed-text on this machine's CPU with ONNX Runtime, instead of a round-trip to Ollama
+
+Needs onnxruntime and tokenizers, plus an ONNX export of the model with its
+tokenizer.json, e.g. onnx/model_quantized.onnx from the Hugging Face
+nomic-ai/nomic-embed-text-v1.5 repository.
+"""
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def available_cores():
+    """CPUs this process may run on; unlike os.cpu_count() this respects container and taskset limits"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def find_tokenizer(model_path):
+    """tokenizer.json next to the model, or one directory up (the Hugging Face onnx/ layout)"""
+    directory = os.path.dirname(os.path.abspath(model_path))
+    for candidate in (directory, os.path.dirname(directory)):
+        path = os.path.join(candidate, "tokenizer.json")
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No tokenizer.json next to {model_path}")
+
+
+class OnnxEmbeddings:
+    """Sentence embeddings computed in-process, with the interface of OllamaEmbeddings.
+
+    Texts get the same "passage: " and "query: " instructions that
+    langchain's OllamaEmbeddings adds, so local query vectors line up with
+    documents embedded through Ollama. Token states are mean-pooled over the
+    attention mask and L2-normalized. Batches run one at a time on a single
+    session whose intra-op thread pool spans ``threads`` cores (all available
+    cores by default); two batches at once would only compete for them.
+    """
+
+    embed_instruction = "passage: "
+    query_instruction = "query: "
+
+    def __init__(self, model_path, tokenizer_path=None, max_length=2048, threads=None, max_batch=32,
+                 registry=None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.model_path = model_path
+        self.threads = threads or available_cores()
+        self.max_batch = max_batch
+        # Optional telemetry.MetricsRegistry
+        self.registry = registry
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self._inputs = {node.name for node in self._session.get_inputs()}
+
+        self._tokenizer = Tokenizer.from_file(tokenizer_path or find_tokenizer(model_path))
+        self._tokenizer.enable_truncation(max_length)
+        pad_id = self._tokenizer.token_to_id("[PAD]") or 0
+        # Pads each batch to its longest text only
+        self._tokenizer.enable_padding(pad_id=pad_id, pad_token="[PAD]")
+
+        self._lock = threading.Lock()
+        self._stats = {"batches": 0, "texts": 0, "seconds": 0.0}
+        logger.info(f"Loaded {model_path} with {self.threads} threads")
+
+    def _embed(self, texts):
+        """Embed texts as given (instructions already added), max_batch at a time"""
+        # Texts of similar length share a batch, so little of it is padding
+        order = sorted(range(len(texts)), key=lambda index: len(texts[index]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.max_batch):
+            indices = order[start:start + self.max_batch]
+            for index, vector in zip(indices, self._embed_batch([texts[index] for index in indices])):
+                vectors[index] = vector
+        return vectors
+
+    def _embed_batch(self, texts):
+        started = time.perf_counter()
+        encodings = self._tokenizer.encode_batch(texts)
+        ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feed = {"input_ids": ids, "attention_mask": mask, "token_type_ids": np.zeros_like(ids)}
+        feed = {name: value for name, value in feed.items() if name in self._inputs}
+
+        with self._lock:
+            output = self._session.run(None, feed)[0]
+        if output.ndim == 3:
+            weights = mask[:, :, None].astype(np.float32)
+            output = (output * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+        output = output / np.maximum(np.linalg.norm(output, axis=1, keepdims=True), 1e-12)
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["texts"] += len(texts)
+            self._stats["seconds"] += elapsed
+        if self.registry is not None:
+            self.registry.observe("chatbot_embedding_batch_seconds", elapsed, backend="onnx")
+            self.registry.increment("chatbot_embedding_texts_total", len(texts), backend="onnx")
+        return output.astype(np.float32).tolist()
+
+    def embed_documents(self, texts):
+        return self._embed([f"{self.embed_instruction}{text}" for text in texts])
+
+    def embed_query(self, text):
+        return self._embed([f"{self.query_instruction}{text}"])[0]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        return {
+            **stats,
+            "threads": self.threads,
+            "avg_batch_size": stats["texts"] / stats["batches"] if stats["batches"] else 0.0,
+            "avg_batch_ms": stats["seconds"] / stats["batches"] * 1000 if stats["batches"] else 0.0,
+        }
@@ -0,0 +1,223 @@
+"""Compact codes for L2-normalized embeddings, scored without decoding the whole matrix
+
+Every codec turns float32 rows into fixed-width uint8 code rows, so a code
+matrix can be grown and sliced exactly like the float32 matrix it replaces:
+
+    float16   2 bytes per dimension                           (2x smaller)
+    int8      1 byte per dimension plus a float32 scale       (~4x smaller)
+    pq        1 byte per subspace, product quantization       (48 bytes: 64x smaller at 768 dims)
+
+``scores(codes, query)`` gives approximate cosine similarities for a
+normalized query. They are good enough to shortlist candidates, which the
+caller then re-scores against full-precision vectors.
+"""
+import os
+import tempfile
+
+import numpy as np
+
+# Rows decoded at a time while scoring; small enough for the float32 block to stay in cache
+SCORE_CHUNK_ROWS = 1024
+PQ_CHUNK_ROWS = 8192
+
+
+def _chunked(codes, score_block, chunk_rows):
+    scores = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), chunk_rows):
+        scores[start:start + chunk_rows] = score_block(codes[start:start + chunk_rows])
+    return scores
+
+
+class Float16Codec:
+    name = "float16"
+
+    def __init__(self, dims):
+        self.dims = dims
+        self.code_size = 2 * dims
+        self.trained = True
+
+    def train(self, sample):
+        pass
+
+    def encode(self, vectors):
+        halves = np.ascontiguousarray(vectors, dtype=np.float16)
+        return halves.view(np.uint8).reshape(len(halves), self.code_size)
+
+    def decode(self, codes):
+        return np.ascontiguousarray(codes).view(np.float16).astype(np.float32)
+
+    def scores(self, codes, query):
+        return _chunked(codes, lambda block: self.decode(block) @ query, SCORE_CHUNK_ROWS)
+
+
+class Int8Codec:
+    """Symmetric scalar quantization with one scale per vector: x ~ scale * code, code in [-127, 127]"""
+
+    name = "int8"
+
+    def __init__(self, dims):
+        self.dims = dims
+        self.code_size = dims + 4  # the scale rides along as the last four bytes
+        self.trained = True
+
+    def train(self, sample):
+        pass
+
+    def encode(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        scale = np.abs(vectors).max(axis=1) / 127
+        scale[scale == 0] = 1.0
+        codes = np.empty((len(vectors), self.code_size), dtype=np.uint8)
+        codes[:, :self.dims] = np.rint(vectors / scale[:, None]).astype(np.int8).view(np.uint8)
+        codes[:, self.dims:] = scale.astype(np.float32).reshape(-1, 1).view(np.uint8)
+        return codes
+
+    def _split(self, codes):
+        values = codes[:, :self.dims].view(np.int8)
+        scale = np.ascontiguousarray(codes[:, self.dims:]).view(np.float32).ravel()
+        return values, scale
+
+    def decode(self, codes):
+        values, scale = self._split(codes)
+        return values.astype(np.float32) * scale[:, None]
+
+    def scores(self, codes, query):
+        def score_block(block):
+            values, scale = self._split(block)
+            return (values.astype(np.float32) @ query) * scale
+        return _chunked(codes, score_block, SCORE_CHUNK_ROWS)
+
+
+class ProductQuantizer:
+    """Product quantization: each of ``subspaces`` slices of a vector is replaced by
+    the index of its nearest centroid (256 per slice, learned with k-means).
+
+    Scoring uses asymmetric distance computation: the query's dot product
+    with every centroid is tabulated once, then each code row costs one table
+    lookup per subspace. The codebooks come from ``train()``; rows encoded
+    later reuse them, so retrain (reload the store) after the corpus drifts.
+    """
+
+    name = "pq"
+
+    def __init__(self, dims, subspaces=48, iterations=12, seed=0):
+        if dims % subspaces:
+            raise ValueError(f"{dims} dimensions do not split into {subspaces} subspaces")
+        self.dims = dims
+        self.subspaces = subspaces
+        self.sub_dims = dims // subspaces
+        self.code_size = subspaces
+        self.iterations = iterations
+        self.seed = seed
+        self.codebooks = None  # (subspaces, centroids, sub_dims)
+
+    @property
+    def trained(self):
+        return self.codebooks is not None
+
+    def _slices(self, vectors):
+        return np.asarray(vectors, dtype=np.float32).reshape(len(vectors), self.subspaces, self.sub_dims)
+
+    def train(self, sample):
+        sample = self._slices(sample)
+        rng = np.random.default_rng(self.seed)
+        centroids = min(256, len(sample))
+        codebooks = np.empty((self.subspaces, centroids, self.sub_dims), dtype=np.float32)
+        for index in range(self.subspaces):
+            points = sample[:, index, :]
+            center = points[rng.choice(len(points), centroids, replace=False)].copy()
+            for _ in range(self.iterations):
+                assignment = self._nearest(points, center)
+                counts = np.bincount(assignment, minlength=centroids)
+                sums = np.stack([np.bincount(assignment, weights=points[:, dim], minlength=centroids)
+                                 for dim in range(self.sub_dims)], axis=1)
+                filled = counts > 0
+                center[filled] = sums[filled] / counts[filled, None]
+            codebooks[index] = center
+        self.codebooks = codebooks
+
+    @staticmethod
+    def _nearest(points, centers):
+        # argmin |p - c|^2 == argmax (2 p.c - |c|^2)
+        return np.argmax(2 * points @ centers.T - (centers ** 2).sum(axis=1), axis=1)
+
+    def encode(self, vectors):
+        slices = self._slices(vectors)
+        codes = np.empty((len(slices), self.subspaces), dtype=np.uint8)
+        for index in range(self.subspaces):
+            codes[:, index] = self._nearest(slices[:, index, :], self.codebooks[index])
+        return codes
+
+    def decode(self, codes):
+        parts = [self.codebooks[index][codes[:, index]] for index in range(self.subspaces)]
+        return np.concatenate(parts, axis=1)
+
+    def scores(self, codes, query):
+        table = np.einsum("mkd,md->mk", self.codebooks, self._slices(query.reshape(1, -1))[0])
+
+        def score_block(block):
+            # Subspace-major copy, so every lookup below walks contiguous memory
+            columns = np.ascontiguousarray(block.T)
+            total = np.zeros(len(block), dtype=np.float32)
+            for index in range(self.subspaces):
+                total += table[index].take(columns[index])
+            return total
+        return _chunked(codes, score_block, PQ_CHUNK_ROWS)
+
+
+CODECS = {"float16": Float16Codec, "int8": Int8Codec, "pq": ProductQuantizer}
+
+
+def make_codec(name, dims, pq_subspaces=48):
+    """Codec for a VECTOR_QUANTIZATION setting; None (or "float32") keeps full precision"""
+    if not name or name == "float32":
+        return None
+    if name not in CODECS:
+        raise ValueError(f"Unknown vector quantization {name!r}; expected one of {', '.join(CODECS)}")
+    if name == "pq":
+        return ProductQuantizer(dims, subspaces=pq_subspaces)
+    return CODECS[name](dims)
+
+
+def encode_in_chunks(codec, vectors, chunk_rows=65536):
+    """Encode a large (possibly memory-mapped) matrix without materializing it in float32"""
+    codes = np.empty((len(vectors), codec.code_size), dtype=np.uint8)
+    for start in range(0, len(vectors), chunk_rows):
+        codes[start:start + chunk_rows] = codec.encode(vectors[start:start + chunk_rows])
+    return codes
+
+
+class VectorSpill:
+    """Append-only float32 rows in an unnamed temporary file, read back through a memory map.
+
+    Keeps the full-precision copies needed for re-scoring out of the heap:
+    only the pages of the rows actually re-scored are ever touched.
+    """
+
+    def __init__(self, dims, directory=None):
+        self.dims = dims
+        self.rows = 0
+        self._file = tempfile.TemporaryFile(dir=directory)
+        self._map = None
+
+    def append(self, vectors):
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        self._file.flush()
+        self.rows += len(vectors)
+
+    def view(self, rows):
+        """The first ``rows`` rows; earlier views stay valid after later appends"""
+        if rows == 0:
+            return np.empty((0, self.dims), dtype=np.float32)
+        if self._map is None or len(self._map) < rows:
+            self._map = np.memmap(self._file, dtype=np.float32, mode="r", shape=(self.rows, self.dims))
+        return self._map[:rows]
+
+    @property
+    def nbytes(self):
+        return self.rows * self.dims * 4
+
+    def close(self):
+        self._map = None
+        self._file.close()
@@ -0,0 +1,161 @@
+"""Post-processing stages between candidate search (vector, or vector + lexical) and the prompt"""
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimer:
+    """Collects wall-clock milliseconds per named stage"""
+
+    def __init__(self):
+        self.timings = {}
+
+    def stage(self, name):
+        return _Stage(self.timings, name)
+
+
+class _Stage:
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings[self.name] = self.timings.get(self.name, 0.0) + (time.perf_counter() - self.started) * 1000
+        return False
+
+
+def top_k_indices(scores, k):
+    """Indices of the k highest scores, best first, in O(n + k log k)"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=int)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def reciprocal_rank_fusion(rankings, query_embedding, limit, min_similarity=0.0, k=60):
+    """Merge ranked candidate lists from different searches into one, best first.
+
+    ``rankings`` holds lists of (score, content, vector) triples, each best
+    first; only their order is used, so cosine similarities and text ranks
+    mix freely. A document scores sum(1 / (k + rank)) over the lists it is
+    in. ``min_similarity`` drops documents found only by the first (vector)
+    list below that cosine; matches from the other lists stay whatever their
+    cosine, since exact terms are what they are there for.
+
+    Returns (candidates, fused): up to ``limit`` (cosine, content, vector)
+    triples and their fused scores scaled to [0, 1].
+    """
+    query = np.asarray(query_embedding, dtype=np.float32).ravel()
+    query = query / (np.linalg.norm(query) or 1.0)
+
+    fused = {}
+    found = {}
+    for list_index, ranking in enumerate(rankings):
+        for rank, (score, content, vector) in enumerate(ranking):
+            if list_index == 0 and score < min_similarity:
+                continue
+            fused[content] = fused.get(content, 0.0) + 1.0 / (k + rank + 1)
+            found.setdefault(content, vector)
+    if not fused:
+        return [], np.empty(0, dtype=np.float32)
+
+    order = sorted(fused, key=fused.get, reverse=True)[:limit]
+    vectors = np.asarray([found[content] for content in order], dtype=np.float32)
+    cosine = vectors @ query / np.maximum(np.linalg.norm(vectors, axis=1), 1e-12)
+    scores = np.array([fused[content] for content in order], dtype=np.float32)
+    # Same [0, 1] scale the reranker scores are brought to before MMR
+    best = 1.0 / (k + 1) * len(rankings)
+    candidates = [(float(c), content, vector) for c, content, vector in zip(cosine, order, vectors)]
+    return candidates, scores / best
+
+
+def mmr_select(query_scores, vectors, k, mmr_lambda=0.7, duplicate_threshold=0.95):
+    """Maximal marginal relevance over candidates.
+
+    Picks k candidates trading relevance (``query_scores``) against similarity
+    to what is already picked; candidates at or above ``duplicate_threshold``
+    cosine to a picked one are dropped outright. Returns indices in pick order.
+    """
+    if len(query_scores) == 0:
+        return []
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    pairwise = vectors @ vectors.T
+    query_scores = np.asarray(query_scores, dtype=np.float32)
+
+    selected = []
+    redundancy = np.full(len(query_scores), -np.inf, dtype=np.float32)
+    available = np.ones(len(query_scores), dtype=bool)
+    while len(selected) < k and available.any():
+        if selected:
+            mmr = mmr_lambda * query_scores - (1 - mmr_lambda) * redundancy
+        else:
+            mmr = query_scores.copy()
+        mmr[~available] = -np.inf
+        pick = int(np.argmax(mmr))
+        selected.append(pick)
+        available[pick] = False
+        redundancy = np.maximum(redundancy, pairwise[pick])
+        available &= pairwise[pick] < duplicate_threshold
+    return selected
+
+
+class CrossEncoderReranker:
+    """Optional reranker scoring (query, passage) pairs with a small cross-encoder.
+
+    Requires sentence-transformers; the model is loaded on first use.
+    """
+
+    def __init__(self, model_name="cross-encoder/ms-marco-MiniLM-L-6-v2"):
+        self.model_name = model_name
+        self._model = None
+
+    def __call__(self, query, passages):
+        if self._model is None:
+            from sentence_transformers import CrossEncoder
+            self._model = CrossEncoder(self.model_name)
+        return np.asarray(self._model.predict([(query, passage) for passage in passages]), dtype=np.float32)
+
+
+def run_pipeline(candidates, query, top_k, min_similarity=0.0, mmr_lambda=0.7,
+                 duplicate_threshold=0.95, reranker=None, timer=None, relevance=None):
+    """Threshold, optionally rerank, then MMR-select top_k from (score, content, vector) candidates.
+
+    Returns a list of (score, content) pairs, best first. Per-stage timings
+    are added to ``timer`` when one is given. ``relevance`` (e.g. fused
+    scores from reciprocal_rank_fusion, already thresholded) ranks the
+    candidates in place of their cosine scores.
+    """
+    timer = timer or StageTimer()
+
+    if relevance is None:
+        with timer.stage("threshold"):
+            candidates = [c for c in candidates if c[0] >= min_similarity]
+    if not candidates:
+        return []
+
+    scores = np.array([c[0] for c in candidates], dtype=np.float32)
+    relevance = scores if relevance is None else np.asarray(relevance, dtype=np.float32)
+    if reranker is not None:
+        with timer.stage("rerank"):
+            try:
+                rerank_scores = reranker(query, [c[1] for c in candidates])
+                # Bring reranker logits onto the cosine scale before mixing them into MMR
+                spread = rerank_scores.max() - rerank_scores.min()
+                relevance = (rerank_scores - rerank_scores.min()) / spread if spread > 0 else relevance
+            except Exception as e:
+                logger.error(f"Reranker failed, keeping vector order: {str(e)}", exc_info=True)
+
+    with timer.stage("mmr"):
+        order = mmr_select(relevance, [c[2] for c in candidates], top_k,
+                           mmr_lambda=mmr_lambda, duplicate_threshold=duplicate_threshold)
+
+    return [(float(scores[i]), candidates[i][1]) for i in order]
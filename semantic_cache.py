@@ -0,0 +1,148 @@
+"""Semantic answer cache: reuse a previous answer for an equivalent question over the same context"""
+import hashlib
+import logging
+import re
+import threading
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Words that usually point back at earlier turns ("what about that?", "explain it more")
+FOLLOW_UP_WORDS = re.compile(
+    r"\b(it|its|that|this|these|those|they|them|he|she|his|her|above|previous|earlier|"
+    r"again|more|else|also|instead|same|why)\b",
+    re.IGNORECASE
+)
+
+
+def context_id(content):
+    """Stable id for a retrieved chunk"""
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+
+
+def is_follow_up(query, history):
+    """True when the answer likely depends on the conversation, not just the documents"""
+    if not history:
+        return False
+    return len(query.split()) < 4 or bool(FOLLOW_UP_WORDS.search(query))
+
+
+class SemanticCache:
+    """Answers indexed by normalized query embedding, partitioned by context and model.
+
+    A lookup only considers entries generated from the same retrieved chunks
+    with the same model settings, and returns the closest one whose cosine
+    similarity reaches ``threshold``. Entries expire after ``ttl`` seconds and
+    the least recently used ones are dropped beyond ``max_entries``.
+    """
+
+    def __init__(self, threshold=0.95, max_entries=2000, ttl=24 * 3600):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        # Rows [:_size] line up with _entries; the capacity beyond grows by doubling
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self._size = 0
+        self._entries = []
+        self._stats = {"hits": 0, "misses": 0, "bypassed": 0, "seconds_saved": 0.0}
+
+    @staticmethod
+    def _partition(context_ids, model_key):
+        return model_key + "|" + ",".join(sorted(context_ids))
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _drop(self, indices):
+        dropped = set(indices)
+        keep = [i for i in range(self._size) if i not in dropped]
+        self._entries = [self._entries[i] for i in keep]
+        # Compact in place; the fancy index copies the kept rows first
+        self._vectors[:len(keep)] = self._vectors[keep]
+        self._size = len(keep)
+
+    def _append(self, vector):
+        if self._vectors.shape[1] == 0:
+            self._vectors = np.empty((max(1, min(self.max_entries, 64)), len(vector)), dtype=np.float32)
+        elif self._size == len(self._vectors):
+            grown = np.empty((max(self._size + 1, min(self.max_entries, 2 * self._size)), len(vector)),
+                             dtype=np.float32)
+            grown[:self._size] = self._vectors[:self._size]
+            self._vectors = grown
+        self._vectors[self._size] = vector
+        self._size += 1
+
+    def lookup(self, query_embedding, context_ids, model_key):
+        """Return the cached entry dict on a hit, else None"""
+        query = self._normalize(query_embedding)
+        partition = self._partition(context_ids, model_key)
+        now = time.time()
+        with self._lock:
+            expired = [i for i, entry in enumerate(self._entries) if entry["expires_at"] <= now]
+            if expired:
+                self._drop(expired)
+
+            candidates = [i for i, entry in enumerate(self._entries) if entry["partition"] == partition]
+            if candidates:
+                similarities = self._vectors[candidates] @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry = self._entries[candidates[best]]
+                    entry["last_used"] = now
+                    entry["hits"] += 1
+                    self._stats["hits"] += 1
+                    self._stats["seconds_saved"] += entry["generation_seconds"]
+                    logger.debug(f"Semantic cache hit (similarity {similarities[best]:.4f})")
+                    return entry
+            self._stats["misses"] += 1
+            return None
+
+    def record_bypass(self):
+        with self._lock:
+            self._stats["bypassed"] += 1
+
+    def put(self, query_embedding, context_ids, model_key, answer, reasoning="",
+            generation_seconds=0.0):
+        """Store an answer and return its entry, so audio can be attached once synthesized"""
+        query = self._normalize(query_embedding)
+        now = time.time()
+        entry = {
+            "partition": self._partition(context_ids, model_key),
+            "answer": answer,
+            "reasoning": reasoning,
+            "audio": None,
+            "voice": None,
+            "generation_seconds": generation_seconds,
+            "created": now,
+            "last_used": now,
+            "expires_at": now + self.ttl,
+            "hits": 0,
+        }
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                oldest = min(range(len(self._entries)), key=lambda i: self._entries[i]["last_used"])
+                self._drop([oldest])
+            self._append(query)
+            self._entries.append(entry)
+        return entry
+
+    @staticmethod
+    def attach_audio(entry, voice, segments):
+        """Remember synthesized audio segments for the voice they were spoken in"""
+        entry["voice"] = voice
+        entry["audio"] = list(segments)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+            }
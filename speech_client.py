@@ -0,0 +1,140 @@
+"""Shared HTTP client for the Azure speech endpoints (TTS and Whisper)"""
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from langchain_core.document_loaders import BaseBlobParser
+from langchain_core.documents import Document
+
+from telemetry import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class SpeechClient:
+    """Pooled keep-alive session with timeouts, jittered retries and a concurrency cap.
+
+    Requests beyond ``max_concurrency`` wait for a free slot instead of
+    failing, so a burst of sentence-level TTS calls queues inside the process
+    rather than tripping the service's rate limit.
+    """
+
+    def __init__(self, pool_size=10, max_concurrency=8, connect_timeout=3.05,
+                 read_timeout=60.0, max_retries=3, backoff_base=0.5, backoff_max=8.0, registry=None):
+        self.timeout = (connect_timeout, read_timeout)
+        # Optional telemetry.MetricsRegistry that also receives every observation
+        self.registry = registry
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        # Retries are handled below so they also respect the concurrency cap
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def _record(self, name, seconds, outcome):
+        with self._lock:
+            histogram = self._histograms.setdefault(name, LatencyHistogram())
+            counters = self._counters.setdefault(name, {"ok": 0, "error": 0, "retries": 0})
+            counters[outcome] += 1
+        histogram.observe(seconds)
+        if self.registry is not None:
+            self.registry.observe("chatbot_speech_request_seconds", seconds, endpoint=name)
+            self.registry.increment("chatbot_speech_requests_total", endpoint=name, outcome=outcome)
+
+    def _backoff(self, attempt, response=None):
+        """Full-jitter exponential backoff, honouring Retry-After when the service sends one"""
+        if response is not None and response.headers.get("Retry-After"):
+            try:
+                return min(float(response.headers["Retry-After"]), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def post(self, name, url, **kwargs):
+        """POST with retries on connection errors, timeouts, 429 and 5xx.
+
+        ``name`` labels the latency histogram. The final response is returned
+        even when it is an error so callers can log the body.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            response = None
+            error = None
+            with self._slots:
+                started = time.perf_counter()
+                try:
+                    response = self.session.post(url, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+                elapsed = time.perf_counter() - started
+
+            retryable = error is not None or response.status_code in RETRY_STATUSES
+            if not retryable or attempt >= self.max_retries:
+                self._record(name, elapsed, "ok" if response is not None and response.ok else "error")
+                if error is not None:
+                    raise error
+                return response
+
+            self._record(name, elapsed, "retries")
+            delay = self._backoff(attempt, response)
+            logger.warning(f"{name} request failed ({error or response.status_code}), "
+                           f"retrying in {delay:.2f}s")
+            time.sleep(delay)
+            attempt += 1
+
+    def synthesize(self, endpoint, api_key, api_version, text, voice):
+        return self.post(
+            "tts",
+            f"{endpoint}?api-version={api_version}",
+            headers={"api-key": api_key, "Content-Type": "application/json"},
+            json={"input": text, "voice": voice},
+        )
+
+    def transcribe(self, endpoint, api_key, audio_bytes, filename="audio.wav", mime_type="audio/wav"):
+        return self.post(
+            "stt",
+            endpoint,
+            headers={"api-key": api_key},
+            files={"file": (filename, audio_bytes, mime_type)},
+        )
+
+    def stats(self):
+        with self._lock:
+            names = list(self._histograms)
+            counters = {name: dict(self._counters[name]) for name in names}
+        return {name: {**counters[name], **self._histograms[name].snapshot()} for name in names}
+
+
+class PooledWhisperParser(BaseBlobParser):
+    """Whisper blob parser that sends audio through the shared SpeechClient pool"""
+
+    def __init__(self, client, endpoint, api_key):
+        self.client = client
+        self.endpoint = endpoint
+        self.api_key = api_key
+
+    def lazy_parse(self, blob):
+        response = self.client.transcribe(
+            self.endpoint, self.api_key, blob.as_bytes(),
+            filename=os.path.basename(blob.source) if blob.source else "audio.wav",
+            mime_type=blob.mimetype or "audio/wav",
+        )
+        if not response.ok:
+            raise RuntimeError(f"Whisper error {response.status_code}: {response.text}")
+        yield Document(page_content=response.json().get("text", ""),
+                       metadata={"source": blob.source})
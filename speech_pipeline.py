@@ -0,0 +1,120 @@
+"""Sentence-level text-to-speech that starts speaking while the answer is still streaming"""
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Sentence ends, plus clause breaks used once a sentence runs long
+SENTENCE_END = re.compile(r"[.!?](?:[\"')\]]*)(?=\s)|\n\s*\n")
+CLAUSE_END = re.compile(r"[,;:](?=\s)")
+MARKDOWN_NOISE = re.compile(r"[*_#`>|]+")
+
+
+class SentenceChunker:
+    """Cut streamed text into speakable segments.
+
+    Segments shorter than ``min_chars`` are merged with the next one so the
+    TTS service is not called for "Yes." on its own; text longer than
+    ``max_chars`` without a sentence end is cut at the last clause break.
+    """
+
+    def __init__(self, min_chars=40, max_chars=240):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, text):
+        self._buffer += text
+        segments = []
+        while True:
+            cut = self._next_cut()
+            if cut is None:
+                break
+            segment, self._buffer = self._buffer[:cut], self._buffer[cut:]
+            segment = clean_for_speech(segment)
+            if segment:
+                segments.append(segment)
+        return segments
+
+    def _next_cut(self):
+        for match in SENTENCE_END.finditer(self._buffer):
+            if match.end() >= self.min_chars:
+                return match.end()
+        if len(self._buffer) > self.max_chars:
+            clauses = [m.end() for m in CLAUSE_END.finditer(self._buffer, 0, self.max_chars)]
+            if clauses and clauses[-1] >= self.min_chars:
+                return clauses[-1]
+            space = self._buffer.rfind(" ", 0, self.max_chars)
+            return space if space > 0 else self.max_chars
+        return None
+
+    def flush(self):
+        segment, self._buffer = clean_for_speech(self._buffer), ""
+        return [segment] if segment else []
+
+
+def clean_for_speech(text):
+    """Drop markdown markup the voice would otherwise read out"""
+    return " ".join(MARKDOWN_NOISE.sub(" ", text).split())
+
+
+class SpeechPipeline:
+    """Synthesize segments concurrently on a bounded pool and hand them back in order"""
+
+    def __init__(self, synthesize, max_workers=3, chunker=None):
+        self.synthesize = synthesize
+        self.chunker = chunker or SentenceChunker()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts")
+        self._futures = []
+        self._texts = []
+        self._next = 0
+        self.started = time.perf_counter()
+        self.first_audio = None
+        self.segments = []  # (text, audio) in playback order, as delivered
+
+    def feed(self, text):
+        for segment in self.chunker.feed(text):
+            self._submit(segment)
+
+    def finish(self):
+        """Submit whatever is left once the LLM stream has ended"""
+        for segment in self.chunker.flush():
+            self._submit(segment)
+
+    def _submit(self, segment):
+        logger.debug(f"Queueing TTS segment {len(self._futures)}: {segment[:60]}")
+        self._texts.append(segment)
+        self._futures.append(self._executor.submit(self.synthesize, segment))
+
+    def _take(self):
+        index = self._next
+        self._next += 1
+        try:
+            audio = self._futures[index].result()
+        except Exception as e:
+            logger.error(f"TTS segment {index} failed: {str(e)}", exc_info=True)
+            audio = None
+        if audio and self.first_audio is None:
+            self.first_audio = time.perf_counter() - self.started
+        self.segments.append((self._texts[index], audio))
+        return index, self._texts[index], audio
+
+    def ready(self):
+        """(index, text, audio) for segments finished so far, in order, without blocking on later ones"""
+        segments = []
+        while self._next < len(self._futures) and self._futures[self._next].done():
+            segments.append(self._take())
+        return segments
+
+    def remaining(self):
+        """Block until every submitted segment is synthesized, yielding them in order"""
+        while self._next < len(self._futures):
+            yield self._take()
+
+    def close(self, cancel=False):
+        if cancel:
+            for future in self._futures[self._next:]:
+                future.cancel()
+        self._executor.shutdown(wait=not cancel)
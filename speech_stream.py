@@ -0,0 +1,304 @@
+"""Speech-to-text that transcribes while the speaker is still talking
+
+A cheap energy-based voice activity detector cuts the incoming audio at
+pauses, and every finished segment goes to Whisper straight away. When the
+speaker stops, only the last segment is left to transcribe instead of the
+whole utterance.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from audio_utils import encode_wav
+
+logger = logging.getLogger(__name__)
+
+# Length of the frames the detector classifies as speech or not
+FRAME_MS = 30
+# A pause this long ends a segment; shorter ones are gaps between words
+MIN_SILENCE = 0.5
+# Longer stretches without such a pause are cut at their quietest frame
+MAX_SEGMENT_SECONDS = 15.0
+# Words compared when dropping text repeated across a segment boundary
+MAX_OVERLAP_WORDS = 4
+
+
+class EnergySegmenter:
+    """Split a stream of mono samples into speech segments at pauses.
+
+    A frame is speech when its level is ``threshold_db`` above the noise
+    floor and above ``min_level_db``. The floor follows the quiet frames
+    closely and the loud ones very slowly, so a steady background noise
+    stops counting as speech after a few seconds. A segment ends after
+    ``min_silence`` seconds without speech. Segments with less than
+    ``min_speech`` seconds of speech are dropped, such as a click or a
+    cough. ``padding`` seconds of audio are kept on both sides of each
+    segment so word onsets and endings are not clipped.
+    """
+
+    def __init__(self, rate, frame_ms=FRAME_MS, threshold_db=10.0, min_level_db=-45.0, min_silence=MIN_SILENCE,
+                 min_speech=0.2, max_segment=MAX_SEGMENT_SECONDS, padding=0.2):
+        self.rate = rate
+        self.frame = max(1, int(rate * frame_ms / 1000))
+        self.frame_seconds = self.frame / rate
+        self.threshold_db = threshold_db
+        self.min_level_db = min_level_db
+        self.silence_frames = max(1, round(min_silence / self.frame_seconds))
+        self.min_speech_frames = max(1, round(min_speech / self.frame_seconds))
+        self.max_frames = max(2, round(max_segment / self.frame_seconds))
+        self.padding_frames = round(padding / self.frame_seconds)
+        # Until quiet frames are seen, anything above min_level_db is speech
+        self.noise_floor = min_level_db - threshold_db
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._position = 0
+        self._preroll = deque(maxlen=self.padding_frames)
+        self._frames = []  # (samples, level, is_speech) of the open segment
+        self._start = None  # frame number the open segment starts at
+        self._silence = 0  # trailing frames of the open segment without speech
+
+    def feed(self, samples):
+        """Add audio; returns the (start_seconds, samples) segments it completed"""
+        samples = np.asarray(samples, dtype=np.float32)
+        if samples.ndim > 1:
+            samples = samples.mean(axis=1)
+        data = np.concatenate([self._pending, samples])
+        count = len(data) // self.frame
+        self._pending = data[count * self.frame:]
+        frames = data[:count * self.frame].reshape(count, self.frame)
+        levels = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-12)
+
+        segments = []
+        for frame, level in zip(frames, levels):
+            segment = self._step(frame, float(level))
+            if segment is not None:
+                segments.append(segment)
+        return segments
+
+    def flush(self):
+        """Close the open segment at the end of the stream"""
+        self._pending = np.zeros(0, dtype=np.float32)
+        if self._start is None:
+            return []
+        segment = self._close()
+        return [segment] if segment is not None else []
+
+    def _is_speech(self, level):
+        speech = level > max(self.noise_floor + self.threshold_db, self.min_level_db)
+        if not speech:
+            rate = 0.3 if level < self.noise_floor else 0.05
+        else:
+            rate = 0.005
+        self.noise_floor += rate * (level - self.noise_floor)
+        return speech
+
+    def _step(self, frame, level):
+        speech = self._is_speech(level)
+        number = self._position
+        self._position += 1
+        if self._start is None:
+            if not speech:
+                self._preroll.append((frame, level, False))
+                return None
+            self._frames = list(self._preroll) + [(frame, level, True)]
+            self._start = number - len(self._preroll)
+            self._preroll.clear()
+            self._silence = 0
+            return None
+
+        self._frames.append((frame, level, speech))
+        self._silence = 0 if speech else self._silence + 1
+        if self._silence >= self.silence_frames:
+            return self._close()
+        if len(self._frames) >= self.max_frames:
+            return self._cut()
+        return None
+
+    def _close(self):
+        """End the open segment, keeping ``padding`` of its trailing silence"""
+        keep = len(self._frames) - max(0, self._silence - self.padding_frames)
+        frames, rest = self._frames[:keep], self._frames[keep:]
+        # The rest of the pause is the lead-in of the next segment
+        self._preroll.extend(rest)
+        start = self._start
+        self._frames, self._start, self._silence = [], None, 0
+        return self._emit(start, frames)
+
+    def _cut(self):
+        """Split an over-long segment at the quietest frame of its second half"""
+        half = len(self._frames) // 2
+        cut = half + int(np.argmin([level for _, level, _ in self._frames[half:]]))
+        frames, self._frames = self._frames[:cut], self._frames[cut:]
+        start = self._start
+        self._start += cut
+        self._silence = min(self._silence, len(self._frames))
+        return self._emit(start, frames)
+
+    def _emit(self, start, frames):
+        if sum(speech for _, _, speech in frames) < self.min_speech_frames:
+            return None
+        return start * self.frame_seconds, np.concatenate([samples for samples, _, _ in frames])
+
+
+def _word_key(word):
+    return word.strip(".,;:!?\"'").lower()
+
+
+def stitch_transcripts(texts):
+    """Join segment transcripts in order, dropping words repeated across a boundary.
+
+    Failed segments (None) are skipped. Only runs of two or more words count
+    as repeats, so a word the speaker really said twice is kept.
+    """
+    words = []
+    for text in texts:
+        new = (text or "").split()
+        overlap = 0
+        for size in range(min(MAX_OVERLAP_WORDS, len(words), len(new)), 1, -1):
+            if [_word_key(w) for w in words[-size:]] == [_word_key(w) for w in new[:size]]:
+                overlap = size
+                break
+        words.extend(new[overlap:])
+    return " ".join(words) or None
+
+
+class StreamingTranscriber:
+    """Segment incoming audio on a background thread and transcribe each segment as soon as it ends.
+
+    ``feed()`` only queues the samples, so it can be called from a sound
+    device callback. ``transcribe(wav_bytes)`` returns text, or None on
+    failure. It runs on a pool of ``max_workers`` threads, so a slow segment
+    does not hold up the next one.
+    """
+
+    def __init__(self, transcribe, rate, max_workers=2, segmenter=None, registry=None):
+        self.transcribe = transcribe
+        self.rate = rate
+        self.segmenter = segmenter or EnergySegmenter(rate)
+        # Optional telemetry.MetricsRegistry
+        self.registry = registry
+        self.tail_seconds = None  # from finish() to the full transcript
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stt")
+        self._futures = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._segment_loop, name="stt-segmenter", daemon=True)
+        self._thread.start()
+
+    def feed(self, samples):
+        # Sound devices reuse their buffers, so keep a copy
+        self._queue.put(np.array(samples, dtype=np.float32))
+
+    def _segment_loop(self):
+        while True:
+            samples = self._queue.get()
+            try:
+                segments = self.segmenter.flush() if samples is None else self.segmenter.feed(samples)
+            except Exception as e:
+                logger.error(f"Speech segmentation failed: {str(e)}", exc_info=True)
+                segments = []
+            for start, segment in segments:
+                logger.debug(f"Transcribing segment at {start:.2f}s ({len(segment) / self.rate:.2f}s)")
+                with self._lock:
+                    self._futures.append(self._executor.submit(self._transcribe_segment, segment))
+            if samples is None:
+                return
+
+    def _transcribe_segment(self, samples):
+        try:
+            text = self.transcribe(encode_wav(samples, self.rate))
+        except Exception as e:
+            logger.error(f"Segment transcription failed: {str(e)}", exc_info=True)
+            text = None
+        if self.registry is not None:
+            self.registry.increment("chatbot_stt_segments_total", outcome="ok" if text else "error")
+        return text
+
+    @property
+    def segments(self):
+        with self._lock:
+            return len(self._futures)
+
+    def partial(self):
+        """Transcript of the leading segments that are already transcribed"""
+        with self._lock:
+            futures = list(self._futures)
+        texts = []
+        for future in futures:
+            if not future.done():
+                break
+            texts.append(future.result())
+        return stitch_transcripts(texts) or ""
+
+    def finish(self):
+        """End the stream and wait for the remaining segments; returns the whole transcript or None"""
+        started = time.perf_counter()
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+        with self._lock:
+            futures = list(self._futures)
+        text = stitch_transcripts([future.result() for future in futures])
+        self._executor.shutdown(wait=False)
+        self.tail_seconds = time.perf_counter() - started
+        if self.registry is not None:
+            self.registry.observe("chatbot_stt_tail_seconds", self.tail_seconds)
+        return text
+
+    def close(self):
+        """Abandon the stream without waiting for transcripts"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class MicrophoneStream:
+    """Record the local microphone into a StreamingTranscriber until stop().
+
+    ``new_transcriber(rate)`` builds the transcriber for the device's native
+    sample rate; segments are resampled for Whisper when they are encoded.
+    """
+
+    def __init__(self, new_transcriber, device=None, block_ms=50):
+        import sounddevice as sd
+
+        rate = int(sd.query_devices(device, "input")["default_samplerate"])
+        self.transcriber = new_transcriber(rate)
+        self.started = time.monotonic()
+        self.overflows = 0
+        self._stream = sd.InputStream(samplerate=rate, channels=1, device=device, dtype="float32",
+                                      blocksize=int(rate * block_ms / 1000), callback=self._callback)
+        self._stream.start()
+
+    def _callback(self, indata, frames, time_info, status):
+        if status:
+            self.overflows += 1
+        self.transcriber.feed(indata[:, 0])
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def partial(self):
+        return self.transcriber.partial()
+
+    def stop(self):
+        """Stop recording; returns the transcript once the last segment is transcribed"""
+        self._stream.stop()
+        self._stream.close()
+        if self.overflows:
+            logger.warning(f"Microphone input overflowed {self.overflows} times")
+        return self.transcriber.finish()
+
+    def close(self):
+        """Stop recording and drop whatever was said"""
+        self._stream.stop()
+        self._stream.close()
+        self.transcriber.close()
@@ -0,0 +1,251 @@
+"""Lightweight latency measurement shared by the app's service clients"""
+import asyncio
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds; the last bucket catches everything slower
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class LatencyHistogram:
+    """Thread-safe fixed-bucket histogram with approximate percentiles"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self._count += 1
+            self._sum += seconds
+            self._max = max(self._max, seconds)
+
+    def percentile(self, q):
+        """q-th quantile (0 < q <= 1), interpolated linearly inside its bucket like Prometheus does"""
+        with self._lock:
+            if not self._count:
+                return None
+            target = q * self._count
+            seen = 0
+            for index, count in enumerate(self._counts):
+                if count and seen + count >= target:
+                    if index == len(self.buckets):
+                        return self._max
+                    lower = self.buckets[index - 1] if index else 0.0
+                    upper = min(self.buckets[index], self._max)
+                    return lower + (upper - lower) * max(0.0, target - seen) / count
+                seen += count
+            return self._max
+
+    def snapshot(self):
+        with self._lock:
+            count, total, maximum = self._count, self._sum, self._max
+            counts = list(self._counts)
+        return {
+            "count": count,
+            "sum": total,
+            "mean": total / count if count else None,
+            "max": maximum if count else None,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "buckets": dict(zip([*map(str, self.buckets), "+Inf"], counts)),
+        }
+
+
+class Trace:
+    """Wall-clock spans for one request, recorded from any thread or coroutine.
+
+    Times are seconds since the trace was created, so spans of stages that
+    ran concurrently visibly overlap.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self._spans = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        start = time.perf_counter() - self.origin
+        status = "ok"
+        try:
+            yield
+        except BaseException as e:
+            status = "cancelled" if isinstance(e, asyncio.CancelledError) else "error"
+            raise
+        finally:
+            end = time.perf_counter() - self.origin
+            with self._lock:
+                self._spans.append({"name": name, "start": start, "end": end, "status": status, **attributes})
+
+    def spans(self):
+        """Recorded spans ordered by start time"""
+        with self._lock:
+            return sorted(self._spans, key=lambda span: span["start"])
+
+    def overlap(self):
+        """Seconds saved by concurrency: summed span time minus the wall time they cover"""
+        spans = self.spans()
+        if not spans:
+            return 0.0
+        covered = 0.0
+        current_start, current_end = spans[0]["start"], spans[0]["end"]
+        for span in spans[1:]:
+            if span["start"] > current_end:
+                covered += current_end - current_start
+                current_start, current_end = span["start"], span["end"]
+            else:
+                current_end = max(current_end, span["end"])
+        covered += current_end - current_start
+        return sum(span["end"] - span["start"] for span in spans) - covered
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels) + "}"
+
+
+class MetricsRegistry:
+    """Named, labelled histograms and counters for the whole process.
+
+    ``render_prometheus()`` writes them in the Prometheus text exposition
+    format, so any scraper (or curl) can read them from a metrics endpoint.
+    """
+
+    def __init__(self):
+        self._histograms = {}  # name -> {sorted label tuple: LatencyHistogram}
+        self._counters = {}    # name -> {sorted label tuple: value}
+        self._gauges = {}      # name -> {sorted label tuple: function returning the current value}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help=None, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            if help:
+                self._help[name] = help
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = LatencyHistogram()
+            return series[key]
+
+    def observe(self, name, seconds, **labels):
+        self.histogram(name, **labels).observe(seconds)
+
+    def increment(self, name, value=1, help=None, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            if help:
+                self._help[name] = help
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def gauge(self, name, value, help=None, **labels):
+        """Register a gauge; ``value()`` is called for its current value whenever metrics are read"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            if help:
+                self._help[name] = help
+            self._gauges.setdefault(name, {})[key] = value
+
+    def describe(self, name, help):
+        with self._lock:
+            self._help[name] = help
+
+    def snapshot(self, name, label):
+        """{label value: histogram snapshot} for one histogram, e.g. per stage"""
+        with self._lock:
+            series = dict(self._histograms.get(name, {}))
+        return {dict(key).get(label): histogram.snapshot() for key, histogram in series.items()}
+
+    def counters(self, name, label):
+        with self._lock:
+            series = dict(self._counters.get(name, {}))
+        return {dict(key).get(label): value for key, value in series.items()}
+
+    def render_prometheus(self):
+        with self._lock:
+            histograms = {name: dict(series) for name, series in self._histograms.items()}
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            gauges = {name: dict(series) for name, series in self._gauges.items()}
+            help_texts = dict(self._help)
+
+        lines = []
+        for name, series in sorted(counters.items()):
+            if name in help_texts:
+                lines.append(f"# HELP {name} {help_texts[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{_label_text(labels)} {value}")
+        for name, series in sorted(gauges.items()):
+            if name in help_texts:
+                lines.append(f"# HELP {name} {help_texts[name]}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{_label_text(labels)} {value()}")
+        for name, series in sorted(histograms.items()):
+            if name in help_texts:
+                lines.append(f"# HELP {name} {help_texts[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in sorted(series.items()):
+                snapshot = histogram.snapshot()
+                cumulative = 0
+                for bound, count in snapshot["buckets"].items():
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_label_text(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{_label_text(labels)} {snapshot['sum']}")
+                lines.append(f"{name}_count{_label_text(labels)} {snapshot['count']}")
+        return "\n".join(lines) + "\n"
+
+
+# Shared by everything in the process; exported by api_server.py and start_metrics_server()
+REGISTRY = MetricsRegistry()
+REGISTRY.describe("chatbot_stage_seconds", "Duration of each stage of a chat turn")
+REGISTRY.describe("chatbot_turns_total", "Chat turns by outcome")
+
+
+def record_trace(trace, registry=REGISTRY):
+    """Add a finished trace's spans to the per-stage histogram ("tts 3" counts as "tts")"""
+    for span in trace.spans():
+        if span["status"] == "ok":
+            registry.observe("chatbot_stage_seconds", span["end"] - span["start"], stage=span["name"].split(" ")[0])
+
+
+def start_metrics_server(port, host="0.0.0.0", registry=REGISTRY):
+    """Serve GET /metrics from a daemon thread, for processes without a web framework"""
+    # Only processes that export metrics this way pay for importing http.server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = self.server.registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
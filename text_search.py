@@ -0,0 +1,149 @@
+"""Full-text search over langchain_pg_embedding using a Postgres tsvector/GIN index
+
+The lexical side of hybrid retrieval: exact identifiers, part numbers and
+error codes that embeddings blur together are matched as words here.
+"""
+import logging
+import re
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from vector_store import EMBEDDING_TABLE, COLLECTION_TABLE, decode_vector_send
+from embedding_store import parse_vector_text
+
+logger = logging.getLogger(__name__)
+
+# Drops stop words, which would otherwise match nearly every row; codes like E-1042 are not stemmed
+DEFAULT_CONFIG = "english"
+# Words of a question looked up; longer questions keep their first ones
+MAX_QUERY_TERMS = 32
+
+
+def _document_expr(config):
+    """The tsvector expression the GIN index is built on; queries must repeat it exactly"""
+    if not re.fullmatch(r"[a-z_]+", config):
+        raise ValueError(f"Invalid text search configuration: {config!r}")
+    return f"""to_tsvector('{config}'::regconfig, "pageContent")"""
+
+
+def query_terms(query):
+    """Distinct words, identifiers and codes (E-1042, v2.3.1, /etc/app.conf) in a question"""
+    terms = []
+    for term in re.findall(r"\w+(?:[-./:]\w+)*", query):
+        if term.lower() not in terms:
+            terms.append(term.lower())
+    return terms[:MAX_QUERY_TERMS]
+
+
+def index_name(config=DEFAULT_CONFIG):
+    return f"{EMBEDDING_TABLE}_content_{config}_fts_idx"
+
+
+def text_index_exists(engine, config=DEFAULT_CONFIG):
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT 1 FROM pg_indexes WHERE indexname = :name"),
+                            {"name": index_name(config)}).scalar() is not None
+
+
+def ensure_text_index(engine, config=DEFAULT_CONFIG, rebuild=False):
+    """Create (or rebuild) the GIN index used by text_search, CONCURRENTLY so searches keep running"""
+    name = index_name(config)
+    expr = _document_expr(config)
+
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if rebuild:
+            logger.info(f"Dropping text index {name}")
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+        logger.info(f"Building text index {name}")
+        conn.execute(text(f"""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS {name}
+            ON {EMBEDDING_TABLE}
+            USING gin ({expr})
+        """))
+        conn.execute(text(f"ANALYZE {EMBEDDING_TABLE}"))
+
+    return name
+
+
+def text_search(engine, query, top_k=20, collection=None, config=DEFAULT_CONFIG,
+                max_matches=1000, timeout_ms=None, binary=True):
+    """Return up to top_k (rank, content, vector) triples for a free-text query, best first.
+
+    Only the first ``max_matches`` index hits are ranked, so a query made of
+    common words costs the same as a rare one; ``timeout_ms`` caps the
+    statement as a whole. Both keep the lexical side inside the latency
+    budget of the vector search it runs next to. A timed-out search returns
+    no results instead of failing the turn. ``binary`` reads the vectors with
+    vector_send() (needs pgvector) instead of parsing their text form.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+    expr = _document_expr(config)
+    params = {"top_k": int(top_k), "max_matches": int(max_matches)}
+    # Any word may match (||); ts_rank_cd then favours documents that match more of them.
+    # Each term is parsed on its own, so nothing the user types is read as tsquery syntax.
+    tsquery = " || ".join(f"plainto_tsquery('{config}'::regconfig, :term{index})" for index in range(len(terms)))
+    params.update({f"term{index}": term for index, term in enumerate(terms)})
+
+    where = ""
+    if collection:
+        where = f"""AND collection_id = (
+                SELECT uuid FROM {COLLECTION_TABLE} WHERE name = :collection
+            )"""
+        params["collection"] = collection
+
+    vector_expr = "vector_send(embedding)" if binary else "embedding::text"
+    try:
+        # engine.begin() keeps the set_config(..., true) call local to this query
+        with engine.begin() as conn:
+            if timeout_ms:
+                conn.execute(text("SELECT set_config('statement_timeout', :value, true)"),
+                             {"value": str(int(timeout_ms))})
+            # The query is spelled out inline (not joined from a CTE) so the planner sees a
+            # constant it can look up in the GIN index
+            results = conn.execute(text(f"""
+                WITH matches AS (
+                    SELECT "pageContent", embedding, {expr} AS document
+                    FROM {EMBEDDING_TABLE}
+                    WHERE {expr} @@ ({tsquery})
+                    {where}
+                    LIMIT :max_matches
+                )
+                SELECT "pageContent",
+                       ts_rank_cd(document, {tsquery}) AS rank,
+                       {vector_expr}
+                FROM matches
+                ORDER BY rank DESC
+                LIMIT :top_k
+            """), params).fetchall()
+    except OperationalError as e:
+        if "statement timeout" not in str(e):
+            raise
+        logger.warning(f"Text search exceeded {timeout_ms}ms, continuing without lexical results")
+        return []
+
+    if not results:
+        return []
+    payloads = [row[2] for row in results]
+    vectors = decode_vector_send(payloads) if binary else parse_vector_text(payloads)
+    return [(float(row[1]), row[0], vector) for row, vector in zip(results, vectors)]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from db import create_db_engine
+
+    arg_parser = argparse.ArgumentParser(description="Manage the full-text index used by hybrid search")
+    arg_parser.add_argument("--dsn", default=None,
+                            help="SQLAlchemy connection string (defaults to $POSTGRES_CONNECTION)")
+    arg_parser.add_argument("--config", default=DEFAULT_CONFIG, help="Postgres text search configuration")
+    arg_parser.add_argument("--rebuild", action="store_true", help="Drop and recreate the index")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    ensure_text_index(create_db_engine(args.dsn), config=args.config, rebuild=args.rebuild)
@@ -0,0 +1,169 @@
+"""Content-addressed cache for synthesized speech, keyed by text, voice and API version"""
+import hashlib
+import logging
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text):
+    """Collapse whitespace and unicode variants so equivalent sentences share a key"""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(text, voice, api_version):
+    material = "\x1f".join([normalize_text(text), voice, api_version])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """Two-tier audio cache: an in-memory LRU in front of a size-capped directory.
+
+    Disk entries are evicted least-recently-used first (by mtime, refreshed on
+    every hit) once the directory grows past ``disk_max_bytes``.
+    """
+
+    def __init__(self, directory=None, memory_max_bytes=32 * 1024 * 1024,
+                 disk_max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "bytes_saved": 0,
+            "evictions": 0,
+        }
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".audio")
+
+    def _disk_entries(self):
+        """(path, size, mtime) for every cached file"""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".audio"):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def _remember(self, key, audio):
+        if len(audio) > self.memory_max_bytes:
+            return
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def get(self, text, voice, api_version):
+        key = cache_key(text, voice, api_version)
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                self._stats["bytes_saved"] += len(audio)
+                return audio
+
+        if self.directory:
+            path = self._path(key)
+            try:
+                with open(path, "rb") as f:
+                    audio = f.read()
+                os.utime(path)
+            except FileNotFoundError:
+                audio = None
+            if audio is not None:
+                with self._lock:
+                    self._remember(key, audio)
+                    self._stats["disk_hits"] += 1
+                    self._stats["bytes_saved"] += len(audio)
+                return audio
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, text, voice, api_version, audio):
+        key = cache_key(text, voice, api_version)
+        with self._lock:
+            self._remember(key, audio)
+
+        if self.directory:
+            path = self._path(key)
+            if os.path.exists(path):
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._disk_bytes += len(audio)
+                over_budget = self._disk_bytes > self.disk_max_bytes
+            if over_budget:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        """Delete least recently used files until the directory is back under 90% of the cap"""
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.disk_max_bytes * 0.9
+        evicted = 0
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        with self._lock:
+            self._disk_bytes = total
+            self._stats["evictions"] += evicted
+        logger.debug(f"TTS cache evicted {evicted} files, {total} bytes on disk")
+
+    def get_or_synthesize(self, text, voice, api_version, synthesize):
+        """Serve from cache, or call synthesize(text, voice) and store a successful result"""
+        audio = self.get(text, voice, api_version)
+        if audio is not None:
+            return audio
+        audio = synthesize(text, voice)
+        if audio:
+            self.put(text, voice, api_version, audio)
+        return audio
+
+    def stats(self):
+        with self._lock:
+            hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+            lookups = hits + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_ratio": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+            }
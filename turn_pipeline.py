@@ -0,0 +1,292 @@
+"""One chat turn as concurrent asyncio stages, reported as a stream of events
+
+Events are dicts with a "type":
+
+    transcript  {"text"}                         audio turns, once Whisper returns (None on failure)
+    context     {"results", "timings"}           retrieved (score, content) pairs, best first
+    prompt      {"tokens", "cached"}             prompt built; cached means the answer cache hit
+    token       {"channel", "text"}              "think" or "answer" text as it streams in
+    audio       {"index", "text", "audio"}       synthesized speech segments, in playback order
+    error       {"message"}
+    done        {"answer", "reasoning", "metrics", "spans", "state"}
+
+``state`` is the session's updated history state, for callers that keep it
+across requests themselves (the HTTP API is stateless).
+"""
+import asyncio
+import base64
+import itertools
+import logging
+import queue
+import threading
+import time
+
+from llm_streaming import ThinkSplitter, StreamStats
+from speech_pipeline import SpeechPipeline
+from semantic_cache import context_id, is_follow_up
+from telemetry import Trace, record_trace
+
+logger = logging.getLogger(__name__)
+
+
+class TurnPipeline:
+    """Runs a turn with independent stages overlapped instead of one after another.
+
+        transcribe ──┐
+        history ─────┼──────────────────────────────┐
+        warm ────────┤                              ├─ generate
+                     └─ embed ─ retrieve ─ cache ───┘     └ tts, per sentence while generating
+
+    Blocking calls (Whisper, embedding, SQL, summarization, TTS) run in worker
+    threads. The answer is streamed with ``astream``, so cancelling a turn
+    closes the model connection and Ollama stops generating. Work already
+    handed to a thread still finishes after a cancel; its result is dropped.
+
+    ``search(question, query_embedding, top_k, min_similarity, search_mode)``
+    returns (results, timings); ``synthesize(text, voice)`` returns audio bytes or None.
+    With a ``registry`` (telemetry.MetricsRegistry), every turn's stage
+    durations and outcome are added to its histograms and counters.
+    """
+
+    def __init__(self, embeddings, chat_model, search, history, answer_cache=None,
+                 transcribe=None, synthesize=None, warm=None, tts_workers=3, registry=None):
+        self.embeddings = embeddings
+        self.chat_model = chat_model
+        self.search = search
+        self.history = history
+        self.answer_cache = answer_cache
+        self.transcribe = transcribe
+        self.synthesize = synthesize
+        self.warm = warm
+        self.tts_workers = tts_workers
+        self.registry = registry
+
+    async def run(self, emit, history, state, question=None, audio=None, voice=None,
+                  top_k=3, min_similarity=0.0, model_key="", search_mode=None, temperature=None):
+        """Run one turn, passing events to ``emit`` as they happen.
+
+        ``history`` holds the previous messages, without this question;
+        ``state`` is the session's HistoryManager state; it is left untouched,
+        and the updated copy arrives with the "done" event. Pass ``audio``
+        instead of ``question`` to transcribe first, and ``voice`` to speak the
+        answer.
+        ``search_mode`` ("vector" or "hybrid") is handed to ``search``; None
+        leaves the choice to it. ``temperature`` overrides the chat model's own
+        for this turn; ``model_key`` should name the one used.
+        """
+        trace = Trace()
+        speech = None
+        outcome = "error"
+        # The history thread cannot be stopped by cancelling the turn, so it
+        # must not fold into a state that the next turn is already using
+        state = dict(state or {})
+
+        def in_thread(name, fn, *args, **attributes):
+            async def stage():
+                with trace.span(name, **attributes):
+                    return await asyncio.to_thread(fn, *args)
+            return asyncio.ensure_future(stage())
+
+        # Neither depends on the question, so they start before it is even transcribed
+        background = [in_thread("history", self.history.prepare, state, history)]
+        if self.warm is not None:
+            background.append(in_thread("warm", self.warm))
+
+        try:
+            if audio is not None:
+                question = await in_thread("transcribe", self.transcribe, audio)
+                emit({"type": "transcript", "text": question})
+                if not question:
+                    outcome = "no_transcript"
+                    return
+
+            query_vector = await in_thread("embed", self.embeddings.embed_query, question)
+            results, timings = await in_thread("retrieve", self.search, question, query_vector,
+                                               top_k, min_similarity, search_mode)
+            emit({"type": "context", "results": results, "timings": timings})
+            self._observe_stages({f"retrieve.{stage}": ms / 1000 for stage, ms in timings.items()})
+            contexts = [content for _, content in results]
+            context_ids = [context_id(content) for content in contexts]
+
+            # Reuse a stored answer to an equivalent question over the same documents,
+            # unless the question leans on the conversation so far
+            follow_up = is_follow_up(question, history)
+            cached = None
+            if self.answer_cache is not None:
+                if follow_up:
+                    self.answer_cache.record_bypass()
+                else:
+                    cached = self.answer_cache.lookup(query_vector, context_ids, model_key)
+
+            await background[0]
+            messages, prompt_tokens = await in_thread("prompt", self.history.build, state, history,
+                                                      "\n\n".join(contexts), question)
+            emit({"type": "prompt", "tokens": prompt_tokens, "cached": cached is not None})
+
+            cached_audio = None
+            if voice and cached is not None and cached["voice"] == voice:
+                cached_audio = cached["audio"]
+            if voice and self.synthesize is not None and not cached_audio:
+                speech = SpeechPipeline(self._traced_synthesize(trace, voice), max_workers=self.tts_workers)
+
+            if cached is not None:
+                answer, reasoning = cached["answer"], cached["reasoning"]
+                metrics = {"cached": True, "seconds_saved": cached["generation_seconds"]}
+                if reasoning:
+                    emit({"type": "token", "channel": "think", "text": reasoning})
+                emit({"type": "token", "channel": "answer", "text": answer})
+                if cached_audio:
+                    for index, segment_audio in enumerate(cached_audio):
+                        emit({"type": "audio", "index": index, "text": None, "audio": segment_audio})
+                elif speech is not None:
+                    speech.feed(answer)
+            else:
+                answer, reasoning, metrics = await self._generate(messages, emit, speech, trace, temperature)
+                self._observe_stages({"llm_ttft": metrics["ttft"]})
+            metrics["prompt_tokens"] = prompt_tokens
+
+            if speech is not None:
+                speech.finish()
+                remaining = speech.remaining()
+                while True:
+                    segment = await asyncio.to_thread(next, remaining, None)
+                    if segment is None:
+                        break
+                    index, text, segment_audio = segment
+                    emit({"type": "audio", "index": index, "text": text, "audio": segment_audio})
+                metrics["first_audio"] = speech.first_audio
+
+            # Remember standalone answers (and their audio) for later equivalent questions
+            if self.answer_cache is not None:
+                entry = cached
+                if cached is None and not follow_up and answer:
+                    entry = self.answer_cache.put(
+                        query_vector, context_ids, model_key, answer, reasoning,
+                        generation_seconds=metrics.get("total") or 0.0
+                    )
+                if entry is not None and speech is not None and speech.segments \
+                        and all(segment_audio for _, segment_audio in speech.segments):
+                    self.answer_cache.attach_audio(entry, voice, [segment_audio for _, segment_audio in speech.segments])
+
+            metrics["overlap"] = trace.overlap()
+            metrics["turn_seconds"] = time.perf_counter() - trace.origin
+            self._observe_stages({"turn": metrics["turn_seconds"]})
+            outcome = "cached" if cached is not None else "ok"
+            emit({"type": "done", "answer": answer, "reasoning": reasoning, "metrics": metrics,
+                  "spans": trace.spans(), "state": state})
+        except asyncio.CancelledError:
+            logger.info("Turn cancelled")
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            logger.error(f"Turn failed: {str(e)}", exc_info=True)
+            emit({"type": "error", "message": str(e)})
+        finally:
+            for task in background:
+                task.cancel()
+            if speech is not None:
+                speech.close(cancel=True)
+            if self.registry is not None:
+                record_trace(trace, self.registry)
+                self.registry.increment("chatbot_turns_total", outcome=outcome)
+
+    def _observe_stages(self, durations):
+        if self.registry is None:
+            return
+        for stage, seconds in durations.items():
+            if seconds is not None:
+                self.registry.observe("chatbot_stage_seconds", seconds, stage=stage)
+
+    def _traced_synthesize(self, trace, voice):
+        counter = itertools.count()
+
+        def synthesize(text):
+            with trace.span(f"tts {next(counter)}", chars=len(text)):
+                return self.synthesize(text, voice)
+        return synthesize
+
+    async def _generate(self, messages, emit, speech, trace, temperature=None):
+        """Stream the answer, keeping the <think> section apart; returns (answer, reasoning, metrics)"""
+        splitter = ThinkSplitter()
+        stats = StreamStats()
+        parts = {"think": "", "answer": ""}
+        options = {} if temperature is None else {"temperature": temperature}
+
+        def deliver(channel, text):
+            parts[channel] += text
+            emit({"type": "token", "channel": channel, "text": text})
+            if speech is not None and channel == "answer":
+                speech.feed(text)
+
+        with trace.span("generate"):
+            try:
+                async for chunk in self.chat_model.astream(messages, **options):
+                    stats.on_chunk(chunk)
+                    for channel, text in splitter.feed(chunk.content):
+                        deliver(channel, text)
+                    if speech is not None:
+                        for index, text, segment_audio in speech.ready():
+                            emit({"type": "audio", "index": index, "text": text, "audio": segment_audio})
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keep whatever arrived before the stream broke
+                logger.error(f"Streaming error: {str(e)}", exc_info=True)
+                emit({"type": "error", "message": f"Streaming error: {str(e)}"})
+            for channel, text in splitter.flush():
+                deliver(channel, text)
+            stats.finish()
+
+        metrics = stats.as_dict()
+        logger.debug(f"Generation metrics: {metrics}")
+        return parts["answer"].strip(), parts["think"].strip(), metrics
+
+
+def event_to_json(event):
+    """JSON-ready copy of an event; audio bytes become base64 strings"""
+    if event.get("audio") is not None:
+        return {**event, "audio": base64.b64encode(event["audio"]).decode("ascii")}
+    return event
+
+
+def event_from_json(event):
+    if event.get("audio") is not None:
+        return {**event, "audio": base64.b64decode(event["audio"])}
+    return event
+
+
+class LoopThread:
+    """An asyncio event loop in a daemon thread, for callers that are not async themselves"""
+
+    def __init__(self, name="turn-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+class TurnHandle:
+    """Synchronous side of a turn running on a LoopThread: iterate its events, or cancel it"""
+
+    def __init__(self, loop_thread, pipeline, **turn):
+        self._events = queue.Queue()
+        self._future = loop_thread.submit(pipeline.run(self._events.put, **turn))
+        self._future.add_done_callback(lambda _: self._events.put(None))
+
+    def events(self):
+        """Block for each event until the turn ends, is cancelled or fails"""
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            yield event
+
+    def cancel(self):
+        """Stop the turn; a no-op once it has finished"""
+        self._future.cancel()
+
+    @property
+    def done(self):
+        return self._future.done()
@@ -0,0 +1,189 @@
+"""Versioned on-disk snapshots of the embedding table for zero-copy cold starts.
+
+A snapshot is a directory holding::
+
+    embeddings.npy        L2-normalized float32 matrix, opened with mmap_mode="r"
+    contents.bin          UTF-8 "pageContent" values back to back
+    contents_offsets.npy  int64 byte offsets into contents.bin (rows + 1)
+    ids.bin / ids_offsets.npy
+    manifest.json         format version, dims, rows and the source table's
+                          row count / max id at export time
+
+Every worker process that maps the same snapshot shares one copy in the OS
+page cache. ``LATEST`` in the snapshot root names the newest complete export.
+"""
+import json
+import logging
+import os
+import shutil
+import time
+from collections import namedtuple
+
+import numpy as np
+from sqlalchemy import text
+
+from vector_store import EMBEDDING_TABLE, COLLECTION_TABLE
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+LATEST_POINTER = "LATEST"
+
+Snapshot = namedtuple("Snapshot", ["path", "manifest", "matrix", "contents", "ids"])
+
+
+class StringTable:
+    """Read-only sequence of strings backed by a memory-mapped blob and an offsets array"""
+
+    def __init__(self, data, offsets):
+        self._data = data
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return bytes(self._data[start:end]).decode("utf-8")
+
+
+def write_string_table(prefix, values):
+    encoded = [str(v).encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    with open(f"{prefix}.bin", "wb") as f:
+        for e in encoded:
+            f.write(e)
+    np.save(f"{prefix}_offsets.npy", offsets)
+
+
+def read_string_table(prefix):
+    offsets = np.load(f"{prefix}_offsets.npy", mmap_mode="r")
+    # np.memmap refuses empty files
+    if offsets[-1] == 0:
+        return StringTable(b"", offsets)
+    return StringTable(np.memmap(f"{prefix}.bin", dtype=np.uint8, mode="r"), offsets)
+
+
+def source_state(engine, collection=None):
+    """Row count and max id of the (optionally collection-scoped) embedding table"""
+    where = ""
+    params = {}
+    if collection:
+        where = f"WHERE collection_id = (SELECT uuid FROM {COLLECTION_TABLE} WHERE name = :collection)"
+        params["collection"] = collection
+    with engine.connect() as conn:
+        row_count = conn.execute(text(f"SELECT count(*) FROM {EMBEDDING_TABLE} {where}"), params).scalar()
+        # ORDER BY ... LIMIT 1 works for any orderable id type (max() has no uuid variant)
+        max_id = conn.execute(text(f"SELECT id FROM {EMBEDDING_TABLE} {where} ORDER BY id DESC LIMIT 1"),
+                              params).scalar()
+    return int(row_count or 0), _jsonable_id(max_id)
+
+
+def _jsonable_id(value):
+    if value is None or isinstance(value, (int, str)):
+        return value
+    return str(value)
+
+
+def write_snapshot(root, matrix, contents, ids, source_rows, source_max_id, collection=None):
+    """Write a new snapshot directory under root and point LATEST at it"""
+    os.makedirs(root, exist_ok=True)
+    name = f"snapshot-{time.strftime('%Y%m%dT%H%M%S')}-{len(matrix)}"
+    final_path = os.path.join(root, name)
+    tmp_path = final_path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    np.save(os.path.join(tmp_path, "embeddings.npy"), np.ascontiguousarray(matrix, dtype=np.float32))
+    write_string_table(os.path.join(tmp_path, "contents"), contents)
+    write_string_table(os.path.join(tmp_path, "ids"), ids)
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "created_at": time.time(),
+        "rows": int(len(matrix)),
+        "dims": int(matrix.shape[1]) if len(matrix) else 0,
+        "dtype": "float32",
+        "normalized": True,
+        "collection": collection,
+        "source_rows": int(source_rows),
+        "source_max_id": _jsonable_id(source_max_id),
+    }
+    with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    # Publish atomically: readers only ever see complete snapshot directories
+    os.replace(tmp_path, final_path)
+    pointer_tmp = os.path.join(root, LATEST_POINTER + ".tmp")
+    with open(pointer_tmp, "w") as f:
+        f.write(name)
+    os.replace(pointer_tmp, os.path.join(root, LATEST_POINTER))
+
+    logger.info(f"Wrote snapshot {final_path} ({manifest['rows']} rows)")
+    return final_path
+
+
+def resolve_snapshot(path):
+    """Accept either a snapshot directory or a root containing a LATEST pointer"""
+    pointer = os.path.join(path, LATEST_POINTER)
+    if os.path.exists(pointer):
+        with open(pointer) as f:
+            return os.path.join(path, f.read().strip())
+    return path
+
+
+def open_snapshot(path):
+    """Memory-map a snapshot without copying the matrix or the contents"""
+    path = resolve_snapshot(path)
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format {manifest.get('format_version')} in {path}")
+
+    matrix = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+    contents = read_string_table(os.path.join(path, "contents"))
+    ids = read_string_table(os.path.join(path, "ids"))
+    logger.info(f"Mapped snapshot {path} ({manifest['rows']} rows)")
+    return Snapshot(path, manifest, matrix, contents, ids)
+
+
+def snapshot_freshness(manifest, row_count, max_id):
+    """Compare a manifest with the live table.
+
+    Returns "fresh" when nothing changed, "behind" when rows were only added
+    (a watermark refresh tops the snapshot up) and "diverged" when rows were
+    deleted or rewritten and the snapshot must be rebuilt.
+    """
+    if row_count == manifest["source_rows"] and max_id == manifest["source_max_id"]:
+        return "fresh"
+    if row_count > manifest["source_rows"] and max_id != manifest["source_max_id"]:
+        return "behind"
+    return "diverged"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from db import create_db_engine
+    from embedding_store import EmbeddingStore
+
+    arg_parser = argparse.ArgumentParser(description="Export the embedding table to a binary snapshot")
+    arg_parser.add_argument("root", help="Snapshot root directory (LATEST is updated)")
+    arg_parser.add_argument("--dsn", default=None,
+                            help="SQLAlchemy connection string (defaults to $POSTGRES_CONNECTION)")
+    arg_parser.add_argument("--collection", default=os.getenv("PGVECTOR_COLLECTION"))
+    arg_parser.add_argument("--text", action="store_true",
+                            help="Parse the text form instead of vector_send() (no pgvector)")
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db_engine = create_db_engine(args.dsn)
+    store = EmbeddingStore(db_engine, collection=args.collection, binary=not args.text)
+    if os.path.exists(os.path.join(args.root, LATEST_POINTER)):
+        # Start from the previous export so only new rows are read from Postgres
+        store.attach_snapshot(open_snapshot(args.root))
+    store.refresh()
+    store.export_snapshot(args.root)
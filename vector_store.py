@@ -0,0 +1,216 @@
+"""Server-side nearest-neighbour search over langchain_pg_embedding using pgvector"""
+import logging
+import math
+
+import numpy as np
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_TABLE = "langchain_pg_embedding"
+COLLECTION_TABLE = "langchain_pg_collection"
+# nomic-embed-text produces 768-dimensional vectors
+EMBEDDING_DIM = 768
+# JSON metadata column: "metadata" in the langchain.js schema, "cmetadata" in langchain's PGVector
+METADATA_COLUMNS = ("metadata", "cmetadata")
+
+
+def describe_embedding_column(engine):
+    """Inspect the embedding column and report what the database can do with it"""
+    info = {
+        "extension": False,
+        "column_type": None,
+        "dims": None,
+        "has_collection": False,
+        "metadata_column": None,
+        "id_type": None,
+        "id_default": None,
+    }
+    with engine.connect() as conn:
+        info["extension"] = conn.execute(text(
+            "SELECT 1 FROM pg_extension WHERE extname = 'vector'"
+        )).scalar() is not None
+
+        info["column_type"] = conn.execute(text(f"""
+            SELECT format_type(atttypid, atttypmod)
+            FROM pg_attribute
+            WHERE attrelid = '{EMBEDDING_TABLE}'::regclass
+              AND attname = 'embedding'
+              AND NOT attisdropped
+        """)).scalar()
+
+        info["has_collection"] = conn.execute(text(f"""
+            SELECT 1
+            FROM pg_attribute
+            WHERE attrelid = '{EMBEDDING_TABLE}'::regclass
+              AND attname = 'collection_id'
+              AND NOT attisdropped
+        """)).scalar() is not None
+
+        columns = {
+            row[0]: row[1:]
+            for row in conn.execute(text(f"""
+                SELECT attname, format_type(atttypid, atttypmod),
+                       CASE WHEN attidentity <> '' THEN 'identity' ELSE pg_get_expr(adbin, adrelid) END
+                FROM pg_attribute
+                LEFT JOIN pg_attrdef ON adrelid = attrelid AND adnum = attnum
+                WHERE attrelid = '{EMBEDDING_TABLE}'::regclass
+                  AND attnum > 0
+                  AND NOT attisdropped
+            """))
+        }
+    info["metadata_column"] = next((name for name in METADATA_COLUMNS if name in columns), None)
+    info["id_type"], info["id_default"] = columns.get("id", (None, None))
+
+    column_type = info["column_type"] or ""
+    if column_type.startswith("vector(") and column_type.endswith(")"):
+        info["dims"] = int(column_type[len("vector("):-1])
+
+    logger.debug(f"Embedding column: {info}")
+    return info
+
+
+def supports_vector_search(info):
+    """True when top-k can be pushed down to Postgres with the <=> operator"""
+    return bool(info["extension"]) and (info["column_type"] or "").startswith("vector")
+
+
+def _embedding_expr(info, dims=EMBEDDING_DIM):
+    """Column expression used for both the index and the ORDER BY.
+
+    HNSW/IVFFlat need a fixed dimension, so an untyped ``vector`` column is
+    indexed through a cast. The query must use the very same expression or the
+    planner will not pick the index.
+    """
+    if info["dims"]:
+        return "embedding"
+    return f"(embedding::vector({dims}))"
+
+
+def decode_vector_send(payloads):
+    """Decode a batch of pgvector binary payloads (vector_send) into a float32 matrix.
+
+    Each payload is a big-endian int16 dimension, an unused int16 and then
+    ``dim`` big-endian float4 values, so equal-length rows can be viewed in one go.
+    """
+    if not payloads:
+        return np.empty((0, 0), dtype=np.float32)
+    row_bytes = len(payloads[0])
+    raw = np.frombuffer(b"".join(bytes(p) for p in payloads), dtype=np.uint8)
+    raw = raw.reshape(len(payloads), row_bytes)[:, 4:]
+    return raw.copy().view(">f4").astype(np.float32)
+
+
+def to_vector_literal(embedding):
+    """Render an embedding as a pgvector text literal"""
+    return "[" + ",".join(repr(float(x)) for x in embedding) + "]"
+
+
+def pgvector_search(engine, info, query_embedding, top_k=5, collection=None,
+                    ef_search=None, probes=None, with_vectors=False):
+    """Return the top_k (similarity, content) pairs ranked by cosine distance in Postgres.
+
+    With ``with_vectors`` each result also carries its float32 embedding,
+    e.g. for MMR re-selection.
+    """
+    expr = _embedding_expr(info, len(query_embedding))
+    params = {"query": to_vector_literal(query_embedding), "top_k": int(top_k)}
+
+    where = ""
+    if collection and info["has_collection"]:
+        where = f"""WHERE collection_id = (
+                SELECT uuid FROM {COLLECTION_TABLE} WHERE name = :collection
+            )"""
+        params["collection"] = collection
+
+    # engine.begin() keeps the set_config(..., true) calls local to this query
+    with engine.begin() as conn:
+        if ef_search:
+            conn.execute(text("SELECT set_config('hnsw.ef_search', :value, true)"),
+                         {"value": str(int(ef_search))})
+        if probes:
+            conn.execute(text("SELECT set_config('ivfflat.probes', :value, true)"),
+                         {"value": str(int(probes))})
+
+        results = conn.execute(text(f"""
+            SELECT "pageContent",
+                   1 - ({expr} <=> CAST(:query AS vector)) AS similarity
+                   {", vector_send(embedding)" if with_vectors else ""}
+            FROM {EMBEDDING_TABLE}
+            {where}
+            ORDER BY {expr} <=> CAST(:query AS vector)
+            LIMIT :top_k
+        """), params).fetchall()
+
+    if with_vectors:
+        vectors = decode_vector_send([row[2] for row in results])
+        return [(float(row[1]), row[0], vector) for row, vector in zip(results, vectors)]
+    return [(float(row[1]), row[0]) for row in results]
+
+
+def index_name(method):
+    return f"{EMBEDDING_TABLE}_embedding_{method}_idx"
+
+
+def ensure_vector_index(engine, info, method="hnsw", rebuild=False, m=16,
+                        ef_construction=64, lists=None, dims=EMBEDDING_DIM):
+    """Create (or rebuild) the cosine ANN index used by pgvector_search.
+
+    ``method`` is ``"hnsw"`` or ``"ivfflat"``. For IVFFlat, ``lists`` defaults to
+    rows / 1000 up to a million rows and sqrt(rows) beyond that, as recommended
+    by pgvector. The index is built CONCURRENTLY so searches keep running.
+    """
+    if method not in ("hnsw", "ivfflat"):
+        raise ValueError(f"Unknown index method: {method}")
+    if not supports_vector_search(info):
+        raise RuntimeError("pgvector extension or vector column not available")
+
+    name = index_name(method)
+    expr = _embedding_expr(info, dims)
+
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if method == "hnsw":
+            options = f"m = {int(m)}, ef_construction = {int(ef_construction)}"
+        else:
+            if lists is None:
+                rows = conn.execute(text(f"SELECT count(*) FROM {EMBEDDING_TABLE}")).scalar() or 0
+                lists = max(1, rows // 1000) if rows <= 1_000_000 else int(math.sqrt(rows))
+            options = f"lists = {int(lists)}"
+
+        if rebuild:
+            logger.info(f"Dropping vector index {name}")
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+        logger.info(f"Building vector index {name} ({options})")
+        conn.execute(text(f"""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS {name}
+            ON {EMBEDDING_TABLE}
+            USING {method} ({expr} vector_cosine_ops)
+            WITH ({options})
+        """))
+        conn.execute(text(f"ANALYZE {EMBEDDING_TABLE}"))
+
+    return name
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from db import create_db_engine
+
+    arg_parser = argparse.ArgumentParser(description="Manage the pgvector ANN index")
+    arg_parser.add_argument("method", choices=["hnsw", "ivfflat"])
+    arg_parser.add_argument("--dsn", default=None,
+                            help="SQLAlchemy connection string (defaults to $POSTGRES_CONNECTION)")
+    arg_parser.add_argument("--rebuild", action="store_true", help="Drop and recreate the index")
+    arg_parser.add_argument("--m", type=int, default=16)
+    arg_parser.add_argument("--ef-construction", type=int, default=64)
+    arg_parser.add_argument("--lists", type=int, default=None)
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db_engine = create_db_engine(args.dsn)
+    column_info = describe_embedding_column(db_engine)
+    ensure_vector_index(db_engine, column_info, method=args.method, rebuild=args.rebuild,
+                        m=args.m, ef_construction=args.ef_construction, lists=args.lists)